@@ -0,0 +1,388 @@
+"""
+Asyncio crawl engine for Shopify products.json endpoints.
+
+The threaded crawler in fetch_products_json.py only ever keeps a couple of domains
+in flight and opens a new connection for every page. This engine runs the same
+crawl on a single event loop:
+
+- thousands of domains are processed concurrently by a fixed pool of workers
+- pages are fetched over pooled keep-alive connections (HTTP/2 when the host
+  negotiates it and the `h2` package is installed)
+- politeness is enforced per host rather than through one global semaphore:
+  a concurrency cap per host plus the adaptive per-domain/per-IP token buckets
+  of rate_limiter.py
+- a throttled (429) domain is parked with its pagination progress and re-queued
+  once its Retry-After has passed, instead of sleeping inside a worker
+- with `fan_out_pages`, a large catalogue is fetched with up to `per_host`
+  concurrent page requests, so one giant store does not set the length of the run
+
+Persistence stays synchronous (ProductSink, the write-behind queue in front of the
+database writer) and runs on a small dedicated thread pool so it never blocks the
+event loop or the resolver threads.
+CrawlState journal writes are short local SQLite commits and run inline.
+"""
+
+import asyncio
+import importlib.util
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+from crawl_state import DomainState, DONE, catalogue_unchanged, max_updated_at
+import product_codec
+from pagination import PAGE, DomainJob, Paginator, catalogue_size, fan_out_plan, page_query
+from rate_limiter import AdaptiveRateLimiter, Throttled
+from write_behind import persist_callback
+
+
+class HostLimiter:
+    """Caps the number of concurrent requests sent to any single host."""
+
+    def __init__(self, per_host: int = 2) -> None:
+        self.per_host = per_host
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def for_host(self, host: str) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.per_host)
+            self._semaphores[host] = semaphore
+        return semaphore
+
+
+class AsyncCrawler:
+    """Crawls products.json for many domains concurrently on one event loop."""
+
+    def __init__(
+        self,
+        stats: Any,
+        writer: Any,
+        headers: Dict[str, str],
+        endpoints: Sequence[str],
+        sink: Optional[Any] = None,
+        state: Optional[Any] = None,
+        cache: Optional[Any] = None,
+        write_queue: Optional[Any] = None,
+        limiter: Optional[AdaptiveRateLimiter] = None,
+        per_page: int = 250,
+        concurrency: int = 1000,
+        per_host: int = 2,
+        timeout: float = 10.0,
+        persist_workers: int = 4,
+        max_throttles: int = 6,
+        fan_out_pages: int = 0,
+    ) -> None:
+        self.stats = stats
+        self.writer = writer
+        self.headers = headers
+        self.endpoints = list(endpoints)
+        self.sink = sink
+        self.state = state
+        self.cache = cache
+        self.write_queue = write_queue
+        self.per_page = per_page
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.host_limiter = HostLimiter(per_host)
+        self.limiter = limiter or AdaptiveRateLimiter()
+        self.max_throttles = max_throttles
+        self.fan_out_pages = fan_out_pages
+        self._outstanding: int = 0
+        self._finished: Optional[asyncio.Event] = None
+        self.persist_executor = ThreadPoolExecutor(
+            max_workers=persist_workers, thread_name_prefix="persist")
+        self.client: Optional[httpx.AsyncClient] = None
+
+    def _make_client(self) -> httpx.AsyncClient:
+        # Every domain is its own host, so the pool mostly serves keep-alive reuse
+        # across the pages of one store; size it to the number of domains in flight.
+        limits = httpx.Limits(
+            max_connections=self.concurrency * self.host_limiter.per_host,
+            max_keepalive_connections=self.concurrency,
+            keepalive_expiry=30.0,
+        )
+        return httpx.AsyncClient(
+            headers=self.headers,
+            http2=importlib.util.find_spec("h2") is not None,
+            limits=limits,
+            timeout=self.timeout,
+            follow_redirects=True,
+        )
+
+    async def fetch_page(self, domain: str, url: str,
+                         conditional_headers: Optional[Dict[str, str]] = None) -> Tuple[bytes, httpx.Headers]:
+        """Async counterpart of fetch_products_json._fetch_page.
+
+        A 304 reuses the cached page. A 429 is reported to the rate limiter and
+        surfaces as Throttled so the scheduler can re-queue the domain instead of
+        sleeping in the worker.
+        """
+        assert self.client is not None
+        request_headers: Optional[Dict[str, str]] = None
+        if self.cache is not None:
+            request_headers = self.cache.conditional_headers(url) or conditional_headers or None
+
+        await self.limiter.acquire(domain)
+        async with self.host_limiter.for_host(domain):
+            response = await self.client.get(url, headers=request_headers)
+        if response.status_code == 304:
+            self.limiter.record_success(domain)
+            body = await asyncio.to_thread(self.cache.load, url) if self.cache is not None else None
+            if body is not None:
+                return body, response.headers
+            # Cached body vanished (evicted) or was never stored; fetch it unconditionally
+            await self.limiter.acquire(domain)
+            async with self.host_limiter.for_host(domain):
+                response = await self.client.get(url)
+        if response.status_code == 429:
+            delay = self.limiter.record_throttle(domain, response.headers.get("Retry-After"))
+            raise Throttled(domain, delay)
+        response.raise_for_status()
+        self.limiter.record_success(domain)
+
+        if self.cache is not None:
+            await asyncio.to_thread(
+                self.cache.store, url, response.content,
+                response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        return response.content, response.headers
+
+    async def fetch_catalogue_size(self, domain: str) -> Optional[int]:
+        """Published product count from /meta.json, or None if the store does not report it."""
+        assert self.client is not None
+        await self.limiter.acquire(domain)
+        async with self.host_limiter.for_host(domain):
+            response = await self.client.get(f"https://{domain}/meta.json")
+        if response.status_code == 429:
+            raise Throttled(domain, self.limiter.record_throttle(domain, response.headers.get("Retry-After")))
+        if not response.is_success:
+            return None
+        self.limiter.record_success(domain)
+        try:
+            return catalogue_size(product_codec.loads(response.content))
+        except ValueError:
+            return None
+
+    async def fetch_page_range(self, job: DomainJob, endpoint_path: str,
+                               first_page: int, last_page: int) -> List[List[Dict[str, Any]]]:
+        """Fetch pages `first_page`..`last_page`, `per_host` at a time; returns them in page order.
+
+        Pages that arrived before a throttle stay on `job`, so a resumed fan-out only
+        asks for the missing ones.
+        """
+        domain = job.domain
+        pending = [page for page in range(first_page, last_page + 1) if page not in job.pages]
+
+        async def worker() -> None:
+            while pending:
+                page = pending.pop(0)
+                try:
+                    url = f"https://{domain}{endpoint_path}?{page_query(page, self.per_page)}"
+                    body, _ = await self.fetch_page(domain, url)
+                    job.pages[page] = product_codec.decode_products(body)
+                except BaseException:
+                    pending.clear()
+                    raise
+
+        workers = min(self.host_limiter.per_host, len(pending))
+        results = await asyncio.gather(*(worker() for _ in range(workers)), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return [job.pages.pop(page) for page in range(first_page, last_page + 1)]
+
+    async def fetch_all_pages_for_endpoint(self, job: DomainJob, endpoint_path: str,
+                                           conditional_headers: Optional[Dict[str, str]] = None) -> List[Dict[str, Any]]:
+        """Async counterpart of fetch_products_json.fetch_all_pages_for_endpoint.
+
+        The Paginator lives on `job`, so a throttled domain resumes at the page (or
+        since_id cursor) it was stopped on when the scheduler hands it out again.
+        """
+        domain = job.domain
+        previous = job.previous.pagination if job.previous is not None else None
+        product_count = job.previous.product_count if job.previous is not None else None
+        if job.pager is None:
+            large = fan_out_plan(product_count, self.per_page, self.fan_out_pages) > 0
+            job.pager = Paginator(PAGE if large else previous, self.per_page)
+        pager = job.pager
+
+        while True:
+            if self.fan_out_pages and pager.requests == 1:
+                if job.catalogue_size is None:
+                    job.catalogue_size = product_count or await self.fetch_catalogue_size(domain) or 0
+                pages = fan_out_plan(job.catalogue_size, self.per_page, self.fan_out_pages)
+                if pages:
+                    first_page = pager.switch_to_pages()
+                    more = pager.take_pages(await self.fetch_page_range(job, endpoint_path, first_page, pages))
+                    if self.state is not None:
+                        self.state.record_page(domain, endpoint_path, pager.requests)
+                    if not more:
+                        break
+
+            url = f"https://{domain}{endpoint_path}?{pager.query()}"
+            first = pager.first
+            body, response_headers = await self.fetch_page(
+                domain, url, conditional_headers if first else None)
+            if first and self.state is not None:
+                self.state.record_validators(
+                    domain, response_headers.get("ETag"), response_headers.get("Last-Modified"))
+            products: List[Dict[str, Any]] = product_codec.decode_products(body)
+
+            more = pager.advance(products)
+            if products and self.state is not None:
+                self.state.record_page(domain, endpoint_path, pager.requests)
+            if not more:
+                break
+
+        if self.state is not None and pager.detected is not None and pager.detected != previous:
+            self.state.record_pagination(domain, pager.detected)
+        return pager.products
+
+    async def _persist(self, func, *args) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.persist_executor, func, *args)
+
+    def _ordered_endpoints(self, previous: Optional[DomainState]) -> List[str]:
+        if previous is None or previous.endpoint not in self.endpoints:
+            return list(self.endpoints)
+        return [previous.endpoint] + [e for e in self.endpoints if e != previous.endpoint]
+
+    async def fetch_domain_products(self, job: DomainJob) -> Optional[float]:
+        """Fetch and persist all products of one domain, mirroring the threaded crawler.
+
+        Returns the delay after which a throttled domain should be retried, or None
+        once the domain is finished (successfully or not).
+        """
+        domain = job.domain
+        try:
+            if not job.started:
+                if self.state is not None:
+                    job.previous = self.state.get(domain)
+                    self.state.mark_started(domain)
+                job.started = True
+
+            previous = job.previous
+            # Only a completed earlier crawl has validators worth revalidating against
+            recrawl = previous is not None and previous.status == DONE
+            all_domain_products: List[Dict[str, Any]] = []
+            endpoints = self._ordered_endpoints(previous)
+
+            while job.endpoint_index < len(endpoints):
+                endpoint = endpoints[job.endpoint_index]
+                try:
+                    products_for_endpoint = await self.fetch_all_pages_for_endpoint(
+                        job, endpoint,
+                        previous.conditional_headers() if recrawl and endpoint == previous.endpoint else None,
+                    )
+                    job.answered = True
+                    if products_for_endpoint:
+                        all_domain_products = products_for_endpoint
+                        break
+                except Throttled:
+                    raise
+                except httpx.HTTPStatusError as http_err:
+                    status_code = http_err.response.status_code
+                    if status_code == 401:
+                        print(f"Skipping {domain}: Authentication required")
+                        job.answered = True
+                        break
+                    elif status_code not in (404, 400):
+                        raise
+                    job.answered = True
+                except Exception as e:
+                    # Try next endpoint on generic errors
+                    job.last_error = e
+                job.next_endpoint()
+
+            if not job.answered and job.last_error is not None:
+                # Every endpoint failed (unreachable, timed out): a failure, not an empty store
+                raise job.last_error
+
+            if self.state is not None and catalogue_unchanged(previous, all_domain_products):
+                self.stats.add_unchanged(domain)
+                self.state.mark_done(domain, previous.product_count, previous.max_updated_at)
+                return None
+
+            for product in all_domain_products:
+                product["domain"] = domain
+
+            self.stats.add_products(all_domain_products, domain)
+            if self.sink is not None:
+                await self._persist(self.sink.write_domain, domain, all_domain_products)
+
+            if self.write_queue is not None:
+                # May block on backpressure, so it runs off the event loop like the sink
+                await self._persist(
+                    self.write_queue.submit, domain, all_domain_products,
+                    persist_callback(domain, all_domain_products, self.state, self.writer))
+            elif self.state is not None:
+                self.state.mark_done(domain, len(all_domain_products), max_updated_at(all_domain_products))
+
+        except Throttled as throttled:
+            job.throttles += throttled.rate_limited
+            if job.throttles <= self.max_throttles:
+                print(f"Rate limited for {domain}, re-queueing in {throttled.delay:.1f}s")
+                return throttled.delay
+            await self._record_failure(domain, f"Rate limited {job.throttles} times, giving up")
+        except httpx.HTTPError as e:
+            await self._record_failure(domain, f"Request failed: {str(e)}")
+        except json.JSONDecodeError as e:
+            await self._record_failure(domain, f"Invalid JSON: {str(e)}")
+        except Exception as e:
+            await self._record_failure(domain, f"Unexpected error: {str(e)}")
+        return None
+
+    async def _record_failure(self, domain: str, error_msg: str) -> None:
+        self.stats.add_failed_domain(domain, error_msg)
+        if self.state is not None:
+            self.state.mark_failed(domain, error_msg)
+        if self.writer.is_enabled():
+            await self._persist(self.writer.upsert_domain, domain, [], error_msg)
+
+    async def _worker(self, queue: "asyncio.Queue[DomainJob]") -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await queue.get()
+            retry_in: Optional[float] = None
+            try:
+                retry_in = await self.fetch_domain_products(job)
+            finally:
+                if retry_in is not None:
+                    # Park the job off-queue; the worker moves straight on to another domain
+                    loop.call_later(retry_in, queue.put_nowait, job)
+                else:
+                    self._outstanding -= 1
+                    if self._outstanding == 0:
+                        self._finished.set()
+
+    async def crawl(self, domains: Sequence[str]) -> None:
+        if not domains:
+            return
+        queue: "asyncio.Queue[DomainJob]" = asyncio.Queue()
+        for domain in domains:
+            queue.put_nowait(DomainJob(domain))
+        # Throttled jobs leave the queue while they wait, so completion is tracked
+        # by counting finished domains rather than with queue.join()
+        self._outstanding = len(domains)
+        self._finished = asyncio.Event()
+
+        async with self._make_client() as client:
+            self.client = client
+            workers = [
+                asyncio.create_task(self._worker(queue))
+                for _ in range(min(self.concurrency, len(domains)))
+            ]
+            try:
+                await self._finished.wait()
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                self.client = None
+
+    def run(self, domains: Sequence[str]) -> None:
+        try:
+            asyncio.run(self.crawl(domains))
+        finally:
+            self.persist_executor.shutdown(wait=True)
@@ -0,0 +1,261 @@
+"""
+Asyncio engine for scrape_domain_metadata.py.
+
+The serial scraper sleeps 0.5-2s before every homepage and handles one domain at a
+time, so a full domain list spends most of a day sleeping. This engine keeps many
+domains in flight on one event loop instead:
+
+- homepages are fetched over pooled keep-alive connections
+- politeness is per host (a concurrency cap per host plus the adaptive per-domain
+  and per-IP token buckets of rate_limiter.py); a 429 parks the domain until its
+  Retry-After has passed instead of blocking a worker
+- HTML is parsed on a small thread pool by the scraper's own single-pass
+  extraction (html_metadata.py), so both modes produce identical `domains` rows
+- rows are upserted in batches on a dedicated persistence thread
+
+With the scraper's `lightweight` source the engine asks /meta.json, the homepage
+head and /cart.js first (storefront_metadata.py) and downloads the full homepage
+only when they do not identify the shop.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, UTC
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+import storefront_metadata
+from async_crawler import HostLimiter
+from rate_limiter import AdaptiveRateLimiter, Throttled
+
+
+@dataclass
+class MetadataJob:
+    domain: str
+    attempts: int = 0
+    throttles: int = 0
+
+
+class AsyncMetadataScraper:
+    """Scrapes homepage metadata for many domains concurrently."""
+
+    def __init__(
+        self,
+        scraper: Any,
+        concurrency: int = 200,
+        per_host: int = 1,
+        timeout: float = 15.0,
+        batch_size: int = 500,
+        limiter: Optional[AdaptiveRateLimiter] = None,
+        max_attempts: int = 3,
+        max_throttles: int = 6,
+        parse_workers: int = 4,
+    ) -> None:
+        self.scraper = scraper
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.host_limiter = HostLimiter(per_host)
+        self.limiter = limiter or AdaptiveRateLimiter()
+        self.max_attempts = max_attempts
+        self.max_throttles = max_throttles
+        self.parse_executor = ThreadPoolExecutor(max_workers=parse_workers, thread_name_prefix="parse")
+        # One persistence thread keeps upserts ordered and off the event loop
+        self.persist_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="persist")
+        self.client: Optional[httpx.AsyncClient] = None
+        self.written: int = 0
+        self.fetched_bytes: int = 0
+        self.fetch_failures: int = 0
+        self._pending: List[Dict[str, Any]] = []
+        self._flushes: List["asyncio.Future[int]"] = []
+        self._outstanding: int = 0
+        self._finished: Optional[asyncio.Event] = None
+
+    def _make_client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=self.concurrency * self.host_limiter.per_host,
+            max_keepalive_connections=self.concurrency,
+            keepalive_expiry=30.0,
+        )
+        return httpx.AsyncClient(
+            headers=dict(self.scraper.session.headers),
+            limits=limits,
+            timeout=self.timeout,
+            follow_redirects=True,
+        )
+
+    def _check(self, domain: str, response: httpx.Response) -> None:
+        if response.status_code == 429:
+            delay = self.limiter.record_throttle(domain, response.headers.get("Retry-After"))
+            raise Throttled(domain, delay)
+        response.raise_for_status()
+        self.limiter.record_success(domain)
+
+    async def fetch_homepage(self, domain: str) -> str:
+        assert self.client is not None
+        await self.limiter.acquire(domain)
+        async with self.host_limiter.for_host(domain):
+            response = await self.client.get(f"https://{domain}/")
+        self._check(domain, response)
+        self.fetched_bytes += len(response.content)
+        return response.text
+
+    async def fetch_json(self, domain: str, path: str) -> Tuple[Optional[Any], int]:
+        """A JSON endpoint, or None if the store does not serve it."""
+        assert self.client is not None
+        await self.limiter.acquire(domain)
+        async with self.host_limiter.for_host(domain):
+            response = await self.client.get(f"https://{domain}{path}", headers={"Accept": "application/json"})
+        try:
+            self._check(domain, response)
+            data = response.json()
+        except (httpx.HTTPStatusError, ValueError):
+            return None, 0
+        self.fetched_bytes += len(response.content)
+        return data, len(response.content)
+
+    async def fetch_head(self, domain: str) -> Tuple[Optional[str], int]:
+        """The homepage up to </head>; the rest of the body is never downloaded."""
+        assert self.client is not None
+        await self.limiter.acquire(domain)
+        async with self.host_limiter.for_host(domain):
+            async with self.client.stream("GET", f"https://{domain}/") as response:
+                try:
+                    self._check(domain, response)
+                except httpx.HTTPStatusError:
+                    return None, 0
+                reader = storefront_metadata.HeadReader()
+                async for chunk in response.aiter_bytes():
+                    if reader.feed(chunk):
+                        break
+        self.fetched_bytes += len(reader.buffer)
+        return reader.text(response.encoding), len(reader.buffer)
+
+    async def scrape_lightweight(self, domain: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        """Async counterpart of DomainMetadataScraper.scrape_lightweight."""
+        loop = asyncio.get_running_loop()
+        sources: List[str] = []
+
+        data, meta_bytes = await self.fetch_json(domain, "/meta.json")
+        meta_json = storefront_metadata.parse_meta_json(data)
+        if meta_json:
+            sources.append("meta.json")
+
+        head_html, head_bytes = await self.fetch_head(domain)
+        head: Dict[str, Any] = {}
+        if head_html:
+            head = await loop.run_in_executor(
+                self.parse_executor, storefront_metadata.parse_head, head_html, domain)
+            sources.append("head")
+
+        cart_currency, cart_bytes = None, 0
+        if storefront_metadata.needs_currency(meta_json):
+            data, cart_bytes = await self.fetch_json(domain, "/cart.js")
+            cart_currency = storefront_metadata.parse_cart_js(data)
+            if cart_currency:
+                sources.append("cart.js")
+
+        metadata.update(storefront_metadata.combine(domain, meta_json, head, cart_currency))
+        metadata['metadata_sources'] = sources
+        metadata['fetched_bytes'] = meta_bytes + head_bytes + cart_bytes
+        return metadata
+
+    async def scrape_domain(self, job: MetadataJob) -> Optional[float]:
+        """Scrape one domain and queue its row; returns a retry delay, or None when done."""
+        domain = job.domain
+        metadata: Dict[str, Any] = {
+            'domain': domain,
+            'scraped_at': datetime.now(UTC).isoformat(),
+        }
+        try:
+            lightweight = self.scraper.source == 'lightweight'
+            if lightweight:
+                await self.scrape_lightweight(domain, metadata)
+            if not lightweight or storefront_metadata.needs_html(metadata):
+                html = await self.fetch_homepage(domain)
+                metadata['metadata_sources'] = metadata.get('metadata_sources', []) + ['html']
+                metadata['fetched_bytes'] = metadata.get('fetched_bytes', 0) + len(html.encode('utf-8'))
+                loop = asyncio.get_running_loop()
+                metadata = await loop.run_in_executor(
+                    self.parse_executor, self.scraper.extract_metadata, domain, html, metadata)
+        except Throttled as throttled:
+            job.throttles += throttled.rate_limited
+            if job.throttles <= self.max_throttles:
+                return throttled.delay
+            metadata['error'] = f"Rate limited {job.throttles} times, giving up"
+        except httpx.HTTPError as e:
+            job.attempts += 1
+            # Server errors and dropped connections get the same retries as the serial scraper
+            retriable = not isinstance(e, httpx.HTTPStatusError) or e.response.status_code >= 500
+            if retriable and job.attempts < self.max_attempts:
+                return min(10.0, 2.0 ** job.attempts)
+            print(f"Error fetching https://{domain}/: {e}")
+            metadata['error'] = 'Failed to fetch homepage'
+        except Exception as e:
+            print(f"Error processing {domain}: {e}")
+            metadata['error'] = f"Unexpected error: {e}"
+
+        if 'error' in metadata:
+            self.fetch_failures += 1
+        self._pending.append(self.scraper.domain_record(domain, metadata))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        return None
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        loop = asyncio.get_running_loop()
+        self._flushes.append(loop.run_in_executor(self.persist_executor, self.scraper.upsert_domain_records, batch))
+
+    async def _worker(self, queue: "asyncio.Queue[MetadataJob]") -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await queue.get()
+            retry_in: Optional[float] = None
+            try:
+                retry_in = await self.scrape_domain(job)
+            finally:
+                if retry_in is not None:
+                    loop.call_later(retry_in, queue.put_nowait, job)
+                else:
+                    self._outstanding -= 1
+                    if self._outstanding == 0:
+                        self._finished.set()
+
+    async def scrape(self, domains: Sequence[str]) -> None:
+        if not domains:
+            return
+        queue: "asyncio.Queue[MetadataJob]" = asyncio.Queue()
+        for domain in domains:
+            queue.put_nowait(MetadataJob(domain))
+        self._outstanding = len(domains)
+        self._finished = asyncio.Event()
+
+        async with self._make_client() as client:
+            self.client = client
+            workers = [
+                asyncio.create_task(self._worker(queue))
+                for _ in range(min(self.concurrency, len(domains)))
+            ]
+            try:
+                await self._finished.wait()
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                self.client = None
+                self._flush()
+                self.written = sum(await asyncio.gather(*self._flushes))
+
+    def run(self, domains: Sequence[str]) -> None:
+        try:
+            asyncio.run(self.scrape(domains))
+        finally:
+            self.parse_executor.shutdown(wait=True)
+            self.persist_executor.shutdown(wait=True)
+        if self.fetch_failures:
+            print(f"{self.fetch_failures} domains could not be scraped (recorded with an error)")
@@ -0,0 +1,147 @@
+"""
+Content hashes of the product and image rows last written for each domain.
+
+Re-crawls fetch whole catalogues, but most products are byte-identical to what is
+already stored. Each row gets a stable hash of its content (everything except the
+`fetched_at` stamp; a product's hash also covers its variant and option rows), and a
+local SQLite index remembers the hashes of the last successful write per domain. Diffing a fresh crawl against it leaves only inserted
+and changed rows to upsert, plus the keys that disappeared from the store to delete.
+"""
+
+import hashlib
+import sqlite3
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Tuple
+
+import product_codec
+from product_rows import RowBatch
+
+PRODUCT = "product"
+IMAGE = "image"
+
+# (kind, product_id or image_id)
+HashKey = Tuple[str, int]
+
+
+def content_hash(row: Dict[str, Any]) -> str:
+    """Stable hash of a row's content, ignoring when it was fetched."""
+    content = {k: v for k, v in row.items() if k != "fetched_at"}
+    encoded = product_codec.dumps(content, sort_keys=True)
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+@dataclass
+class HashDiff:
+    batch: RowBatch
+    hashes: Dict[HashKey, str]
+    inserted: int = 0
+    changed: int = 0
+    unchanged: int = 0
+    deleted: int = 0
+
+
+class ContentHashIndex:
+    """Thread-safe SQLite index of per-domain row hashes."""
+
+    def __init__(self, path: str = "content_hashes.sqlite") -> None:
+        self.path = path
+        self.lock: Lock = Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS row_hashes (
+                    domain TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    row_id INTEGER NOT NULL,
+                    hash TEXT NOT NULL,
+                    PRIMARY KEY (domain, kind, row_id)
+                ) WITHOUT ROWID
+            """)
+            self.conn.commit()
+
+    def _load(self, domain: str) -> Dict[HashKey, str]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT kind, row_id, hash FROM row_hashes WHERE domain = ?", (domain,))
+            return {(kind, row_id): digest for kind, row_id, digest in rows}
+
+    def diff(self, domain: str, batch: RowBatch, write_all: bool = False) -> HashDiff:
+        """Reduce a domain's full batch to the rows that changed since the last write.
+
+        `batch` must hold the complete, non-empty catalogue: every key missing from it
+        is scheduled for deletion. With `write_all` every row is kept (hashes are still
+        recomputed), which resynchronizes a database that drifted from the index.
+        """
+        previous = self._load(domain)
+        result = HashDiff(RowBatch(), {})
+
+        # Variants and options are written (and replaced) together with their product
+        children: Dict[Any, Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]] = {
+            row["product_id"]: ([], []) for row in batch.product_rows}
+        for row in batch.variant_rows:
+            children[row["product_id"]][0].append(row)
+        for row in batch.option_rows:
+            children[row["product_id"]][1].append(row)
+
+        for row in batch.product_rows:
+            variants, options = children[row["product_id"]]
+            digest = content_hash({
+                "product": content_hash(row),
+                "variants": [content_hash(v) for v in variants],
+                "options": [content_hash(o) for o in options],
+            })
+            result.hashes[(PRODUCT, row["product_id"])] = digest
+            old = previous.get((PRODUCT, row["product_id"]))
+            if old is None:
+                result.inserted += 1
+            elif old != digest:
+                result.changed += 1
+            else:
+                result.unchanged += 1
+            if write_all or old != digest:
+                result.batch.product_rows.append(row)
+                result.batch.variant_rows.extend(variants)
+                result.batch.option_rows.extend(options)
+
+        for row in batch.image_rows:
+            digest = content_hash(row)
+            result.hashes[(IMAGE, row["image_id"])] = digest
+            if write_all or previous.get((IMAGE, row["image_id"])) != digest:
+                result.batch.image_rows.append(row)
+
+        for kind, row_id in previous:
+            if (kind, row_id) in result.hashes:
+                continue
+            if kind == PRODUCT:
+                result.batch.product_deletes.append((domain, row_id))
+                result.deleted += 1
+            else:
+                result.batch.image_deletes.append((domain, row_id))
+        return result
+
+    def commit(self, domain: str, hashes: Dict[HashKey, str]) -> None:
+        """Replace a domain's hashes once its rows were written."""
+        with self.lock:
+            self.conn.execute("DELETE FROM row_hashes WHERE domain = ?", (domain,))
+            self.conn.executemany(
+                "INSERT INTO row_hashes (domain, kind, row_id, hash) VALUES (?, ?, ?, ?)",
+                [(domain, kind, row_id, digest) for (kind, row_id), digest in hashes.items()],
+            )
+            self.conn.commit()
+
+    def domains(self) -> List[str]:
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT DISTINCT domain FROM row_hashes")]
+
+    def forget(self, domains: Iterable[str]) -> None:
+        """Drop the hashes of `domains`, e.g. ones now written by another shard."""
+        with self.lock:
+            self.conn.executemany("DELETE FROM row_hashes WHERE domain = ?", [(d,) for d in domains])
+            self.conn.commit()
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
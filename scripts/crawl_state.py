@@ -0,0 +1,197 @@
+"""
+Durable crawl state for the products.json crawler.
+
+A local SQLite journal records, per domain, the crawl status, the endpoint that
+served products and the pagination strategy it supports (see pagination.py), the
+last page reached, the first page's ETag/Last-Modified
+validators and the `updated_at` high-water mark of the catalogue. A restarted
+run uses it to skip domains that already completed, and a re-crawl uses it to
+send conditional requests and to skip stores whose catalogue did not change.
+"""
+
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime, UTC
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Optional
+
+PENDING = "pending"
+IN_PROGRESS = "in_progress"
+DONE = "done"
+FAILED = "failed"
+
+
+@dataclass
+class DomainState:
+    domain: str
+    status: str
+    endpoint: Optional[str]
+    last_page: int
+    product_count: Optional[int]
+    etag: Optional[str]
+    last_modified: Optional[str]
+    max_updated_at: Optional[str]
+    attempts: int
+    last_error: Optional[str]
+    pagination: Optional[str] = None
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """Validators to send with the first page of a re-crawl."""
+        headers: Dict[str, str] = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+def max_updated_at(products: Iterable[Dict[str, Any]]) -> Optional[str]:
+    """Return the newest product `updated_at` normalized to UTC ISO-8601."""
+    newest: Optional[datetime] = None
+    for product in products:
+        value = product.get("updated_at")
+        if not value:
+            continue
+        try:
+            parsed = datetime.fromisoformat(value).astimezone(UTC)
+        except (TypeError, ValueError):
+            continue
+        if newest is None or parsed > newest:
+            newest = parsed
+    return newest.isoformat() if newest else None
+
+
+class CrawlState:
+    """Thread-safe SQLite journal of per-domain crawl progress."""
+
+    def __init__(self, path: str = "crawl_state.sqlite") -> None:
+        self.path = path
+        self.lock: Lock = Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS domains (
+                    domain TEXT PRIMARY KEY,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    endpoint TEXT,
+                    last_page INTEGER NOT NULL DEFAULT 0,
+                    product_count INTEGER,
+                    etag TEXT,
+                    last_modified TEXT,
+                    max_updated_at TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    started_at TEXT,
+                    finished_at TEXT,
+                    pagination TEXT
+                )
+            """)
+            # Journals written before the pagination column existed
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(domains)")}
+            if "pagination" not in columns:
+                self.conn.execute("ALTER TABLE domains ADD COLUMN pagination TEXT")
+            self.conn.commit()
+
+    def _execute(self, sql: str, params: tuple) -> None:
+        with self.lock:
+            self.conn.execute(sql, params)
+            self.conn.commit()
+
+    def get(self, domain: str) -> Optional[DomainState]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT domain, status, endpoint, last_page, product_count, etag, last_modified, "
+                "max_updated_at, attempts, last_error, pagination FROM domains WHERE domain = ?",
+                (domain,),
+            ).fetchone()
+        return DomainState(**dict(row)) if row else None
+
+    def select_domains(self, domains: List[str], recrawl: bool = False) -> List[str]:
+        """Filter `domains` down to those this run should visit.
+
+        Completed domains are skipped unless `recrawl` is set, in which case they are
+        revisited with conditional requests. Failed and interrupted domains are retried.
+        """
+        if recrawl:
+            return list(domains)
+        with self.lock:
+            done = {
+                row[0] for row in self.conn.execute(
+                    "SELECT domain FROM domains WHERE status = ?", (DONE,))
+            }
+        return [domain for domain in domains if domain not in done]
+
+    def mark_started(self, domain: str) -> None:
+        self._execute("""
+            INSERT INTO domains (domain, status, attempts, started_at) VALUES (?, ?, 1, ?)
+            ON CONFLICT(domain) DO UPDATE SET
+                status = excluded.status,
+                attempts = domains.attempts + 1,
+                last_page = 0,
+                started_at = excluded.started_at
+        """, (domain, IN_PROGRESS, datetime.now(UTC).isoformat()))
+
+    def record_page(self, domain: str, endpoint: str, page: int) -> None:
+        self._execute(
+            "UPDATE domains SET endpoint = ?, last_page = ? WHERE domain = ?",
+            (endpoint, page, domain),
+        )
+
+    def record_pagination(self, domain: str, strategy: str) -> None:
+        self._execute("UPDATE domains SET pagination = ? WHERE domain = ?", (strategy, domain))
+
+    def record_validators(self, domain: str, etag: Optional[str], last_modified: Optional[str]) -> None:
+        self._execute(
+            "UPDATE domains SET etag = ?, last_modified = ? WHERE domain = ?",
+            (etag, last_modified, domain),
+        )
+
+    def mark_done(self, domain: str, product_count: int, updated_at_high_water: Optional[str]) -> None:
+        self._execute("""
+            UPDATE domains SET status = ?, product_count = ?, max_updated_at = ?,
+                last_error = NULL, finished_at = ?
+            WHERE domain = ?
+        """, (DONE, product_count, updated_at_high_water, datetime.now(UTC).isoformat(), domain))
+
+    def mark_failed(self, domain: str, error: str) -> None:
+        self._execute(
+            "UPDATE domains SET status = ?, last_error = ?, finished_at = ? WHERE domain = ?",
+            (FAILED, error, datetime.now(UTC).isoformat(), domain),
+        )
+
+    def domains(self) -> List[str]:
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT domain FROM domains")]
+
+    def forget(self, domains: Iterable[str]) -> None:
+        """Drop the journal entries of `domains`, e.g. ones now crawled by another shard."""
+        with self.lock:
+            self.conn.executemany("DELETE FROM domains WHERE domain = ?", [(d,) for d in domains])
+            self.conn.commit()
+
+    def summary(self) -> Dict[str, int]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT status, COUNT(*) FROM domains GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+def catalogue_unchanged(previous: Optional[DomainState], products: List[Dict[str, Any]]) -> bool:
+    """True when a completed earlier crawl saw the same catalogue.
+
+    Any added or edited product moves the `updated_at` high-water mark forward and any
+    removal changes the product count, so (count, high-water mark) is a cheap fingerprint.
+    """
+    if previous is None or previous.status != DONE or not previous.max_updated_at:
+        return False
+    return (
+        previous.product_count == len(products)
+        and max_updated_at(products) == previous.max_updated_at
+    )
@@ -0,0 +1,43 @@
+"""
+Shared Postgres connection settings for the scripts that talk to the database directly.
+"""
+
+import os
+from typing import Dict
+
+from psycopg2.extensions import parse_dsn
+
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+
+def require_database_url() -> str:
+    database_url = os.environ.get("DATABASE_URL", "").strip()
+    if not database_url:
+        raise SystemExit(
+            "DATABASE_URL is not set. Set an IPv4-compatible Session Pooler URL "
+            "(e.g., postgresql://postgres.<project_ref>:[PASSWORD]@aws-1-eu-central-2.pooler.supabase.com:5432/postgres?sslmode=require)"
+        )
+    return with_sslmode(database_url)
+
+
+def _is_local(params: Dict[str, str]) -> bool:
+    """True if every host of parsed connection `params` is this machine or a Unix socket.
+
+    No host at all means libpq's default, PGHOST or the local socket.
+    """
+    hosts = params.get("host") or params.get("hostaddr") or os.environ.get("PGHOST", "")
+    return all(not host or host.startswith("/") or host in LOCAL_HOSTS for host in hosts.split(","))
+
+
+def with_sslmode(database_url: str) -> str:
+    """Require SSL for Supabase and most hosted Postgres setups, but not for a local server.
+
+    Accepts a postgresql:// URL or a key=value connection string; an explicit sslmode is kept.
+    """
+    params = parse_dsn(database_url)
+    if "sslmode" in params or _is_local(params):
+        return database_url
+    if "://" not in database_url:
+        return f"{database_url} sslmode=require"
+    sep = "&" if "?" in database_url else "?"
+    return f"{database_url}{sep}sslmode=require"
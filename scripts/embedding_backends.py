@@ -0,0 +1,142 @@
+"""
+Embedding backends for embeddings_create.py.
+
+- `remote` calls the Hugging Face Inference API (needs HF_TOKEN) and is bound by its
+  rate limits
+- `local` runs the same sentence-transformers model on our own CPUs
+
+The local backend sorts texts by length before batching, so each batch pads to
+similar lengths, and can fan batches out to a pool of worker processes with a fixed
+torch thread count each. With `quantize` every worker applies dynamic int8
+quantization to the model's Linear layers, which speeds up CPU inference at a small
+accuracy cost (sentence-transformers 3.0.1 predates its ONNX backend, so torch's
+dynamic quantization is the int8 path available here).
+
+Both backends return L2-normalized float32 vectors of shape (len(texts), dim).
+"""
+
+import multiprocessing
+import os
+from typing import Any, List, Optional, Sequence
+
+import numpy as np
+
+MODEL_ID = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Loaded once per worker process by _init_worker
+_WORKER_MODEL: Any = None
+
+
+def _load_model(model_id: str, threads: Optional[int], quantize: bool) -> Any:
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    if threads:
+        torch.set_num_threads(threads)
+    model = SentenceTransformer(model_id, device="cpu")
+    if quantize:
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    model.eval()
+    return model
+
+
+def _init_worker(model_id: str, threads: Optional[int], quantize: bool) -> None:
+    global _WORKER_MODEL
+    _WORKER_MODEL = _load_model(model_id, threads, quantize)
+
+
+def _encode(model: Any, texts: List[str], batch_size: int) -> np.ndarray:
+    return model.encode(
+        texts, batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True,
+        show_progress_bar=False,
+    ).astype(np.float32, copy=False)
+
+
+def _encode_chunk(args: tuple) -> np.ndarray:
+    texts, batch_size = args
+    return _encode(_WORKER_MODEL, texts, batch_size)
+
+
+class RemoteBackend:
+    """Hugging Face Inference API feature extraction."""
+
+    def __init__(self, model_id: str = MODEL_ID) -> None:
+        from huggingface_hub import InferenceClient
+
+        self.model_id = model_id
+        self.client = InferenceClient(provider="hf-inference", api_key=os.environ["HF_TOKEN"])
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        embeddings = np.asarray(self.client.feature_extraction(list(texts), model=self.model_id), dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
+
+    def close(self) -> None:
+        pass
+
+
+class LocalBackend:
+    """sentence-transformers on CPU, optionally across a pool of worker processes."""
+
+    def __init__(
+        self,
+        model_id: str = MODEL_ID,
+        processes: int = 1,
+        threads: Optional[int] = None,
+        quantize: bool = False,
+        batch_size: int = 64,
+        chunk_size: int = 1024,
+    ) -> None:
+        self.model_id = model_id
+        self.processes = processes
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.model: Any = None
+        self.pool: Optional[Any] = None
+
+        if processes > 1:
+            # Split the cores between workers unless told otherwise, so they don't oversubscribe
+            threads = threads or max(1, (os.cpu_count() or 1) // processes)
+            self.pool = multiprocessing.get_context("spawn").Pool(
+                processes, initializer=_init_worker, initargs=(model_id, threads, quantize))
+        else:
+            self.model = _load_model(model_id, threads, quantize)
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        # Length-sorted batches pad to similar lengths; restore the caller's order afterwards
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        sorted_texts: List[str] = [texts[i] for i in order]
+
+        if self.pool is not None:
+            # Small calls still spread over every worker
+            chunk_size = min(self.chunk_size, -(-len(sorted_texts) // self.processes))
+            chunks = [
+                (sorted_texts[i:i + chunk_size], self.batch_size)
+                for i in range(0, len(sorted_texts), chunk_size)
+            ]
+            encoded = np.concatenate(self.pool.map(_encode_chunk, chunks))
+        else:
+            encoded = _encode(self.model, sorted_texts, self.batch_size)
+
+        embeddings = np.empty_like(encoded)
+        embeddings[order] = encoded
+        return embeddings
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+def make_backend(name: str, **kwargs: Any) -> Any:
+    if name == "remote":
+        return RemoteBackend(kwargs.get("model_id", MODEL_ID))
+    if name == "local":
+        return LocalBackend(**kwargs)
+    raise ValueError(f"Unknown embedding backend: {name}")
@@ -0,0 +1,127 @@
+"""
+Persistent embedding cache keyed by normalized input text.
+
+Shopify catalogues repeat themselves: the same product is sold by many stores and
+titles like "Gift Card" appear thousands of times. Vectors are cached in SQLite as
+float16 blobs under sha1(model id + normalized text), so every distinct text is
+embedded once per model and reused for every row (and every later run) that shares it.
+"""
+
+import hashlib
+import re
+import sqlite3
+import unicodedata
+from threading import Lock
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+_WHITESPACE = re.compile(r"\s+")
+
+# SQLite's default limit on bound parameters per statement
+_MAX_PARAMS = 900
+
+
+# Bumped when the key derivation changes; version 1 case-folded texts, which let a
+# cased model serve "Apple" the vector of "apple"
+_KEY_VERSION = 2
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form used for cache keys: NFKC, whitespace collapsed.
+
+    Case is kept: cased models embed "Apple" and "apple" differently.
+    """
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def cache_key(model_id: str, text: str) -> bytes:
+    return hashlib.sha1(f"{_KEY_VERSION}\0{model_id}\0{normalize_text(text)}".encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """Thread-safe SQLite store of float16 vectors keyed by `cache_key`."""
+
+    def __init__(self, path: str = "embedding_cache.sqlite") -> None:
+        self.path = path
+        self.lock: Lock = Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key BLOB PRIMARY KEY,
+                    vector BLOB NOT NULL
+                ) WITHOUT ROWID
+            """)
+            self.conn.commit()
+
+    def get_many(self, keys: Sequence[bytes]) -> Dict[bytes, np.ndarray]:
+        found: Dict[bytes, np.ndarray] = {}
+        with self.lock:
+            for i in range(0, len(keys), _MAX_PARAMS):
+                chunk = keys[i:i + _MAX_PARAMS]
+                placeholders = ",".join("?" * len(chunk))
+                for key, blob in self.conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk):
+                    found[key] = np.frombuffer(blob, dtype=np.float16)
+        return found
+
+    def put_many(self, keys: Sequence[bytes], vectors: np.ndarray) -> None:
+        rows = [(key, vector.astype(np.float16).tobytes()) for key, vector in zip(keys, vectors)]
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+            self.conn.commit()
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+class CachedBackend:
+    """Wraps an embedding backend so each distinct normalized text is encoded only once."""
+
+    def __init__(self, backend: Any, cache: EmbeddingCache, model_id: str) -> None:
+        self.backend = backend
+        self.cache = cache
+        self.model_id = model_id
+        self.hits: int = 0
+        self.encoded: int = 0
+        self.duplicates: int = 0
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        keys: List[bytes] = [cache_key(self.model_id, text) for text in texts]
+        unique: Dict[bytes, str] = {}
+        for key, text in zip(keys, texts):
+            unique.setdefault(key, text)
+        self.duplicates += len(keys) - len(unique)
+
+        vectors = self.cache.get_many(list(unique))
+        self.hits += len(vectors)
+
+        missing = [key for key in unique if key not in vectors]
+        if missing:
+            fresh = self.backend.encode([unique[key] for key in missing])
+            self.cache.put_many(missing, fresh)
+            self.encoded += len(missing)
+            # Serve what was just cached, so fresh and cached rows have the same precision
+            for key, vector in zip(missing, fresh):
+                vectors[key] = vector.astype(np.float16)
+
+        return np.stack([vectors[key] for key in keys]).astype(np.float32)
+
+    def stats(self) -> Optional[str]:
+        total = self.hits + self.encoded + self.duplicates
+        if not total:
+            return None
+        return (f"{self.encoded} texts encoded, {self.hits} cache hits, "
+                f"{self.duplicates} in-batch duplicates ({(total - self.encoded) / total:.0%} saved)")
+
+    def close(self) -> None:
+        self.backend.close()
+        self.cache.close()
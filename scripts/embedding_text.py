@@ -0,0 +1,93 @@
+"""
+Text composition for product embeddings.
+
+A product is embedded from several of its fields rather than the title alone, e.g.
+
+    Lavender Soap Bar. Brand: Soap Co. Type: Soap. Tags: handmade, vegan. Cold-processed ...
+
+The fields are configurable. Postgres keeps `embedding_source_hash`, an md5 over the
+raw values of every field in SOURCE_FIELDS, up to date on write (see the
+products_embedding_source_hash migration). An embedding records the fingerprint it
+was made from in `embedding_text_hash` and the model and field list in
+`embedding_config`, so the backfill selects only products whose embedding is missing,
+stale or made with another configuration.
+"""
+
+import hashlib
+import html
+import re
+from typing import Any, Dict, List, Sequence
+
+DEFAULT_FIELDS: List[str] = ["title", "vendor", "product_type", "tags", "body_html"]
+
+# How each field is read from public.products; the fingerprint trigger hashes the same
+# expressions in the same order (SOURCE_FIELDS)
+FIELD_SQL: Dict[str, str] = {
+    "title": "p.title",
+    "vendor": "p.vendor",
+    "product_type": "p.product_type",
+    "tags": "array_to_string(p.tags, ', ')",
+    "body_html": "p.raw_json ->> 'body_html'",
+}
+
+SOURCE_FIELDS: List[str] = list(FIELD_SQL)
+
+FIELD_LABELS: Dict[str, str] = {
+    "vendor": "Brand",
+    "product_type": "Type",
+    "tags": "Tags",
+}
+
+# Bump when compose_text changes, so every product is re-embedded once
+COMPOSER_VERSION = "1"
+
+# all-MiniLM-L6-v2 truncates at 256 word pieces; longer text only costs tokenization
+MAX_CHARS = 1000
+
+_TAGS = re.compile(r"<[^>]+>")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def parse_fields(value: str) -> List[str]:
+    fields = [field.strip() for field in value.split(",") if field.strip()]
+    unknown = [field for field in fields if field not in FIELD_SQL]
+    if unknown or not fields:
+        raise ValueError(f"Unknown embedding fields {unknown}; choose from {', '.join(FIELD_SQL)}")
+    return fields
+
+
+def strip_html(value: str) -> str:
+    return html.unescape(_TAGS.sub(" ", value))
+
+
+def compose_text(row: Dict[str, Any], fields: Sequence[str], max_chars: int = MAX_CHARS) -> str:
+    """Join a product's non-empty fields into one embedding input."""
+    parts: List[str] = []
+    for field in fields:
+        value = row.get(field)
+        if not value:
+            continue
+        if field == "body_html":
+            value = strip_html(value)
+        value = _WHITESPACE.sub(" ", str(value)).strip()
+        if not value:
+            continue
+        label = FIELD_LABELS.get(field)
+        parts.append(f"{label}: {value}" if label else value)
+    return ". ".join(parts)[:max_chars]
+
+
+def select_columns_sql(fields: Sequence[str]) -> str:
+    """SELECT-list entries exposing each configured field under its own name."""
+    return ", ".join(f"{FIELD_SQL[field]} AS {field}" for field in fields)
+
+
+def embedding_config(model_id: str, fields: Sequence[str]) -> str:
+    """What an embedding was made with; a different value means it has to be redone."""
+    return f"{model_id}|{','.join(fields)}|v{COMPOSER_VERSION}|"
+
+
+def source_hash(row: Dict[str, Any]) -> str:
+    """Python twin of `embedding_source_hash` for rows read outside the database (tags already joined)."""
+    values = "\x1f".join(str(row.get(field) or "") for field in SOURCE_FIELDS)
+    return hashlib.md5(values.encode("utf-8")).hexdigest()
@@ -1,112 +1,307 @@
-import os
-from huggingface_hub import InferenceClient
+import argparse
+import queue
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
 import psycopg2
 import psycopg2.extras as extras
 from tqdm import tqdm
 from dotenv import load_dotenv
 
-load_dotenv()
+from db import require_database_url
+from embedding_backends import MODEL_ID, make_backend
+from embedding_cache import CachedBackend, EmbeddingCache
+from embedding_text import (DEFAULT_FIELDS, SOURCE_FIELDS, compose_text, embedding_config, parse_fields,
+                            select_columns_sql, source_hash)
 
-print("DATABASE_URL:", os.environ.get("DATABASE_URL"))
+BATCH_SIZE = 512
 
-client = InferenceClient(
-    provider="hf-inference",
-    api_key=os.environ["HF_TOKEN"],
-)
 
-source_sentence = "That is a happy person"
-other_sentences = [
-    "That is a happy dog",
-    "That is a very happy person",
-    "Today is a sunny day"
-]
+# Marks the end of a stage's output
+_DONE = object()
 
-# The InferenceClient.feature_extraction method expects only one positional argument (the input(s)), and the model should be passed as a keyword argument.
-# To embed multiple sentences, pass a list of sentences as the first argument.
-embeddings = client.feature_extraction(
-    [source_sentence],
-    model="sentence-transformers/all-MiniLM-L6-v2",
-)
 
-print(len(embeddings[0]))
+# Embedding missing, or its source fields changed since (products_embedding_backlog_idx)
+BACKLOG_SQL = "(p.embedding IS NULL OR p.embedding_text_hash IS DISTINCT FROM p.embedding_source_hash)"
 
-result = client.sentence_similarity(
-    source_sentence,
-    other_sentences,
-    model="sentence-transformers/all-MiniLM-L6-v2",
-)
+# Embedded with another model or field list
+CONFIG_CHANGED_SQL = "p.embedding_config IS DISTINCT FROM %(config)s"
 
-print(result)
 
+def _keyset_pages(conn, condition: str, params: Dict[str, Any], batch_size: int,
+                  fields: Sequence[str]) -> Iterator[List[Dict[str, Any]]]:
+    query = f"""
+      SELECT p.domain, p.product_id, {select_columns_sql(fields)}, p.embedding_source_hash AS source_hash
+      FROM public.products p
+      WHERE (p.domain, p.product_id) > (%(domain)s, %(product_id)s)
+        AND {condition}
+      ORDER BY p.domain, p.product_id
+      LIMIT %(limit)s
+    """
+    params = {**params, "domain": "", "product_id": -1, "limit": batch_size}
+    while True:
+        with conn.cursor(cursor_factory=extras.RealDictCursor) as cur:
+            cur.execute(query, params)
+            rows = cur.fetchall()
+        conn.commit()
+        if not rows:
+            return
+        params["domain"], params["product_id"] = rows[-1]["domain"], rows[-1]["product_id"]
+        for row in rows:
+            row["text"] = compose_text(row, fields)
+        yield rows
 
-def _require_database_url() -> str:
-    database_url = os.environ.get("DATABASE_URL", "").strip()
-    if not database_url:
-        raise SystemExit(
-            "DATABASE_URL is not set. Set an IPv4-compatible Session Pooler URL "
-            "(e.g., postgresql://postgres.<project_ref>:[PASSWORD]@aws-1-eu-central-2.pooler.supabase.com:5432/postgres?sslmode=require)"
-        )
-    # Ensure SSL is required for Supabase and most hosted Postgres setups
-    if "sslmode=" not in database_url:
-        sep = "&" if "?" in database_url else "?"
-        database_url = f"{database_url}{sep}sslmode=require"
-    return database_url
 
+def config_changed(conn, config: str) -> bool:
+    """Whether any embedding was made with another model or field list (an index lookup)."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT EXISTS (
+                SELECT 1 FROM public.products
+                WHERE embedding_config < %(config)s OR embedding_config > %(config)s
+            )
+        """, {"config": config})
+        changed = cur.fetchone()[0]
+    conn.commit()
+    return changed
 
-BATCH_SIZE = 512
-TEXT_FIELD = "title"  # or combine fields if needed
 
+def fetch_batches(conn, batch_size: int, fields: Sequence[str], model_id: str) -> Iterator[List[Dict[str, Any]]]:
+    """Page through products needing an embedding by keyset on (domain, product_id).
 
-def chunks(lst, n):
-    for i in range(0, len(lst), n):
-        yield lst[i:i+n]
+    A product needs one when it has none yet, or when its `embedding_source_hash`
+    (maintained by Postgres on write) no longer matches the `embedding_text_hash` it
+    was embedded from. The partial index on that condition holds only the backlog, so
+    a run never reads the rest of the table. Only after a change of model or fields
+    does a second pass walk every product whose `embedding_config` differs. Each page
+    is its own short query, so nothing is held open between pages, and a restarted run
+    simply continues with whatever is still missing or stale.
+    """
+    params = {"config": embedding_config(model_id, fields)}
+    yield from _keyset_pages(conn, BACKLOG_SQL, params, batch_size, fields)
+    if config_changed(conn, params["config"]):
+        yield from _keyset_pages(conn, CONFIG_CHANGED_SQL, params, batch_size, fields)
 
 
-def main():
-    db_url = _require_database_url()
-    conn = psycopg2.connect(db_url)
-    conn.autocommit = False
+def fetch_parquet_batches(conn, path: str, batch_size: int, fields: Sequence[str],
+                          model_id: str) -> Iterator[List[Dict[str, Any]]]:
+    """Read the embedding inputs from a Parquet crawl dataset (see parquet_export.py).
 
-    with conn.cursor(cursor_factory=extras.DictCursor) as cur:
-        cur.execute("""
-          SELECT domain, product_id, COALESCE(title, '') AS text
-          FROM public.products
-          WHERE embedding IS NULL
-        """)
-        rows = cur.fetchall()
-
-    total = len(rows)
-    print(f"Rows to embed: {total}")
-    if total == 0:
-        conn.close()
-        return
-
-    for batch in tqdm(list(chunks(rows, BATCH_SIZE))):
-        texts = [r["text"] for r in batch]
-        embeddings = client.feature_extraction(
-            texts, model="sentence-transformers/all-MiniLM-L6-v2")
-
-        update_rows = [
-            (emb.tolist(), r["domain"], r["product_id"])
-            for emb, r in zip(embeddings, batch)
-        ]
-
-        # Use execute_values for efficient bulk updates
+    Only the key and field columns of each domain's latest crawl are read, locally.
+    The database is asked just which of those products need an embedding, by key
+    and source hash, so no product text or raw_json crosses the wire. The dataset
+    should be the crawl that was loaded into the database; where its text differs,
+    the embedding follows the dataset.
+    """
+    import pyarrow as pa
+    from parquet_export import dataset, latest_crawl, latest_crawls
+
+    config = embedding_config(model_id, fields)
+    latest = latest_crawls(path)
+    columns = ["domain", "product_id", "crawl_date", "run_id", *SOURCE_FIELDS]
+    for record_batch in dataset(path, "products").to_batches(columns=columns, batch_size=batch_size):
+        rows = latest_crawl(pa.Table.from_batches([record_batch]), latest).to_pylist()
+        if not rows:
+            continue
+        for row in rows:
+            if row.get("tags") is not None:
+                row["tags"] = ", ".join(row["tags"])
+            row["source_hash"] = source_hash(row)
         with conn.cursor() as cur:
-            extras.execute_values(
+            stale = extras.execute_values(
                 cur,
                 """
-                UPDATE public.products AS p SET embedding = data.emb
-                FROM (VALUES %s) AS data(emb, domain, product_id)
-                WHERE p.domain = data.domain AND p.product_id = data.product_id
+                SELECT p.domain, p.product_id
+                FROM public.products p
+                JOIN (VALUES %s) AS k(domain, product_id, source_hash, config)
+                  ON p.domain = k.domain AND p.product_id = k.product_id
+                WHERE p.embedding IS NULL OR p.embedding_text_hash IS DISTINCT FROM k.source_hash
+                   OR p.embedding_config IS DISTINCT FROM k.config
                 """,
-                update_rows,
-                template="(%s::vector, %s, %s)",
-                page_size=1000
+                [(r["domain"], r["product_id"], r["source_hash"], config) for r in rows],
+                template="(%s, %s::bigint, %s, %s)",
+                page_size=len(rows),
+                fetch=True,
             )
         conn.commit()
+        keys = {(domain, product_id) for domain, product_id in stale}
+        batch = [r for r in rows if (r["domain"], r["product_id"]) in keys]
+        for row in batch:
+            row["text"] = compose_text(row, fields)
+        if batch:
+            yield batch
+
+
+def write_embeddings(conn, rows: List[Dict[str, Any]], embeddings, config: str) -> None:
+    update_rows = [
+        (emb.tolist(), r["source_hash"], config, r["domain"], r["product_id"])
+        for emb, r in zip(embeddings, rows)
+    ]
+
+    # Use execute_values for efficient bulk updates
+    with conn.cursor() as cur:
+        extras.execute_values(
+            cur,
+            """
+            UPDATE public.products AS p
+            SET embedding = data.emb, embedding_text_hash = data.text_hash, embedding_config = data.config
+            FROM (VALUES %s) AS data(emb, text_hash, config, domain, product_id)
+            WHERE p.domain = data.domain AND p.product_id = data.product_id
+            """,
+            update_rows,
+            template="(%s::vector, %s, %s, %s, %s)",
+            page_size=1000
+        )
+    conn.commit()
+
+
+def _stage(target, *args) -> threading.Thread:
+    thread = threading.Thread(target=target, args=args, daemon=True)
+    thread.start()
+    return thread
+
+
+def run_pipeline(read_conn, write_conn, backend, batch_size: int, queue_depth: int,
+                 fields: Sequence[str], model_id: str, parquet: Optional[str] = None) -> int:
+    """Fetch, encode and write concurrently with bounded queues between the stages.
+
+    At most `queue_depth` batches wait on either side of the encoder, so memory stays
+    flat however large the backlog is. Each batch is committed on its own, which makes
+    the job safe to interrupt and rerun. Returns the number of products embedded.
+    """
+    to_encode: "queue.Queue[Any]" = queue.Queue(maxsize=queue_depth)
+    to_write: "queue.Queue[Any]" = queue.Queue(maxsize=queue_depth)
+    stop = threading.Event()
+    errors: List[BaseException] = []
+    written = 0
+    config = embedding_config(model_id, fields)
+
+    def put(q: "queue.Queue[Any]", item: Any) -> bool:
+        # Give up instead of blocking forever once another stage has failed
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(q: "queue.Queue[Any]") -> Any:
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def fetcher() -> None:
+        try:
+            batches = (fetch_parquet_batches(read_conn, parquet, batch_size, fields, model_id) if parquet
+                       else fetch_batches(read_conn, batch_size, fields, model_id))
+            for rows in batches:
+                if not put(to_encode, rows):
+                    return
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            put(to_encode, _DONE)
+
+    def writer() -> None:
+        nonlocal written
+        try:
+            with tqdm(unit="products") as progress:
+                while (item := get(to_write)) is not _DONE:
+                    rows, embeddings = item
+                    write_embeddings(write_conn, rows, embeddings, config)
+                    written += len(rows)
+                    progress.update(len(rows))
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    threads = [_stage(fetcher), _stage(writer)]
+    try:
+        # Encoding stays on the main thread: it is the CPU-bound stage
+        while (rows := get(to_encode)) is not _DONE:
+            embeddings = backend.encode([r["text"] for r in rows])
+            if not put(to_write, (rows, embeddings)):
+                break
+        put(to_write, _DONE)
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+    return written
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Embed products that have no embedding yet or whose source text changed.")
+    parser.add_argument("--fields", type=parse_fields, default=DEFAULT_FIELDS,
+                        help=f"comma-separated product fields composed into the embedding text "
+                             f"(default: {','.join(DEFAULT_FIELDS)})")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help=f"rows embedded and written per database round-trip (default: {BATCH_SIZE})")
+    parser.add_argument("--queue-depth", type=int, default=4,
+                        help="batches buffered between the fetch, encode and write stages (default: 4)")
+    parser.add_argument("--backend", choices=["remote", "local"], default="remote",
+                        help="Hugging Face Inference API or sentence-transformers on local CPUs (default: remote)")
+    parser.add_argument("--model", default=MODEL_ID,
+                        help=f"embedding model (default: {MODEL_ID})")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="local backend: encoder worker processes (default: 1)")
+    parser.add_argument("--threads", type=int,
+                        help="local backend: torch threads per process (default: cores / processes)")
+    parser.add_argument("--quantize", action="store_true",
+                        help="local backend: dynamic int8 quantization of the model's Linear layers")
+    parser.add_argument("--cache", default="embedding_cache.sqlite",
+                        help="SQLite cache of embeddings by normalized text; empty string disables it "
+                             "(default: embedding_cache.sqlite)")
+    parser.add_argument("--parquet", metavar="DIR",
+                        help="read product text from the crawler's Parquet datasets in DIR instead of the database")
+    parser.add_argument("--encode-batch-size", type=int, default=64,
+                        help="local backend: texts per forward pass (default: 64)")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    load_dotenv()
+    if args.backend == "local":
+        backend = make_backend(
+            "local",
+            model_id=args.model,
+            processes=args.processes,
+            threads=args.threads,
+            quantize=args.quantize,
+            batch_size=args.encode_batch_size,
+        )
+    else:
+        backend = make_backend("remote", model_id=args.model)
+    if args.cache:
+        backend = CachedBackend(backend, EmbeddingCache(args.cache), args.model)
+
+    db_url = require_database_url()
+    read_conn = psycopg2.connect(db_url)
+    write_conn = psycopg2.connect(db_url)
 
-    conn.close()
+    print(f"Embedding products from: {', '.join(args.fields)}")
+    try:
+        embedded = run_pipeline(
+            read_conn, write_conn, backend, args.batch_size, args.queue_depth, args.fields, args.model,
+            parquet=args.parquet)
+        print(f"Embedded {embedded} new or changed products")
+    finally:
+        read_conn.close()
+        write_conn.close()
+        backend.close()
+    if isinstance(backend, CachedBackend) and backend.stats():
+        print(f"Embedding cache: {backend.stats()}")
     print("Done.")
 
 
@@ -1,16 +1,29 @@
+import argparse
 import requests
 import json
 import concurrent.futures
-from threading import Lock, BoundedSemaphore
-from typing import List, Dict, Any, Optional
+import copy
+from threading import Lock
+from typing import List, Dict, Any, Mapping, Optional, Tuple
 from dataclasses import dataclass, field
 from datetime import datetime, UTC
 import time
-import random
+import heapq
 import os
 
 from dotenv import load_dotenv
 from tenacity import retry, stop_after_attempt, wait_exponential
+
+from content_hashes import ContentHashIndex
+from crawl_state import CrawlState, DomainState, DONE, catalogue_unchanged, max_updated_at
+from http_cache import HttpCache
+import product_codec
+from pagination import PAGE, DomainJob, Paginator, catalogue_size, fan_out_plan, page_query
+from product_rows import RAW_JSON_MODES, RowBatch, build_rows
+from product_sink import ProductSink, TeeSink
+from rate_limiter import AdaptiveRateLimiter, Throttled
+import sharding
+from write_behind import WriteBehindQueue, persist_callback
 try:
     # supabase-py v2
     from supabase import create_client, Client
@@ -18,86 +31,214 @@ except Exception:  # pragma: no cover
     create_client = None
     Client = None
 
-# Last unsuccessful: cloud9wigs.com
+# Browser-like headers sent with every storefront request.
+HEADERS: Dict[str, str] = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'application/json',
+    'Accept-Language': 'en-US,en;q=0.9',
+}
+
+# Public storefront endpoints. Try collections-all first (commonly paginates), then plain products.
+PRODUCT_ENDPOINTS: List[str] = [
+    "/collections/all/products.json",
+    "/products.json",
+]
+
+# Shared by all worker threads: per-domain and per-IP politeness for the threaded crawl
+RATE_LIMITER = AdaptiveRateLimiter()
+
+# Give up on a domain after it has been throttled this many times
+MAX_THROTTLES = 6
+
+# Catalogues of at least this many pages are fetched with concurrent page requests
+# (0 disables the fan-out), FAN_OUT_WORKERS pages at a time per domain
+FAN_OUT_PAGES = 0
+FAN_OUT_WORKERS = 2
+
 
 @dataclass
 class ScrapingStats:
     total_processed: int = 0
     successful_domains: int = 0
     failed_domains: List[str] = field(default_factory=list)
+    errors: Dict[str, str] = field(default_factory=dict)
     start_time: datetime = field(default_factory=datetime.now)
     lock: Lock = field(default_factory=Lock)
-    rate_limit_semaphore: BoundedSemaphore = field(
-        default_factory=lambda: BoundedSemaphore(2))
-    all_products: List[Dict[str, Any]] = field(default_factory=list)
-
-    def wait_for_rate_limit(self) -> None:
-        """Implements rate limiting with jitter to prevent thundering herd."""
-        self.rate_limit_semaphore.acquire()
-        time.sleep(0.5 + random.random())
+    total_products: int = 0
+    unchanged_domains: int = 0
 
     def add_products(self, products: List[Dict[str, Any]], domain: str) -> None:
         with self.lock:
-            self.all_products.extend(products)
+            self.total_products += len(products)
             self.successful_domains += 1
             self.total_processed += 1
             products_count = len(products)
-            total_count = len(self.all_products)
             print(
                 f"Found {products_count} products from {domain} "
-                f"(Total: {total_count} products from {self.successful_domains} domains)"
+                f"(Total: {self.total_products} products from {self.successful_domains} domains)"
             )
 
+    def add_unchanged(self, domain: str) -> None:
+        with self.lock:
+            self.unchanged_domains += 1
+            self.total_processed += 1
+            print(f"Catalogue unchanged for {domain}, skipping")
+
     def add_failed_domain(self, domain: str, error: str) -> None:
         with self.lock:
             self.failed_domains.append(domain)
+            self.errors[domain] = error
             self.total_processed += 1
             print(f"Error processing {domain}: {error}")
 
 
-def fetch_all_pages_for_endpoint(domain: str, endpoint_path: str, headers: Dict[str, str], per_page: int = 250) -> List[Dict[str, Any]]:
-    """Fetch all products for a given public storefront endpoint using page-number pagination.
+def _fetch_page(url: str, headers: Dict[str, str], domain: str, limiter: AdaptiveRateLimiter,
+                cache: Optional[HttpCache] = None,
+                conditional_headers: Optional[Dict[str, str]] = None) -> Tuple[bytes, Mapping[str, str]]:
+    """GET one products.json page, revalidating it against the HTTP cache.
 
-    Tries pages starting at 1 and stops when a page returns fewer than `per_page` items,
-    an empty list, or when duplicate page content is detected.
+    Returns the body and the response headers. Validators are only sent when a 304 can
+    be answered with a cached body, so there is nothing to revalidate without a
+    `cache`. `conditional_headers` (the journaled validators of the first page) stand
+    in when the cache has none of its own for `url`. A 304 only says this one page is
+    unchanged; later pages may still differ. A 429 is reported to `limiter` and raised
+    as Throttled so the domain can be re-queued.
     """
-    collected: List[Dict[str, Any]] = []
-    last_first_product_id: Optional[int] = None
-    page: int = 1
-
-    while True:
-        url = f"https://{domain}{endpoint_path}?limit={per_page}&page={page}"
+    if cache is not None:
+        request_headers = {**headers, **(cache.conditional_headers(url) or conditional_headers or {})}
+    else:
+        request_headers = headers
+
+    limiter.wait(domain)
+    response = requests.get(url, timeout=10, headers=request_headers)
+    if response.status_code == 304:
+        limiter.record_success(domain)
+        body = cache.load(url) if cache is not None else None
+        if body is not None:
+            return body, response.headers
+        # Cached body vanished (evicted) or was never stored; fetch it unconditionally
+        limiter.wait(domain)
         response = requests.get(url, timeout=10, headers=headers)
-        response.raise_for_status()
-        data: Dict[str, Any] = response.json()
-        products: List[Dict[str, Any]] = data.get("products", [])
+    if response.status_code == 429:
+        raise Throttled(domain, limiter.record_throttle(domain, response.headers.get("Retry-After")))
+    response.raise_for_status()
+    limiter.record_success(domain)
 
-        if not products:
-            break
+    if cache is not None:
+        cache.store(url, response.content,
+                    response.headers.get("ETag"), response.headers.get("Last-Modified"))
+    return response.content, response.headers
 
-        # Detect duplicate page loops (some themes ignore page param)
-        first_id: Optional[int] = None
-        try:
-            if isinstance(products[0].get("id"), int):
-                first_id = products[0]["id"]
-        except Exception:
-            first_id = None
 
-        if last_first_product_id is not None and first_id is not None and first_id == last_first_product_id:
-            # Same page served again -> stop to avoid infinite loop
-            break
+def _catalogue_size(domain: str, headers: Dict[str, str]) -> Optional[int]:
+    """Published product count from /meta.json, or None if the store does not report it."""
+    RATE_LIMITER.wait(domain)
+    try:
+        response = requests.get(f"https://{domain}/meta.json", timeout=10, headers=headers)
+    except requests.exceptions.RequestException:
+        return None
+    if response.status_code == 429:
+        raise Throttled(domain, RATE_LIMITER.record_throttle(domain, response.headers.get("Retry-After")))
+    if not response.ok:
+        return None
+    RATE_LIMITER.record_success(domain)
+    try:
+        return catalogue_size(product_codec.loads(response.content))
+    except ValueError:
+        return None
 
-        collected.extend(products)
-        last_first_product_id = first_id
 
-        # If fewer than requested, likely last page
-        if len(products) < per_page:
-            break
+def _fetch_page_range(domain: str, endpoint_path: str, headers: Dict[str, str], per_page: int,
+                      first_page: int, last_page: int, workers: int,
+                      cache: Optional[HttpCache] = None,
+                      fetched: Optional[Dict[int, List[Dict[str, Any]]]] = None) -> List[List[Dict[str, Any]]]:
+    """Fetch pages `first_page`..`last_page`, `workers` at a time; returns them in page order.
 
-        page += 1
-        time.sleep(0.5 + random.random())
+    Pages already in `fetched` are not asked for again, and pages that arrived before
+    a failure (e.g. Throttled) stay in it, so a re-queued domain only fetches the rest.
+    """
+    fetched = {} if fetched is None else fetched
 
-    return collected
+    def fetch(page: int) -> None:
+        url = f"https://{domain}{endpoint_path}?{page_query(page, per_page)}"
+        body, _ = _fetch_page(url, headers, domain, RATE_LIMITER, cache)
+        fetched[page] = product_codec.decode_products(body)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fan-out")
+    try:
+        list(executor.map(fetch, [page for page in range(first_page, last_page + 1) if page not in fetched]))
+    finally:
+        # A failed page (e.g. Throttled) cancels the pages not started yet
+        executor.shutdown(cancel_futures=True)
+    return [fetched.pop(page) for page in range(first_page, last_page + 1)]
+
+
+def fetch_all_pages_for_endpoint(domain: str, endpoint_path: str, headers: Dict[str, str], per_page: int = 250,
+                                 state: Optional[CrawlState] = None,
+                                 conditional_headers: Optional[Dict[str, str]] = None,
+                                 cache: Optional[HttpCache] = None,
+                                 pagination: Optional[str] = None,
+                                 fan_out_pages: int = 0,
+                                 fan_out_workers: int = 2,
+                                 product_count: Optional[int] = None,
+                                 job: Optional[DomainJob] = None) -> List[Dict[str, Any]]:
+    """Fetch all products for a given public storefront endpoint.
+
+    Pages are walked by a Paginator (see pagination.py): `since_id` keyset pagination
+    where the store supports it, page numbers otherwise, starting with `pagination`,
+    the strategy that worked last time. The walk stops at a short or empty page or
+    when a page adds no new products. `conditional_headers` are offered for the first
+    page only and a 304 just reuses that page from the cache; whether the catalogue
+    changed is decided after the full walk. Progress, the first page's validators
+    and a newly detected strategy are journaled to `state` when given. With a `cache`,
+    every page is revalidated against its cached copy and a 304 reuses the cached body.
+
+    With `fan_out_pages`, a catalogue of at least that many pages is fetched with
+    `fan_out_workers` concurrent page requests once its first page came back full.
+    Its size is `product_count` (from the last crawl) or asked from /meta.json.
+
+    With a `job`, the Paginator, catalogue size and fan-out pages are kept on it, so
+    after a Throttled the same job resumes at the page it was stopped on.
+    """
+    job = job if job is not None else DomainJob(domain)
+    if job.pager is None:
+        large = fan_out_plan(product_count, per_page, fan_out_pages) > 0
+        job.pager = Paginator(PAGE if large else pagination, per_page)
+    pager = job.pager
+
+    while True:
+        if fan_out_pages and pager.requests == 1:
+            if job.catalogue_size is None:
+                job.catalogue_size = product_count or _catalogue_size(domain, headers) or 0
+            pages = fan_out_plan(job.catalogue_size, per_page, fan_out_pages)
+            if pages:
+                first_page = pager.switch_to_pages()
+                more = pager.take_pages(_fetch_page_range(
+                    domain, endpoint_path, headers, per_page, first_page, pages, fan_out_workers, cache,
+                    job.pages))
+                if state is not None:
+                    state.record_page(domain, endpoint_path, pager.requests)
+                if not more:
+                    break
+
+        url = f"https://{domain}{endpoint_path}?{pager.query()}"
+        first = pager.first
+        body, response_headers = _fetch_page(
+            url, headers, domain, RATE_LIMITER, cache, conditional_headers if first else None)
+        if first and state is not None:
+            state.record_validators(
+                domain, response_headers.get("ETag"), response_headers.get("Last-Modified"))
+        products: List[Dict[str, Any]] = product_codec.decode_products(body)
+
+        more = pager.advance(products)
+        if products and state is not None:
+            state.record_page(domain, endpoint_path, pager.requests)
+        if not more:
+            break
+
+    if state is not None and pager.detected is not None and pager.detected != pagination:
+        state.record_pagination(domain, pager.detected)
+    return pager.products
 
 
 class SupabaseWriter:
@@ -108,8 +249,9 @@ class SupabaseWriter:
     """
 
     # Reduced batch size for better reliability
-    def __init__(self, batch_size: int = 50) -> None:
+    def __init__(self, batch_size: int = 50, raw_json: str = "full") -> None:
         load_dotenv()
+        self.raw_json = raw_json
         self.supabase_url: Optional[str] = os.getenv("SUPABASE_URL")
         self.supabase_key: Optional[str] = os.getenv("SUPABASE_API_KEY")
         self.client: Optional[Client] = None
@@ -179,188 +321,319 @@ class SupabaseWriter:
                 time.sleep(2)  # Additional backoff for rate limits
             raise  # Re-raise for retry
 
-    def _chunked(self, rows: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    @retry(stop=stop_after_attempt(5), wait=wait_exponential(multiplier=1, min=1, max=10))
+    def _delete(self, table: str, domain: str, key: str, ids: List[Any]) -> None:
+        assert self.client is not None
+        try:
+            with self.lock:
+                self.client.table(table).delete().eq("domain", domain).in_(key, ids).execute()
+        except Exception as e:
+            print(f"Error deleting from {table}: {str(e)}")
+            raise  # Re-raise for retry
+
+    def _delete_keys(self, table: str, key: str, keys: List[Tuple[str, Any]]) -> None:
+        by_domain: Dict[str, List[Any]] = {}
+        for domain, row_id in keys:
+            by_domain.setdefault(domain, []).append(row_id)
+        for domain, ids in by_domain.items():
+            for chunk in self._chunked(ids):
+                self._delete(table, domain, key, chunk)
+
+    def _chunked(self, rows: List[Any]) -> List[List[Any]]:
         return [rows[i:i + self.batch_size] for i in range(0, len(rows), self.batch_size)]
 
     def upsert_products(self, products: List[Dict[str, Any]], domain: str) -> None:
         if not self.is_enabled() or not products:
             return
 
-        fetched_at = datetime.now(UTC).isoformat()
-
-        product_rows: List[Dict[str, Any]] = []
-        image_rows_dict: Dict[str, Dict[str, Any]] = {}
-
-        for p in products:
-            product_id = p.get("id")
-            if product_id is None:
-                continue
-
-            # Core product row with raw_json
-            product_rows.append({
-                "domain": domain,
-                "product_id": product_id,
-                "handle": p.get("handle"),
-                "title": p.get("title"),
-                "vendor": p.get("vendor"),
-                "product_type": p.get("product_type"),
-                "tags": p.get("tags"),
-                "created_at": p.get("created_at"),
-                "updated_at": p.get("updated_at"),
-                "published_at": p.get("published_at"),
-                "admin_graphql_api_id": p.get("admin_graphql_api_id"),
-                "template_suffix": p.get("template_suffix"),
-                "published_scope": p.get("published_scope"),
-                "fetched_at": fetched_at,
-                "raw_json": p,
-            })
-
-            # Images - deduplicate by domain and image_id
-            for img in p.get("images", []) or []:
-                image_id = img.get("id")
-                if image_id is None:
-                    continue
-
-                # Use dictionary to deduplicate by domain+image_id
-                image_key = f"{domain}:{image_id}"
-                image_rows_dict[image_key] = {
-                    "domain": domain,
-                    "image_id": image_id,
-                    "product_id": product_id,
-                    "position": img.get("position"),
-                    "src": img.get("src"),
-                    "width": img.get("width"),
-                    "height": img.get("height"),
-                    "alt": img.get("alt"),
-                    "created_at": img.get("created_at"),
-                    "updated_at": img.get("updated_at"),
-                    "fetched_at": fetched_at,
-                    "raw_json": img,
-                }
+        self.write_batch(build_rows(products, domain, raw_json=self.raw_json))
 
+    def write_batch(self, batch: RowBatch) -> None:
         # Perform batched upserts/inserts
-        for chunk in self._chunked(product_rows):
+        for chunk in self._chunked(batch.product_rows):
             self._upsert("products", chunk, on_conflict="domain,product_id")
-        image_rows = list(image_rows_dict.values())
-        for chunk in self._chunked(image_rows):
+        for chunk in self._chunked(batch.image_rows):
             self._upsert("images", chunk, on_conflict="domain,image_id")
+        # A written product's variants and options replace the stored ones
+        replaced = [(row["domain"], row["product_id"]) for row in batch.product_rows]
+        replaced += batch.product_deletes
+        self._delete_keys("product_variants", "product_id", replaced)
+        self._delete_keys("product_options", "product_id", replaced)
+        for chunk in self._chunked(batch.variant_rows):
+            self._upsert("product_variants", chunk, on_conflict="domain,variant_id")
+        for chunk in self._chunked(batch.option_rows):
+            self._upsert("product_options", chunk, on_conflict="domain,product_id,position")
+        self._delete_keys("images", "image_id", batch.image_deletes)
+        self._delete_keys("products", "product_id", batch.product_deletes)
+
+    def upsert_domain(self, domain: str, products: List[Dict[str, Any]], error: Optional[str] = None) -> None:
+        """Record the outcome of a fetch attempt on the domain's row."""
+        if not self.is_enabled():
+            return
+
+        now = datetime.now(UTC).isoformat()
+        row: Dict[str, Any] = {
+            "domain": domain,
+            "scraping_status": "failed" if error else "active",
+            "last_scrape_error": error,
+            "last_fetched_at": now,
+            "updated_at": now,
+        }
+        if products:
+            row["product_count"] = len(products)
+
+        try:
+            self._upsert("domains", [row], on_conflict="domain")
+        except Exception as e:
+            print(f"Warning: Failed to update domain record for {domain}: {e}")
 
 
 # Initialize a global writer (lazy-disabled if env is missing)
 SUPABASE_WRITER = SupabaseWriter()
 
+# Writer used by the crawl; `--writer postgres` swaps in the COPY-based bulk loader
+WRITER: Any = SUPABASE_WRITER
 
-def fetch_domain_products(domain: str, stats: ScrapingStats) -> None:
-    """Fetch products from a single domain."""
-    try:
-        stats.wait_for_rate_limit()
+# Write-behind stage in front of WRITER, started by main() when persistence is enabled
+WRITE_QUEUE: Optional[WriteBehindQueue] = None
+
+
+def _ordered_endpoints(previous: Optional[DomainState]) -> List[str]:
+    """Try the endpoint that served products last time first."""
+    if previous is None or previous.endpoint not in PRODUCT_ENDPOINTS:
+        return list(PRODUCT_ENDPOINTS)
+    return [previous.endpoint] + [e for e in PRODUCT_ENDPOINTS if e != previous.endpoint]
 
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'application/json',
-            'Accept-Language': 'en-US,en;q=0.9',
-        }
 
-        # Public storefront endpoints. Try collections-all first (commonly paginates), then plain products.
-        endpoints = [
-            "/collections/all/products.json",
-            "/products.json",
-        ]
+def _record_failure(domain: str, error_msg: str, stats: ScrapingStats, state: Optional[CrawlState]) -> None:
+    stats.add_failed_domain(domain, error_msg)
+    if state is not None:
+        state.mark_failed(domain, error_msg)
+    # Update domain record with error status
+    if WRITER.is_enabled():
+        WRITER.upsert_domain(domain, [], error_msg)
 
+
+def fetch_domain_products(domain: str, stats: ScrapingStats, sink: Optional[ProductSink] = None,
+                          state: Optional[CrawlState] = None, cache: Optional[HttpCache] = None,
+                          job: Optional[DomainJob] = None) -> Optional[Throttled]:
+    """Fetch products from a single domain.
+
+    Returns the Throttled that interrupted the crawl, whose delay tells when to re-queue
+    the domain, or None once the domain is finished (successfully or not). Pass the
+    same `job` again to resume a throttled domain at the endpoint and page it reached.
+    """
+    job = job if job is not None else DomainJob(domain)
+    try:
+        if not job.started:
+            if state is not None:
+                job.previous = state.get(domain)
+                state.mark_started(domain)
+            job.started = True
+
+        previous = job.previous
+        # Only a completed earlier crawl has validators worth revalidating against
+        recrawl = previous is not None and previous.status == DONE
         all_domain_products: List[Dict[str, Any]] = []
+        endpoints = _ordered_endpoints(previous)
 
-        for endpoint in endpoints:
+        while job.endpoint_index < len(endpoints):
+            endpoint = endpoints[job.endpoint_index]
             try:
                 products_for_endpoint = fetch_all_pages_for_endpoint(
                     domain=domain,
                     endpoint_path=endpoint,
-                    headers=headers,
+                    headers=HEADERS,
                     per_page=250,
+                    state=state,
+                    cache=cache,
+                    conditional_headers=previous.conditional_headers()
+                    if recrawl and endpoint == previous.endpoint else None,
+                    pagination=previous.pagination if previous is not None else None,
+                    fan_out_pages=FAN_OUT_PAGES,
+                    fan_out_workers=FAN_OUT_WORKERS,
+                    product_count=previous.product_count if previous is not None else None,
+                    job=job,
                 )
+                job.answered = True
                 if products_for_endpoint:
                     all_domain_products = products_for_endpoint
                     break
+            except Throttled:
+                raise
             except requests.exceptions.HTTPError as http_err:
                 # Handle common HTTP errors
-                if http_err.response is not None:
-                    if http_err.response.status_code in (404, 400):
-                        # Try next endpoint
-                        continue
-                    elif http_err.response.status_code == 401:
-                        # Don't retry unauthorized - store requires authentication
-                        print(f"Skipping {domain}: Authentication required")
-                        break
-                    elif http_err.response.status_code == 429:
-                        # Rate limited - add delay and retry
-                        print(f"Rate limited for {domain}, backing off...")
-                        time.sleep(5 + random.random() * 5)
-                        continue
-                raise
-            except Exception:
+                if http_err.response is None or http_err.response.status_code not in (404, 400, 401):
+                    raise
+                job.answered = True
+                if http_err.response.status_code == 401:
+                    # Don't retry unauthorized - store requires authentication
+                    print(f"Skipping {domain}: Authentication required")
+                    break
+                # 404/400: try next endpoint
+            except Exception as e:
                 # Try next endpoint on generic errors
-                continue
+                job.last_error = e
+            job.next_endpoint()
+
+        if not job.answered and job.last_error is not None:
+            # Every endpoint failed (unreachable, timed out): a failure, not an empty store
+            raise job.last_error
+
+        if state is not None and catalogue_unchanged(previous, all_domain_products):
+            stats.add_unchanged(domain)
+            state.mark_done(domain, previous.product_count, previous.max_updated_at)
+            return None
 
         # Add domain to each product and save
         for product in all_domain_products:
             product["domain"] = domain
 
         stats.add_products(all_domain_products, domain)
-
-        # Persist immediately so data isn't lost if the process exits later
-        try:
-            if SUPABASE_WRITER.is_enabled():
-                print(
-                    f"Attempting to persist {len(all_domain_products)} products for {domain}...")
-                SUPABASE_WRITER.upsert_products(all_domain_products, domain)
-                print(
-                    f"Successfully persisted {len(all_domain_products)} products for {domain} to Supabase")
-        except Exception as persist_err:
-            # Non-fatal: continue scraping even if persistence fails
-            error_msg = str(persist_err)
-            if "timeout" in error_msg.lower():
-                print(
-                    f"Warning: Timeout persisting data for {domain}. Consider reducing batch size or adding retries.")
-            elif "rate" in error_msg.lower():
-                print(
-                    f"Warning: Rate limit hit while persisting data for {domain}. Adding delay for next operations.")
-                time.sleep(5)  # Add delay for rate limits
-            else:
-                print(
-                    f"Warning: Failed to persist data for {domain}: {error_msg}")
-            # Log full error details for debugging
-            print(
-                f"Full error context for {domain}: {type(persist_err).__name__}: {error_msg}")
-            
-            # Update domain record with error status
-            if SUPABASE_WRITER.is_enabled():
-                SUPABASE_WRITER.upsert_domain(domain, [], error_msg)
-
+        if sink is not None:
+            sink.write_domain(domain, all_domain_products)
+
+        # Hand the rows to the write-behind queue; the journal is updated once they commit
+        if WRITE_QUEUE is not None:
+            WRITE_QUEUE.submit(domain, all_domain_products,
+                               on_done=persist_callback(domain, all_domain_products, state, WRITER))
+        elif state is not None:
+            state.mark_done(domain, len(all_domain_products), max_updated_at(all_domain_products))
+
+    except Throttled as throttled:
+        # Hand the worker back; the scheduler retries this domain after the delay
+        print(f"Rate limited for {domain}, re-queueing in {throttled.delay:.1f}s")
+        return throttled
     except requests.exceptions.RequestException as e:
-        error_msg = f"Request failed: {str(e)}"
-        stats.add_failed_domain(domain, error_msg)
-        # Update domain record with error status
-        if SUPABASE_WRITER.is_enabled():
-            SUPABASE_WRITER.upsert_domain(domain, [], error_msg)
+        _record_failure(domain, f"Request failed: {str(e)}", stats, state)
     except json.JSONDecodeError as e:
-        error_msg = f"Invalid JSON: {str(e)}"
-        stats.add_failed_domain(domain, error_msg)
-        # Update domain record with error status
-        if SUPABASE_WRITER.is_enabled():
-            SUPABASE_WRITER.upsert_domain(domain, [], error_msg)
+        _record_failure(domain, f"Invalid JSON: {str(e)}", stats, state)
     except Exception as e:
-        error_msg = f"Unexpected error: {str(e)}"
-        stats.add_failed_domain(domain, error_msg)
-        # Update domain record with error status
-        if SUPABASE_WRITER.is_enabled():
-            SUPABASE_WRITER.upsert_domain(domain, [], error_msg)
-    finally:
-        stats.rate_limit_semaphore.release()
+        _record_failure(domain, f"Unexpected error: {str(e)}", stats, state)
+    return None
+
+
+def run_threaded(domains: List[str], stats: ScrapingStats, sink: ProductSink, state: Optional[CrawlState],
+                 cache: Optional[HttpCache], max_workers: int) -> None:
+    """Crawl `domains` on a thread pool, re-queueing throttled domains after their delay.
 
+    A re-queued domain keeps its DomainJob, so it resumes at the page it was stopped on
+    instead of fetching the pages it already has again.
+    """
+    jobs: Dict[str, DomainJob] = {domain: DomainJob(domain) for domain in domains}
+    delayed: List[Tuple[float, str]] = []
 
-def main():
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(fetch_domain_products, domain, stats, sink, state, cache, jobs[domain]): domain
+            for domain in jobs
+        }
+        while futures or delayed:
+            now = time.monotonic()
+            while delayed and delayed[0][0] <= now:
+                _, domain = heapq.heappop(delayed)
+                futures[executor.submit(fetch_domain_products, domain, stats, sink, state, cache, jobs[domain])] = domain
+
+            timeout = delayed[0][0] - now if delayed else None
+            if not futures:
+                time.sleep(max(0.0, timeout or 0.0))
+                continue
+            done, _ = concurrent.futures.wait(
+                futures, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+
+            for future in done:
+                domain = futures.pop(future)
+                try:
+                    throttled = future.result()
+                except Exception as e:
+                    print(f"Worker for {domain} crashed: {e}")
+                    throttled = None
+                if throttled is None:
+                    # Finished: drop the job and the products its pager holds
+                    del jobs[domain]
+                    continue
+                # Only 429s count; waiting out an earlier block is not a new throttle
+                job = jobs[domain]
+                job.throttles += throttled.rate_limited
+                if job.throttles > MAX_THROTTLES:
+                    del jobs[domain]
+                    _record_failure(domain, f"Rate limited {job.throttles} times, giving up", stats, state)
+                else:
+                    heapq.heappush(delayed, (time.monotonic() + throttled.delay, domain))
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Fetch products.json from every domain in domains.txt")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="use the asyncio crawl engine instead of the thread pool")
+    parser.add_argument("--concurrency", type=int, default=1000,
+                        help="domains kept in flight by the async engine (default: 1000)")
+    parser.add_argument("--per-host", type=int, default=2,
+                        help="concurrent requests allowed per host in async mode and during a page "
+                             "fan-out (default: 2)")
+    parser.add_argument("--fan-out-pages", type=int, default=0,
+                        help="fetch catalogues of at least this many pages with --per-host concurrent "
+                             "page requests instead of one page at a time (default: 0, off)")
+    parser.add_argument("--shard", type=sharding.parse_shard, metavar="i/N",
+                        help="crawl only shard i of N of domains.txt (0 <= i < N), e.g. one per host; "
+                             "state files get the shard index in their name, output files the full i/N")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="run N shard processes on this machine and merge their summaries (default: 0, off)")
+    parser.add_argument("--output-dir", default="crawl_output",
+                        help="directory for the NDJSON product shards (default: crawl_output)")
+    parser.add_argument("--domains-per-shard", type=int, default=1000,
+                        help="domains written to each shard before rotating (default: 1000)")
+    parser.add_argument("--compress", action="store_true",
+                        help="zstd-compress the product shards")
+    parser.add_argument("--parquet", metavar="DIR",
+                        help="also write products, variants and images as partitioned Parquet datasets to DIR")
+    parser.add_argument("--state", default="crawl_state.sqlite",
+                        help="SQLite crawl journal used to resume and re-crawl (default: crawl_state.sqlite)")
+    parser.add_argument("--recrawl", action="store_true",
+                        help="revisit completed domains, skipping those whose catalogue is unchanged")
+    parser.add_argument("--domain-rate", type=float, default=1.0,
+                        help="initial requests per second per domain, adapted on 429s (default: 1.0)")
+    parser.add_argument("--ip-rate", type=float, default=100.0,
+                        help="requests per second per resolved IP/CDN address (default: 100)")
+    parser.add_argument("--http-cache", metavar="DIR",
+                        help="revalidate pages against an on-disk HTTP cache in DIR")
+    parser.add_argument("--http-cache-max-mb", type=int, default=2048,
+                        help="size budget of the HTTP cache before LRU eviction (default: 2048)")
+    parser.add_argument("--writer", choices=["supabase", "postgres"], default="supabase",
+                        help="persist through the Supabase API or bulk-load over DATABASE_URL with COPY (default: supabase)")
+    parser.add_argument("--database-url",
+                        help="Postgres URL for --writer postgres (default: DATABASE_URL from the environment)")
+    parser.add_argument("--writer-pool", type=int, default=8,
+                        help="pooled connections used by --writer postgres (default: 8)")
+    parser.add_argument("--write-workers", type=int, default=4,
+                        help="write-behind threads persisting batches (default: 4)")
+    parser.add_argument("--write-batch-rows", type=int, default=5000,
+                        help="rows coalesced across domains into one write (default: 5000)")
+    parser.add_argument("--max-pending-rows", type=int, default=100_000,
+                        help="queued rows before crawl workers block on the writers (default: 100000)")
+    parser.add_argument("--raw-json", choices=RAW_JSON_MODES, default="full",
+                        help="raw products.json stored per row: full (read by the frontend), compact "
+                             "(only fields without a column) or none (default: full)")
+    parser.add_argument("--hash-index", default="content_hashes.sqlite",
+                        help="SQLite index of written row hashes used to skip unchanged products; "
+                             "pass an empty string to disable (default: content_hashes.sqlite)")
+    parser.add_argument("--write-all", action="store_true",
+                        help="write every row even if its hash is unchanged, resyncing the database with the index")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
     """Main entry point with graceful shutdown handling."""
+    args = parse_args(argv)
+    if args.shard is not None and args.shards:
+        print("--shard and --shards are mutually exclusive")
+        return 2
     try:
-        _main()
+        if args.shards > 1:
+            run_shards(args)
+        else:
+            _main(args)
     except KeyboardInterrupt:
         print("\nGracefully shutting down...")
         print("Waiting for in-progress tasks to complete (press Ctrl+C again to force quit)...")
@@ -373,29 +646,183 @@ def main():
     return 0
 
 
-def _main():
+def run_shards(args: argparse.Namespace) -> Dict[str, Any]:
+    """Crawl every shard of domains.txt in its own process, then merge their summaries."""
+    shard_args: List[argparse.Namespace] = []
+    for index in range(args.shards):
+        shard = copy.copy(args)
+        shard.shard = (index, args.shards)
+        shard.shards = 0
+        # The processes share this machine's address, so they split its per-IP budget
+        shard.ip_rate = args.ip_rate / args.shards
+        shard_args.append(shard)
+
+    print(f"Starting {args.shards} shard processes...")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.shards) as pool:
+        # A shard returns None when there was nothing to crawl at all (empty domains.txt)
+        summaries = [summary for summary in pool.map(_main, shard_args) if summary is not None]
+    if not summaries:
+        print("No domains to crawl")
+        return {}
+    merged = sharding.merge(summaries)
+    sharding.print_summary(merged)
+    if merged["failed"]:
+        print("\nFailed domains:")
+        for domain, error in merged["failed"].items():
+            print(f"- {domain}: {error}")
+    return merged
+
+
+def _forget_moved_domains(store: Any, shard: sharding.Shard) -> None:
+    """Drop a shard's state for domains that hash elsewhere since the shard count changed."""
+    moved = sharding.moved_away(store.domains(), shard)
+    if moved:
+        print(f"Forgetting {len(moved)} domains that moved to other shards ({type(store).__name__})")
+        store.forget(moved)
+
+
+def _shard_summary(args: argparse.Namespace, stats: ScrapingStats, domains: List[str], skipped: int,
+                   output_files: int) -> Dict[str, Any]:
+    """What `sharding.py merge` needs from one shard, written next to its output."""
+    index, shards = args.shard
+    finished = datetime.now()
+    summary = {
+        "shard": index,
+        "shards": shards,
+        "domains": len(domains),
+        "skipped": skipped,
+        "successful": stats.successful_domains,
+        "unchanged": stats.unchanged_domains,
+        "failed": {domain: stats.errors.get(domain, "") for domain in stats.failed_domains},
+        "products": stats.total_products,
+        "throttles": RATE_LIMITER.throttle_count,
+        "output_files": output_files,
+        "started_at": stats.start_time.astimezone(UTC).isoformat(),
+        "finished_at": finished.astimezone(UTC).isoformat(),
+        "seconds": (finished - stats.start_time).total_seconds(),
+    }
+    path = sharding.write_summary(args.output_dir, summary)
+    print(f"Shard summary written to {path}")
+    return summary
+
+
+def _main(args: argparse.Namespace) -> Optional[Dict[str, Any]]:
+    """Run the crawl; a shard (`args.shard`) returns its summary."""
+    global RATE_LIMITER, WRITER, WRITE_QUEUE, FAN_OUT_PAGES, FAN_OUT_WORKERS
+    RATE_LIMITER = AdaptiveRateLimiter(domain_rate=args.domain_rate, ip_rate=args.ip_rate)
+    FAN_OUT_PAGES = args.fan_out_pages
+    FAN_OUT_WORKERS = args.per_host
+    if args.writer == "postgres":
+        from pg_bulk_writer import PostgresBulkWriter
+
+        WRITER = PostgresBulkWriter(args.database_url, pool_size=args.writer_pool, raw_json=args.raw_json)
+
     # Read domains
     with open("domains.txt", "r") as f:
         domains = [line.strip() for line in f.readlines() if line.strip()]
 
     if not domains:
         print("No domains found in domains.txt")
-        return
-
-    # Initialize statistics
+        return None
+
+    run_tag: Optional[str] = None
+    if args.shard is not None:
+        run_tag = sharding.shard_tag(args.shard)
+        total_domains = len(domains)
+        domains = sharding.select_shard(domains, args.shard)
+        print(f"Shard {args.shard[0]}/{args.shard[1]}: {len(domains)} of {total_domains} domains")
+
+    # Skip domains a previous run already completed
+    state_path = sharding.shard_path(args.state, args.shard)
+    state = CrawlState(state_path)
+    if args.shard is not None:
+        _forget_moved_domains(state, args.shard)
+    total_domains = len(domains)
+    domains = state.select_domains(domains, recrawl=args.recrawl)
+    skipped = total_domains - len(domains)
+    if skipped:
+        print(f"Resuming from {state_path}: skipping {skipped} completed domains")
+    if not domains:
+        print("All domains already completed; pass --recrawl to revisit them")
+        state.close()
+        if args.shard is not None:
+            return _shard_summary(args, ScrapingStats(), domains, skipped, 0)
+        return None
+
+    cache: Optional[HttpCache] = None
+    if args.http_cache:
+        cache = HttpCache(sharding.shard_path(args.http_cache, args.shard),
+                          max_bytes=args.http_cache_max_mb * 1024 * 1024)
+
+    hashes: Optional[ContentHashIndex] = None
+    if WRITER.is_enabled():
+        if args.hash_index:
+            hashes = ContentHashIndex(sharding.shard_path(args.hash_index, args.shard))
+            if args.shard is not None:
+                _forget_moved_domains(hashes, args.shard)
+        WRITE_QUEUE = WriteBehindQueue(
+            WRITER,
+            workers=args.write_workers,
+            batch_rows=args.write_batch_rows,
+            max_pending_rows=args.max_pending_rows,
+            hashes=hashes,
+            write_all=args.write_all,
+            raw_json=args.raw_json,
+        )
+
+    # Initialize statistics and the streaming output
     stats = ScrapingStats()
-    max_workers = min(32, len(domains))
+    sink = ProductSink(
+        output_dir=args.output_dir,
+        domains_per_shard=args.domains_per_shard,
+        compress=args.compress,
+        run_tag=run_tag,
+    )
+    crawl_sink: Any = sink
+    parquet_sink = None
+    if args.parquet:
+        from parquet_export import ParquetSink
+
+        parquet_sink = ParquetSink(args.parquet, raw_json=args.raw_json, run_tag=run_tag)
+        crawl_sink = TeeSink(sink, parquet_sink)
+
+    if args.use_async:
+        from async_crawler import AsyncCrawler
+
+        print(
+            f"Starting to fetch products from {len(domains)} domains with the async engine "
+            f"({args.concurrency} domains in flight, {args.per_host} requests per host)...")
+        crawler = AsyncCrawler(
+            stats=stats,
+            writer=WRITER,
+            headers=HEADERS,
+            endpoints=PRODUCT_ENDPOINTS,
+            sink=crawl_sink,
+            state=state,
+            cache=cache,
+            write_queue=WRITE_QUEUE,
+            limiter=RATE_LIMITER,
+            concurrency=args.concurrency,
+            per_host=args.per_host,
+            fan_out_pages=args.fan_out_pages,
+        )
+        try:
+            crawler.run(domains)
+        finally:
+            crawl_sink.close()
+    else:
+        max_workers = min(32, len(domains))
 
-    print(
-        f"Starting to fetch products from {len(domains)} domains using {max_workers} threads...")
+        print(
+            f"Starting to fetch products from {len(domains)} domains using {max_workers} threads...")
 
-    # Process domains using thread pool
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [
-            executor.submit(fetch_domain_products, domain, stats)
-            for domain in domains
-        ]
-        concurrent.futures.wait(futures)
+        # Process domains using thread pool
+        with crawl_sink:
+            run_threaded(domains, stats, crawl_sink, state, cache, max_workers)
+
+    if WRITE_QUEUE is not None:
+        print("Waiting for queued writes to finish...")
+        WRITE_QUEUE.close()
 
     # Calculate and print summary
     duration = (datetime.now() - stats.start_time).total_seconds()
@@ -406,20 +833,41 @@ def _main():
     print(f"Total domains processed: {len(domains)}")
     print(
         f"Successful domains: {stats.successful_domains} ({success_rate:.1f}%)")
+    print(f"Unchanged domains: {stats.unchanged_domains}")
+    print(f"Rate limit responses: {RATE_LIMITER.throttle_count}")
     print(f"Failed domains: {len(stats.failed_domains)}")
-    print(f"Total products collected: {len(stats.all_products)}")
-
-    # Save products to file
-    with open("products.json", "w") as f:
-        json.dump(stats.all_products, f, indent=2)
-
-    print("\nProducts saved to products.json")
+    print(f"Total products collected: {stats.total_products}")
+    if WRITE_QUEUE is not None:
+        print(
+            f"Persisted: {WRITE_QUEUE.domains_written} domains, {WRITE_QUEUE.rows_written} rows in "
+            f"{WRITE_QUEUE.batches_written} batches ({WRITE_QUEUE.domains_failed} domains failed, "
+            f"crawl blocked on writes for {WRITE_QUEUE.blocked_seconds:.1f}s)")
+    if hashes is not None:
+        print(
+            f"Product changes: {WRITE_QUEUE.products_inserted} inserted, {WRITE_QUEUE.products_changed} changed, "
+            f"{WRITE_QUEUE.products_deleted} deleted, {WRITE_QUEUE.products_unchanged} unchanged (skipped)")
+        hashes.close()
+    print(f"Crawl state: {state.summary()}")
+    state.close()
+    if WRITER is not SUPABASE_WRITER:
+        WRITER.close()
+    if cache is not None:
+        print(f"HTTP cache: {cache.hits} pages revalidated, {cache.total_bytes / 1024 ** 2:.1f} MB on disk")
+        cache.close()
+    print(f"\nProducts saved to {len(sink.shard_paths)} shard(s) in {sink.output_dir}")
+    if parquet_sink is not None:
+        print(f"Parquet datasets: {len(parquet_sink.shard_paths)} file(s) in {parquet_sink.output_dir}")
 
     if stats.failed_domains:
         print("\nFailed domains:")
         for domain in stats.failed_domains:
             print(f"- {domain}")
 
+    if args.shard is not None:
+        output_files = len(sink.shard_paths) + (len(parquet_sink.shard_paths) if parquet_sink is not None else 0)
+        return _shard_summary(args, stats, domains, skipped, output_files)
+    return None
+
 
 if __name__ == "__main__":
     import sys
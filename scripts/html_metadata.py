@@ -0,0 +1,548 @@
+"""
+Single-pass metadata extraction for storefront homepages.
+
+The scraper's original extractors (LegacyExtractor below, now only the benchmark's
+reference) each query a BeautifulSoup tree on their own: `get_text()` is rebuilt for
+the email, currency and "powered by" checks, every `<a>` is walked again for social
+links and regexes are recompiled inside the loops.
+This module collects everything the scraper needs in one pass over the document:
+
+- with selectolax installed, its lexbor C parser builds the tree and a handful
+  of CSS queries pick out the fields
+- otherwise a streaming `html.parser.HTMLParser` subclass gathers the same fields
+  while the document is tokenized, without building a tree at all
+
+All patterns are compiled once at import. Both backends fill the same PageFields and
+share the final interpretation, so they return identical metadata; the heuristics
+match the original extractors (visible text excludes script, style and template
+contents, as BeautifulSoup's get_text does).
+
+    uv run python scripts/html_metadata.py fetch --out pages --limit 200
+    uv run python scripts/html_metadata.py bench --corpus pages
+"""
+
+import argparse
+import json
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as SelectolaxParser
+except ImportError:  # pragma: no cover
+    SelectolaxParser = None
+
+_EMAIL_IN_TEXT = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b')
+_VALID_EMAIL = re.compile(r'^[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}$')
+_THEME_CLASS = re.compile(r'shopify|theme')
+
+# First matching pattern wins, in this order
+_CURRENCY_PATTERNS: List[Tuple[re.Pattern, str]] = [
+    (re.compile(r'\$(\d+)'), 'USD'),
+    (re.compile(r'€(\d+)'), 'EUR'),
+    (re.compile(r'£(\d+)'), 'GBP'),
+    (re.compile(r'¥(\d+)'), 'JPY'),
+    (re.compile(r'CAD'), 'CAD'),
+    (re.compile(r'AUD'), 'AUD'),
+]
+
+_SOCIAL_PATTERNS: List[Tuple[str, re.Pattern]] = [
+    ('twitter', re.compile(r'twitter\.com|x\.com', re.IGNORECASE)),
+    ('facebook', re.compile(r'facebook\.com|fb\.com', re.IGNORECASE)),
+    ('instagram', re.compile(r'instagram\.com', re.IGNORECASE)),
+    ('linkedin', re.compile(r'linkedin\.com', re.IGNORECASE)),
+    ('youtube', re.compile(r'youtube\.com|youtu\.be', re.IGNORECASE)),
+    ('tiktok', re.compile(r'tiktok\.com', re.IGNORECASE)),
+    ('pinterest', re.compile(r'pinterest\.com', re.IGNORECASE)),
+]
+
+_TITLE_SUFFIXES = (' - Shopify', ' | Shopify', ' - Powered by Shopify')
+
+# Elements whose contents are not page text
+_NON_TEXT = frozenset({'script', 'style', 'template'})
+
+
+@dataclass
+class PageFields:
+    """Raw pieces of a homepage, before interpretation."""
+
+    title: Optional[str] = None
+    meta: Dict[str, str] = field(default_factory=dict)
+    h1: List[str] = field(default_factory=list)
+    hrefs: List[str] = field(default_factory=list)
+    text: str = ""
+    theme_class: bool = False
+    json_ld: List[str] = field(default_factory=list)
+
+
+def _record_meta(meta: Dict[str, str], attrs: Dict[str, Optional[str]]) -> None:
+    content = attrs.get('content')
+    if content is None:
+        return
+    # soup.find semantics: the first tag with a given property or name wins
+    for key in (attrs.get('property'), attrs.get('name')):
+        if key and key not in meta:
+            meta[key] = content
+
+
+class _StreamingExtractor(HTMLParser):
+    """Collects PageFields while the document is tokenized."""
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.fields = PageFields()
+        self._text: List[str] = []
+        self._skip_depth = 0
+        self._title: Optional[List[str]] = None
+        self._h1: Optional[List[str]] = None
+        self._h1_depth = 0
+        self._json_ld: Optional[List[str]] = None
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        a = {name: value or '' for name, value in attrs}
+        if not self.fields.theme_class and 'class' in a and _THEME_CLASS.search(a['class']):
+            self.fields.theme_class = True
+
+        if tag == 'meta':
+            _record_meta(self.fields.meta, a)
+        elif tag == 'a':
+            if a.get('href'):
+                self.fields.hrefs.append(a['href'])
+        elif tag == 'title' and self.fields.title is None and self._title is None:
+            self._title = []
+        elif tag == 'h1':
+            if self._h1 is None:
+                self._h1 = []
+            self._h1_depth += 1
+        elif tag in _NON_TEXT:
+            self._skip_depth += 1
+            if tag == 'script' and a.get('type', '').lower() == 'application/ld+json':
+                self._json_ld = []
+
+    def handle_startendtag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        # <meta ... /> and friends; a self-closed script/h1/title is not a container
+        if tag in _NON_TEXT or tag in ('h1', 'title'):
+            return
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == 'title' and self._title is not None:
+            self.fields.title = ''.join(self._title)
+            self._title = None
+        elif tag == 'h1' and self._h1 is not None:
+            self._h1_depth -= 1
+            if self._h1_depth <= 0:
+                self.fields.h1.append(''.join(self._h1))
+                self._h1 = None
+                self._h1_depth = 0
+        elif tag in _NON_TEXT and self._skip_depth:
+            self._skip_depth -= 1
+            if tag == 'script' and self._json_ld is not None:
+                self.fields.json_ld.append(''.join(self._json_ld))
+                self._json_ld = None
+
+    def handle_data(self, data: str) -> None:
+        if self._skip_depth:
+            if self._json_ld is not None:
+                self._json_ld.append(data)
+            return
+        self._text.append(data)
+        if self._title is not None:
+            self._title.append(data)
+        if self._h1 is not None:
+            self._h1.append(data)
+
+    def result(self) -> PageFields:
+        self.close()
+        if self._title is not None:
+            self.fields.title = ''.join(self._title)
+        if self._h1 is not None:
+            self.fields.h1.append(''.join(self._h1))
+        self.fields.text = ''.join(self._text)
+        return self.fields
+
+
+def _fields_html_parser(html: str) -> PageFields:
+    extractor = _StreamingExtractor()
+    extractor.feed(html)
+    return extractor.result()
+
+
+def _fields_selectolax(html: str) -> PageFields:
+    tree = SelectolaxParser(html)
+    fields = PageFields()
+
+    for node in tree.css('meta'):
+        _record_meta(fields.meta, node.attributes)
+    title = tree.css_first('title')
+    if title is not None:
+        fields.title = title.text()
+    fields.h1 = [node.text() for node in tree.css('h1')]
+    fields.hrefs = [href for node in tree.css('a[href]') if (href := node.attributes.get('href'))]
+    fields.theme_class = any(_THEME_CLASS.search(node.attributes.get('class') or '')
+                             for node in tree.css('[class]'))
+    fields.json_ld = [node.text() for node in tree.css('script[type="application/ld+json"]')]
+
+    tree.strip_tags(list(_NON_TEXT))
+    fields.text = tree.root.text() if tree.root is not None else ''
+    return fields
+
+
+def parse_fields(html: str, backend: Optional[str] = None) -> PageFields:
+    """Collect PageFields with `backend` ("selectolax" or "html.parser"; default: fastest available)."""
+    backend = backend or ('selectolax' if SelectolaxParser is not None else 'html.parser')
+    if backend == 'selectolax':
+        if SelectolaxParser is None:
+            raise RuntimeError("selectolax backend requested but the selectolax package is not installed")
+        return _fields_selectolax(html)
+    return _fields_html_parser(html)
+
+
+def _shop_name(fields: PageFields, domain: str) -> Optional[str]:
+    og_title = fields.meta.get('og:title')
+    if og_title:
+        return og_title.strip()
+    if fields.title:
+        title = fields.title.strip()
+        for suffix in _TITLE_SUFFIXES:
+            title = title.replace(suffix, '')
+        if title and title != domain:
+            return title
+    for text in fields.h1:
+        text = text.strip()
+        if text and len(text) < 100:
+            return text
+    return None
+
+
+def _description(fields: PageFields) -> Optional[str]:
+    for key in ('description', 'og:description'):
+        if fields.meta.get(key):
+            return fields.meta[key].strip()
+    return None
+
+
+def _email(fields: PageFields) -> Optional[str]:
+    for href in fields.hrefs:
+        if href.startswith('mailto:'):
+            email = href.replace('mailto:', '').strip()
+            if _VALID_EMAIL.match(email):
+                return email
+    for match in _EMAIL_IN_TEXT.finditer(fields.text):
+        if _VALID_EMAIL.match(match.group()):
+            return match.group()
+    return None
+
+
+def social_links(hrefs: List[str], domain: str) -> Dict[str, str]:
+    """First link per social platform, with relative links resolved against `domain`."""
+    links: Dict[str, str] = {}
+    for href in hrefs:
+        if href.startswith('/'):
+            href = f"https://{domain}{href}"
+        for platform, pattern in _SOCIAL_PATTERNS:
+            if platform not in links and pattern.search(href):
+                links[platform] = href
+        if len(links) == len(_SOCIAL_PATTERNS):
+            break
+    return links
+
+
+def _currency(text: str) -> Optional[str]:
+    for pattern, code in _CURRENCY_PATTERNS:
+        if pattern.search(text):
+            return code
+    return None
+
+
+def interpret(fields: PageFields, domain: str) -> Dict[str, Any]:
+    """Turn PageFields into the scraper's metadata fields."""
+    description = _description(fields)
+    return {
+        'display_name': _shop_name(fields, domain),
+        'description': description,
+        'shop_email': _email(fields),
+        'social_links': social_links(fields.hrefs, domain),
+        'shop_currency': _currency(fields.text),
+        'powered_by_badge': 'shopify' in fields.text.lower(),
+        'meta_description': description,
+        'theme': 'Shopify' if (fields.meta.get('generator', '').lower().find('shopify') >= 0
+                               or fields.theme_class) else None,
+    }
+
+
+def extract(html: str, domain: str, backend: Optional[str] = None) -> Dict[str, Any]:
+    """Every metadata field of one homepage, from a single parse."""
+    return interpret(parse_fields(html, backend), domain)
+
+
+class LegacyExtractor:
+    """The scraper's original per-field BeautifulSoup extractors.
+
+    No longer on the scrape path; `bench` times them and checks that extract()
+    still returns the same metadata.
+    """
+
+    def extract_shop_name(self, soup: Any, domain: str) -> Optional[str]:
+        """Extract shop name from various sources."""
+        # Try og:title first
+        og_title = soup.find('meta', property='og:title')
+        if og_title and og_title.get('content'):
+            return og_title['content'].strip()
+
+        # Try page title
+        title_tag = soup.find('title')
+        if title_tag and title_tag.text:
+            title = title_tag.text.strip()
+            # Remove common suffixes
+            for suffix in [' - Shopify', ' | Shopify', ' - Powered by Shopify']:
+                title = title.replace(suffix, '')
+            if title and title != domain:
+                return title
+
+        # Try h1 tags
+        h1_tags = soup.find_all('h1')
+        for h1 in h1_tags:
+            text = h1.text.strip()
+            if text and len(text) < 100:  # Reasonable shop name length
+                return text
+
+        return None
+
+    def extract_description(self, soup: Any) -> Optional[str]:
+        """Extract shop description from meta tags."""
+        # Try meta description
+        meta_desc = soup.find('meta', attrs={'name': 'description'})
+        if meta_desc and meta_desc.get('content'):
+            return meta_desc['content'].strip()
+
+        # Try og:description
+        og_desc = soup.find('meta', property='og:description')
+        if og_desc and og_desc.get('content'):
+            return og_desc['content'].strip()
+
+        return None
+
+    def extract_contact_email(self, soup: Any) -> Optional[str]:
+        """Extract contact email from the page."""
+        # Look for mailto links
+        mailto_links = soup.find_all('a', href=re.compile(r'^mailto:'))
+        for link in mailto_links:
+            email = link['href'].replace('mailto:', '').strip()
+            if self.is_valid_email(email):
+                return email
+
+        # Look for email patterns in text
+        text_content = soup.get_text()
+        email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
+        emails = re.findall(email_pattern, text_content)
+
+        for email in emails:
+            if self.is_valid_email(email):
+                return email
+
+        return None
+
+    def is_valid_email(self, email: str) -> bool:
+        """Validate email format."""
+        pattern = r'^[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}$'
+        return bool(re.match(pattern, email))
+
+    def extract_social_links(self, soup: Any, domain: str) -> Dict[str, str]:
+        """Extract social media links from the page."""
+        social_links = {}
+
+        # Common social media patterns
+        social_patterns = {
+            'twitter': [r'twitter\.com', r'x\.com'],
+            'facebook': [r'facebook\.com', r'fb\.com'],
+            'instagram': [r'instagram\.com'],
+            'linkedin': [r'linkedin\.com'],
+            'youtube': [r'youtube\.com', r'youtu\.be'],
+            'tiktok': [r'tiktok\.com'],
+            'pinterest': [r'pinterest\.com'],
+        }
+
+        # Find all links
+        links = soup.find_all('a', href=True)
+
+        for link in links:
+            href = link['href']
+            if not href:
+                continue
+
+            # Convert relative URLs to absolute
+            if href.startswith('/'):
+                href = f"https://{domain}{href}"
+
+            # Check against social patterns
+            for platform, patterns in social_patterns.items():
+                if platform not in social_links:  # Only take first match
+                    for pattern in patterns:
+                        if re.search(pattern, href, re.IGNORECASE):
+                            social_links[platform] = href
+                            break
+
+        return social_links
+
+    def extract_currency(self, soup: Any) -> Optional[str]:
+        """Extract currency information from the page."""
+        # Look for currency symbols or codes in text
+        text_content = soup.get_text()
+
+        # Common currency patterns
+        currency_patterns = [
+            r'\$(\d+)',  # USD
+            r'€(\d+)',   # EUR
+            r'£(\d+)',  # GBP
+            r'¥(\d+)',  # JPY
+            r'CAD',      # Canadian Dollar
+            r'AUD',      # Australian Dollar
+        ]
+
+        for pattern in currency_patterns:
+            if re.search(pattern, text_content):
+                if '$' in pattern:
+                    return 'USD'
+                elif '€' in pattern:
+                    return 'EUR'
+                elif '£' in pattern:
+                    return 'GBP'
+                elif '¥' in pattern:
+                    return 'JPY'
+                elif 'CAD' in pattern:
+                    return 'CAD'
+                elif 'AUD' in pattern:
+                    return 'AUD'
+
+        return None
+
+    def detect_shopify_theme(self, soup: Any) -> Optional[str]:
+        """Detect Shopify theme information."""
+        # Look for theme-related meta tags
+        theme_meta = soup.find('meta', attrs={'name': 'generator'})
+        if theme_meta and 'shopify' in theme_meta.get('content', '').lower():
+            return 'Shopify'
+
+        # Look for Shopify-specific classes or IDs
+        shopify_elements = soup.find_all(attrs={'class': re.compile(r'shopify|theme')})
+        if shopify_elements:
+            return 'Shopify'
+
+        return None
+
+    def check_powered_by_badge(self, soup: Any) -> bool:
+        """Check if the store shows 'Powered by Shopify' badge."""
+        text_content = soup.get_text().lower()
+        return 'powered by shopify' in text_content or 'shopify' in text_content
+
+
+def _legacy_extract(html: str, domain: str) -> Dict[str, Any]:
+    from bs4 import BeautifulSoup
+
+    legacy = LegacyExtractor()
+    soup = BeautifulSoup(html, 'html.parser')
+    return {
+        'display_name': legacy.extract_shop_name(soup, domain),
+        'description': legacy.extract_description(soup),
+        'shop_email': legacy.extract_contact_email(soup),
+        'social_links': legacy.extract_social_links(soup, domain),
+        'shop_currency': legacy.extract_currency(soup),
+        'powered_by_badge': legacy.check_powered_by_badge(soup),
+        'meta_description': legacy.extract_description(soup),
+        'theme': legacy.detect_shopify_theme(soup),
+    }
+
+
+def load_corpus(path: str) -> List[Tuple[str, str]]:
+    """(domain, html) pairs from a directory of `<domain>.html` files."""
+    pages = []
+    for name in sorted(os.listdir(path)):
+        if name.endswith('.html'):
+            with open(os.path.join(path, name), encoding='utf-8', errors='replace') as f:
+                pages.append((name[:-len('.html')], f.read()))
+    return pages
+
+
+def bench(pages: List[Tuple[str, str]], repeat: int = 3) -> None:
+    runs: Dict[str, Any] = {'beautifulsoup (legacy)': _legacy_extract,
+                            'html.parser (streaming)': lambda html, domain: extract(html, domain, 'html.parser')}
+    if SelectolaxParser is not None:
+        runs['selectolax'] = lambda html, domain: extract(html, domain, 'selectolax')
+
+    total_mb = sum(len(html.encode('utf-8')) for _, html in pages) / 1e6
+    print(f"{len(pages)} pages, {total_mb:.1f} MB, best of {repeat}")
+    reference: Optional[List[Dict[str, Any]]] = None
+    for name, run in runs.items():
+        best = float('inf')
+        results: List[Dict[str, Any]] = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            results = [run(html, domain) for domain, html in pages]
+            best = min(best, time.perf_counter() - start)
+        if reference is None:
+            reference = results
+            agreement = ''
+        else:
+            same = sum(r == ref for r, ref in zip(results, reference))
+            agreement = f", {same}/{len(pages)} pages identical to legacy"
+        print(f"  {name:<24} {best * 1000 / max(1, len(pages)):7.2f} ms/page "
+              f"{total_mb / best:7.1f} MB/s{agreement}")
+
+
+def fetch_corpus(domains: List[str], out: str, timeout: float = 15.0) -> None:
+    import requests
+
+    from scrape_domain_metadata import DomainMetadataScraper
+
+    os.makedirs(out, exist_ok=True)
+    session = DomainMetadataScraper().session
+    for domain in domains:
+        try:
+            response = session.get(f"https://{domain}/", timeout=timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            print(f"Skipping {domain}: {e}")
+            continue
+        with open(os.path.join(out, f"{domain}.html"), 'w', encoding='utf-8') as f:
+            f.write(response.text)
+        print(f"Saved {domain} ({len(response.content)} bytes)")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark homepage metadata extraction.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    fetch = sub.add_parser("fetch", help="save homepages from domains.txt as a benchmark corpus")
+    fetch.add_argument("--domains", default="domains.txt")
+    fetch.add_argument("--out", default="pages")
+    fetch.add_argument("--limit", type=int, default=200)
+    run = sub.add_parser("bench", help="time each extraction backend over a corpus of saved pages")
+    run.add_argument("--corpus", default="pages", help="directory of <domain>.html files (default: pages)")
+    run.add_argument("--repeat", type=int, default=3)
+    run.add_argument("--show", metavar="DOMAIN", help="print the extracted metadata of one page as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.command == "fetch":
+        with open(args.domains) as f:
+            domains = [line.strip() for line in f if line.strip()][:args.limit]
+        fetch_corpus(domains, args.out)
+        return 0
+
+    pages = load_corpus(args.corpus)
+    if args.show:
+        html = dict(pages)[args.show]
+        print(json.dumps(extract(html, args.show), indent=2, ensure_ascii=False))
+        return 0
+    bench(pages, args.repeat)
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
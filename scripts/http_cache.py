@@ -0,0 +1,137 @@
+"""
+On-disk HTTP cache for products.json pages.
+
+Response bodies are stored zstd-compressed under the cache directory, keyed by a
+hash of the URL, together with the ETag/Last-Modified validators the store sent.
+Later crawls send If-None-Match/If-Modified-Since and reuse the cached body when
+the store answers 304, so unchanged catalogues cost a round-trip but no payload.
+The cache is bounded in size and evicts the least recently used entries.
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+from threading import Lock, get_ident
+from typing import Dict, Optional
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+
+class HttpCache:
+    """Thread-safe, size-bounded LRU cache of response bodies keyed by URL."""
+
+    def __init__(self, directory: str = "http_cache", max_bytes: int = 2 * 1024 ** 3) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock: Lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(os.path.join(directory, "index.sqlite"), check_same_thread=False)
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+            self.conn.commit()
+            self.total_bytes: int = self.conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def _body_path(self, url: str) -> str:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, key[:2], key)
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        """Validators for `url`, or an empty dict if it is not cached."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT etag, last_modified FROM entries WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return {}
+        etag, last_modified = row
+        headers: Dict[str, str] = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def load(self, url: str) -> Optional[bytes]:
+        """Return the cached body for a revalidated `url` and mark it recently used."""
+        try:
+            with open(self._body_path(url), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        with self.lock:
+            self.conn.execute(
+                "UPDATE entries SET last_access = ? WHERE url = ?", (time.time(), url))
+            self.conn.commit()
+        self.hits += 1
+        if zstandard is not None:
+            return zstandard.ZstdDecompressor().decompress(data)
+        return data
+
+    def store(self, url: str, body: bytes, etag: Optional[str], last_modified: Optional[str]) -> None:
+        """Cache `body` if the response carried validators to revalidate it with."""
+        if not etag and not last_modified:
+            return
+
+        data = zstandard.ZstdCompressor(level=3).compress(body) if zstandard is not None else body
+        path = self._body_path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            row = self.conn.execute("SELECT size FROM entries WHERE url = ?", (url,)).fetchone()
+            self.total_bytes += len(data) - (row[0] if row else 0)
+            self.conn.execute("""
+                INSERT INTO entries (url, etag, last_modified, size, last_access) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET
+                    etag = excluded.etag,
+                    last_modified = excluded.last_modified,
+                    size = excluded.size,
+                    last_access = excluded.last_access
+            """, (url, etag, last_modified, len(data), time.time()))
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            self.conn.commit()
+
+    def _evict(self) -> None:
+        """Drop least recently used entries until the cache is back under 90% of its budget."""
+        target = int(self.max_bytes * 0.9)
+        evicted = []
+        for url, size in self.conn.execute("SELECT url, size FROM entries ORDER BY last_access"):
+            if self.total_bytes <= target:
+                break
+            try:
+                os.remove(self._body_path(url))
+            except FileNotFoundError:
+                pass
+            self.total_bytes -= size
+            evicted.append((url,))
+        self.conn.executemany("DELETE FROM entries WHERE url = ?", evicted)
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,191 @@
+"""
+Pagination strategies for products.json.
+
+Shopify storefronts page products.json in two ways:
+
+- `since_id`: keyset pagination. Each request asks for the products whose id is
+  greater than the largest id seen so far, so every page costs the same on the
+  server, and products added or removed mid-crawl cannot shift later pages (no
+  skips, no duplicates).
+- `page`: page numbers. Deep pages get slower, a catalogue that changes during the
+  crawl can shift items across page boundaries, and some themes ignore the
+  parameter and serve page 1 forever.
+
+A Paginator starts with the strategy that worked for the store last time (or tries
+`since_id` when it has none). If the store ignores `since_id`, the second response
+repeats ids at or below the cursor; the paginator notices, keeps the first
+response as page 1 and carries on with `page=2`. The strategy it settles on is
+cached in the crawl state. In either mode products are de-duplicated by id, and a
+page that adds nothing new ends the crawl.
+
+Paginator is a pure state machine: the threaded crawler and the async engine both
+drive it with `query()` / `advance(products)`, and both keep it on the domain's
+DomainJob so a throttled domain resumes where it stopped.
+
+Large catalogues can be fanned out instead: once the first page comes back full,
+the catalogue size (from the last crawl, or /meta.json's
+`published_products_count`) gives the number of pages, and the remaining page
+numbers are fetched concurrently within the domain's politeness budget. since_id
+cannot be fanned out (each cursor depends on the previous page), so a fan-out
+always uses page numbers; `take_pages` feeds the responses back in page order. A
+stale count is harmless: surplus pages come back empty, and a catalogue that grew
+is finished sequentially.
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set
+
+from crawl_state import DomainState
+
+SINCE_ID = "since_id"
+PAGE = "page"
+STRATEGIES = (SINCE_ID, PAGE)
+
+
+def page_query(page: int, per_page: int) -> str:
+    return f"limit={per_page}&page={page}"
+
+
+def catalogue_size(meta: Any) -> Optional[int]:
+    """Published product count from a /meta.json response, if the store reports one."""
+    count = meta.get("published_products_count") if isinstance(meta, dict) else None
+    return count if isinstance(count, int) and count > 0 else None
+
+
+def fan_out_plan(product_count: Optional[int], per_page: int, min_pages: int) -> int:
+    """Pages to fetch concurrently for a catalogue of `product_count` products, or 0 to walk it."""
+    if not product_count or min_pages <= 0:
+        return 0
+    pages = -(-product_count // per_page)
+    return pages if pages >= max(2, min_pages) else 0
+
+
+class Paginator:
+    """Walks one endpoint's products.json pages with the best working strategy."""
+
+    def __init__(self, strategy: Optional[str] = None, per_page: int = 250) -> None:
+        self.strategy: str = strategy if strategy in STRATEGIES else SINCE_ID
+        self.per_page = per_page
+        self.page: int = 1
+        self.since_id: int = 0
+        self.requests: int = 0
+        self.products: List[Dict[str, Any]] = []
+        self._seen: Set[Any] = set()
+        # Set once the store's behaviour has been observed (None: not enough pages to tell)
+        self.detected: Optional[str] = None
+        # After a restart at page 1, pages up to this one may hold only products seen already
+        self._replay_pages: int = 0
+
+    @property
+    def first(self) -> bool:
+        """The next request is the endpoint's first page (the one that carries validators)."""
+        return self.requests == 0
+
+    def query(self) -> str:
+        if self.strategy == SINCE_ID:
+            return f"limit={self.per_page}&since_id={self.since_id}"
+        return page_query(self.page, self.per_page)
+
+    def advance(self, products: List[Dict[str, Any]]) -> bool:
+        """Consume one response; returns True if there is another page to fetch."""
+        self.requests += 1
+        if not products:
+            return False
+        ids = [product.get("id") for product in products]
+
+        if self.strategy == SINCE_ID:
+            if all(isinstance(i, int) and i > self.since_id for i in ids):
+                self._add(products, ids)
+                if self.requests >= 2:
+                    self.detected = SINCE_ID
+                self.since_id = max(ids)
+                return len(products) >= self.per_page
+            # since_id is not honoured here; page numbers take over
+            self.strategy = self.detected = PAGE
+            if self.requests == 2:
+                # The first response was page 1 of the default order and this one repeats it
+                self.page = 2
+                return len(self.products) >= self.per_page
+            if self.requests > 2:
+                # Restart from page 1; products already collected are skipped by id, and the
+                # pages that only repeat them do not end the walk
+                self.page = 1
+                self._replay_pages = -(-len(self.products) // self.per_page)
+                return True
+            # Unusable ids on the very first response: treat it as page 1
+
+        added = self._add(products, ids)
+        if len(products) < self.per_page:
+            return False
+        if not added and self.page > self._replay_pages:
+            # A theme that ignores `page` serves the same products again
+            return False
+        self.page += 1
+        return True
+
+    def switch_to_pages(self) -> int:
+        """Prepare a fan-out and return the first page number it has to fetch.
+
+        Products collected by since_id came back in id order rather than page order,
+        so they are dropped and the fan-out starts again at page 1.
+        """
+        if self.strategy != PAGE:
+            self.strategy = PAGE
+            self.page = 1
+            self.products = []
+            self._seen = set()
+        return self.page
+
+    def take_pages(self, pages: List[List[Dict[str, Any]]]) -> bool:
+        """Consume consecutive pages fetched concurrently, starting at `self.page`.
+
+        Returns True if there is another page to fetch. A full page that adds nothing
+        new means the store ignores `page`; the walk then restarts with since_id and
+        keeps the products collected so far.
+        """
+        for products in pages:
+            self.requests += 1
+            ids = [product.get("id") for product in products]
+            added = self._add(products, ids)
+            if len(products) < self.per_page:
+                return False
+            if not added:
+                self.strategy = SINCE_ID
+                self.since_id = 0
+                return True
+            self.page += 1
+        return True
+
+    def _add(self, products: List[Dict[str, Any]], ids: List[Any]) -> int:
+        added = 0
+        for product, product_id in zip(products, ids):
+            if product_id is not None:
+                if product_id in self._seen:
+                    continue
+                self._seen.add(product_id)
+            self.products.append(product)
+            added += 1
+        return added
+
+
+@dataclass
+class DomainJob:
+    """One domain's crawl, including pagination progress kept across re-queues."""
+
+    domain: str
+    started: bool = False
+    previous: Optional[DomainState] = None
+    throttles: int = 0
+    endpoint_index: int = 0
+    # Set once any endpoint gets an answer, even an empty or 404 one
+    answered: bool = False
+    last_error: Optional[Exception] = None
+    pager: Optional[Paginator] = None
+    catalogue_size: Optional[int] = None
+    # Fan-out pages fetched before a throttle, by page number
+    pages: Dict[int, List[Dict[str, Any]]] = field(default_factory=dict)
+
+    def next_endpoint(self) -> None:
+        self.endpoint_index += 1
+        self.pager = None
+        self.pages = {}
@@ -0,0 +1,413 @@
+"""
+Columnar Parquet datasets of the crawled catalogue.
+
+The NDJSON shards of product_sink.py keep every products.json entry, but any
+analysis of them (domain statistics, price ranges, embedding inputs) has to parse
+whole documents in Python. ParquetSink writes the same crawl as three Parquet
+datasets built from the database rows of product_rows.py:
+
+    <dir>/products/crawl_date=2026-10-17/domain_bucket=07/part-<run>-00012.parquet
+    <dir>/variants/...
+    <dir>/images/...
+
+Partitions are the UTC date of the crawl and a stable hash bucket of the domain,
+so a reader can prune to one day or one store without opening other files. Each
+file is written under a temporary name and renamed once complete, so a crashed run
+never leaves a half-written file behind. Readers use pyarrow.dataset and select
+only the columns they need (`dataset(path, "products")`); populate_domains.py and
+embeddings_create.py accept `--parquet DIR`.
+
+Every row carries the `run_id` of the crawl that wrote it. A domain crawled several
+times, on several days or twice on one day, appears once per run; `latest_crawl`
+keeps each domain's most recent (crawl_date, run_id).
+
+    uv run python scripts/parquet_export.py export crawl_output crawl_parquet
+    uv run python scripts/parquet_export.py stats crawl_parquet
+"""
+
+import argparse
+import hashlib
+import json
+import os
+from datetime import datetime, UTC
+from threading import Lock
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None
+
+import product_codec
+from product_rows import IMAGE_COLUMNS, PRODUCT_COLUMNS, VARIANT_COLUMNS, build_rows
+
+TABLES = ("products", "variants", "images")
+
+DEFAULT_BUCKETS = 16
+
+# Written next to the tables; the bucket count must not change between runs
+MANIFEST = "dataset.json"
+
+_INT_COLUMNS = frozenset({"product_id", "variant_id", "image_id", "position", "width", "height", "grams"})
+_FLOAT_COLUMNS = frozenset({"price", "compare_at_price", "price_min", "price_max"})
+_BOOL_COLUMNS = frozenset({"available", "requires_shipping", "taxable"})
+_TIMESTAMP_COLUMNS = frozenset({"created_at", "updated_at", "published_at", "fetched_at"})
+
+# Columns of each table, in the order of the database tables, then the writing run
+COLUMNS: Dict[str, List[str]] = {
+    # body_html is its own column so text pipelines need not parse raw_json
+    "products": PRODUCT_COLUMNS + ["body_html", "run_id"],
+    "variants": VARIANT_COLUMNS + ["run_id"],
+    "images": IMAGE_COLUMNS + ["run_id"],
+}
+
+PARTITIONING = (("crawl_date", "string"), ("domain_bucket", "int32"))
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise RuntimeError("Parquet output requested but the pyarrow package is not installed")
+
+
+def _column_type(column: str) -> "pa.DataType":
+    if column in _INT_COLUMNS:
+        return pa.int64()
+    if column in _FLOAT_COLUMNS:
+        # An analytics copy; the database keeps exact numeric prices
+        return pa.float64()
+    if column in _BOOL_COLUMNS:
+        return pa.bool_()
+    if column in _TIMESTAMP_COLUMNS:
+        return pa.timestamp("us", tz="UTC")
+    if column == "tags":
+        return pa.list_(pa.string())
+    return pa.string()
+
+
+def schema(table: str) -> "pa.Schema":
+    _require_pyarrow()
+    return pa.schema([(column, _column_type(column)) for column in COLUMNS[table]])
+
+
+def domain_bucket(domain: str, buckets: int = DEFAULT_BUCKETS) -> int:
+    """Stable hash partition of a domain (Python's hash() is salted per process)."""
+    digest = hashlib.blake2b(domain.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % buckets
+
+
+def _tags(value: Any) -> Optional[List[str]]:
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return [tag.strip() for tag in value.split(",") if tag.strip()]
+    return [str(tag) for tag in value if tag is not None]
+
+
+def _int(value: Any) -> Optional[int]:
+    try:
+        return int(value) if value is not None and value != "" else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _timestamp(value: Any) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=UTC)
+
+
+def _array(column: str, values: List[Any]) -> "pa.Array":
+    """One column as Arrow, coercing the occasional malformed storefront value to null."""
+    kind = _column_type(column)
+    if column == "raw_json":
+        return pa.array([None if v is None else product_codec.dumps(v).decode("utf-8") for v in values], pa.string())
+    if column == "tags":
+        return pa.array([_tags(v) for v in values], kind)
+    if column in _FLOAT_COLUMNS:
+        # Prices arrive as numeric strings from parse_price
+        return pa.array(values, pa.string()).cast(kind)
+    if column in _TIMESTAMP_COLUMNS:
+        strings = pa.array([None if v is None else str(v) for v in values], pa.string())
+        try:
+            return strings.cast(kind)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            return pa.array([_timestamp(v) for v in values], kind)
+    try:
+        return pa.array(values, kind)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+        if column in _INT_COLUMNS:
+            return pa.array([_int(v) for v in values], kind)
+        if column in _BOOL_COLUMNS:
+            return pa.array([v if isinstance(v, bool) else None for v in values], kind)
+        return pa.array([None if v is None else str(v) for v in values], kind)
+
+
+def to_arrow(table: str, rows: List[Dict[str, Any]]) -> "pa.Table":
+    return pa.Table.from_arrays(
+        [_array(column, [row.get(column) for row in rows]) for column in COLUMNS[table]],
+        schema=schema(table),
+    )
+
+
+class ParquetSink:
+    """Thread-safe writer of the products/variants/images datasets, with ProductSink's interface.
+
+    Rows are buffered per table and domain bucket. A bucket is written out as one
+    file once it holds `rows_per_file` rows, or, largest first, whenever all buffers
+    together exceed `max_buffered_rows`; `close()` writes the rest.
+    """
+
+    def __init__(
+        self,
+        output_dir: str = "crawl_parquet",
+        buckets: int = DEFAULT_BUCKETS,
+        rows_per_file: int = 50_000,
+        max_buffered_rows: int = 100_000,
+        raw_json: str = "full",
+        compression: str = "zstd",
+        run_tag: Optional[str] = None,
+    ) -> None:
+        _require_pyarrow()
+        self.output_dir = output_dir
+        self.buckets = buckets
+        self.rows_per_file = rows_per_file
+        self.max_buffered_rows = max_buffered_rows
+        self.raw_json = raw_json
+        self.compression = compression
+        started = datetime.now(UTC)
+        self.crawl_date = started.strftime("%Y-%m-%d")
+        # Files of different runs (or crawl shards, see sharding.py) never collide,
+        # so a restarted crawl only adds files
+        self.run_id = started.strftime("%Y%m%dT%H%M%S")
+        if run_tag:
+            self.run_id += f"-{run_tag}"
+        self.lock: Lock = Lock()
+
+        self._buffers: Dict[Tuple[str, int], List[Dict[str, Any]]] = {}
+        self._buffered_rows: int = 0
+        self._file_index: int = 0
+        self.shard_paths: List[str] = []
+        self.rows_written: Dict[str, int] = {table: 0 for table in TABLES}
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._check_manifest()
+
+    def _check_manifest(self) -> None:
+        path = os.path.join(self.output_dir, MANIFEST)
+        if os.path.exists(path):
+            with open(path) as f:
+                existing = json.load(f).get("buckets")
+            if existing != self.buckets:
+                raise RuntimeError(
+                    f"{self.output_dir} is partitioned into {existing} domain buckets, not {self.buckets}")
+            return
+        with open(path, "w") as f:
+            json.dump({"buckets": self.buckets, "tables": list(TABLES)}, f)
+
+    def write_domain(self, domain: str, products: List[Dict[str, Any]]) -> None:
+        """Buffer one domain's rows, writing out any bucket that is full."""
+        if not products:
+            return
+        # Build rows outside the lock; only the buffer bookkeeping is serialized
+        batch = build_rows(products, domain, raw_json=self.raw_json)
+        for row, product in zip(batch.product_rows, (p for p in products if p.get("id") is not None)):
+            row["body_html"] = product.get("body_html")
+        bucket = domain_bucket(domain, self.buckets)
+        tables = {"products": batch.product_rows, "variants": batch.variant_rows, "images": batch.image_rows}
+        for rows in tables.values():
+            for row in rows:
+                row["run_id"] = self.run_id
+
+        with self.lock:
+            for table, rows in tables.items():
+                if rows:
+                    self._buffers.setdefault((table, bucket), []).extend(rows)
+                    self._buffered_rows += len(rows)
+            ready = self._take_ready()
+        for key, rows, index in ready:
+            self._write(key, rows, index)
+
+    def _take_ready(self) -> List[Tuple[Tuple[str, int], List[Dict[str, Any]], int]]:
+        ready = [key for key, rows in self._buffers.items() if len(rows) >= self.rows_per_file]
+        remaining = self._buffered_rows - sum(len(self._buffers[key]) for key in ready)
+        for key in sorted(self._buffers, key=lambda k: len(self._buffers[k]), reverse=True):
+            if remaining <= self.max_buffered_rows:
+                break
+            if key not in ready:
+                ready.append(key)
+                remaining -= len(self._buffers[key])
+        return [self._pop(key) for key in ready]
+
+    def _pop(self, key: Tuple[str, int]) -> Tuple[Tuple[str, int], List[Dict[str, Any]], int]:
+        rows = self._buffers.pop(key)
+        self._buffered_rows -= len(rows)
+        self._file_index += 1
+        return key, rows, self._file_index
+
+    def _write(self, key: Tuple[str, int], rows: List[Dict[str, Any]], index: int) -> None:
+        table, bucket = key
+        directory = os.path.join(
+            self.output_dir, table, f"crawl_date={self.crawl_date}", f"domain_bucket={bucket:02d}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-{self.run_id}-{index:05d}.parquet")
+        pq.write_table(to_arrow(table, rows), path + ".tmp", compression=self.compression)
+        os.replace(path + ".tmp", path)
+        with self.lock:
+            self.shard_paths.append(path)
+            self.rows_written[table] += len(rows)
+
+    def close(self) -> None:
+        with self.lock:
+            pending = [self._pop(key) for key in list(self._buffers)]
+        for key, rows, index in pending:
+            self._write(key, rows, index)
+
+    def __enter__(self) -> "ParquetSink":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def dataset(path: str, table: str) -> "ds.Dataset":
+    """One table of a Parquet crawl directory, with `crawl_date`/`domain_bucket` as columns.
+
+    Files written before `run_id` existed read it as null.
+    """
+    _require_pyarrow()
+    partitions = pa.schema([(name, pa.type_for_alias(kind)) for name, kind in PARTITIONING])
+    return ds.dataset(
+        os.path.join(path, table), format="parquet",
+        schema=pa.unify_schemas([schema(table), partitions]),
+        partitioning=ds.partitioning(partitions, flavor="hive"))
+
+
+def _crawl_key(table: "pa.Table") -> "pa.ChunkedArray":
+    """`crawl_date/run_id` of each row; run ids start with their start time, so keys sort by crawl."""
+    return pc.binary_join_element_wise(table["crawl_date"], pc.fill_null(table["run_id"], ""), "/")
+
+
+def latest_crawls(path: str, table: str = "products") -> "pa.Table":
+    """(domain, crawl) of each domain's most recent crawl in the dataset, by (crawl_date, run_id)."""
+    keys = dataset(path, table).to_table(columns=["domain", "crawl_date", "run_id"])
+    keys = pa.table({"domain": keys["domain"], "crawl": _crawl_key(keys)})
+    latest = keys.group_by("domain").aggregate([("crawl", "max")])
+    return latest.rename_columns(["domain", "crawl"])
+
+
+def latest_crawl(table: "pa.Table", latest: "pa.Table") -> "pa.Table":
+    """Rows of `table` (read with `crawl_date` and `run_id`) that belong to their domain's most recent crawl."""
+    # A filter rather than a join: joins cannot carry list columns such as tags
+    expected = pc.take(latest["crawl"], pc.index_in(table["domain"], value_set=latest["domain"]))
+    return table.filter(pc.equal(_crawl_key(table), expected))
+
+
+def domain_statistics(path: str, domains: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+    """Parquet counterpart of the domain_statistics SQL function (same row shape).
+
+    Reads only the domain, vendor, product type and price columns; every requested
+    domain gets a row, with zero counts when it has no products.
+    """
+    latest = latest_crawls(path)
+    wanted = None if domains is None else ds.field("domain").isin(list(domains))
+
+    products = latest_crawl(dataset(path, "products").to_table(
+        columns=["domain", "crawl_date", "run_id", "product_id", "vendor", "product_type"], filter=wanted), latest)
+    empty = pa.scalar("", pa.string())
+    products = products.set_column(
+        products.schema.get_field_index("vendor"), "vendor",
+        pc.if_else(pc.equal(products["vendor"], empty), pa.scalar(None, pa.string()), products["vendor"]))
+    typed = products.filter(pc.not_equal(products["product_type"], empty))
+    counts = products.group_by("domain").aggregate([("product_id", "count_distinct"), ("vendor", "count_distinct")])
+    types = typed.group_by("domain").aggregate([("product_type", "distinct")])
+
+    variants = latest_crawl(dataset(path, "variants").to_table(
+        columns=["domain", "crawl_date", "run_id", "price"], filter=wanted), latest)
+    prices = variants.group_by("domain").aggregate([("price", "min"), ("price", "max")])
+
+    stats: Dict[str, Dict[str, Any]] = {}
+    for domain, product_count, vendor_count in zip(
+            *(counts[column].to_pylist() for column in ("domain", "product_id_count_distinct", "vendor_count_distinct"))):
+        stats[domain] = {'product_count': product_count, 'vendor_count': vendor_count}
+    for domain, product_types in zip(types["domain"].to_pylist(), types["product_type_distinct"].to_pylist()):
+        stats.setdefault(domain, {})['product_types'] = sorted(product_types)
+    for domain, low, high in zip(*(prices[column].to_pylist() for column in ("domain", "price_min", "price_max"))):
+        stats.setdefault(domain, {}).update(price_range_min=low, price_range_max=high)
+
+    return [
+        {
+            'domain': domain,
+            'product_count': stats.get(domain, {}).get('product_count', 0),
+            'vendor_count': stats.get(domain, {}).get('vendor_count', 0),
+            'product_types': stats.get(domain, {}).get('product_types'),
+            'price_range_min': stats.get(domain, {}).get('price_range_min'),
+            'price_range_max': stats.get(domain, {}).get('price_range_max'),
+        }
+        for domain in (sorted(stats) if domains is None else dict.fromkeys(domains))
+    ]
+
+
+def export(input_path: str, output_dir: str, buckets: int = DEFAULT_BUCKETS, raw_json: str = "full") -> ParquetSink:
+    """Convert NDJSON shards (a sink directory or one shard) into the Parquet datasets.
+
+    The export is one run, so only each domain's latest NDJSON crawl goes into it.
+    """
+    from product_sink import iter_latest_products
+
+    sink = ParquetSink(output_dir, buckets=buckets, raw_json=raw_json)
+    with sink:
+        # The sink writes each domain's products contiguously
+        domain: Optional[str] = None
+        products: List[Dict[str, Any]] = []
+        for product in iter_latest_products(input_path):
+            if product.get("domain") != domain and products:
+                sink.write_domain(domain, products)
+                products = []
+            domain = product.get("domain")
+            products.append(product)
+        if products:
+            sink.write_domain(domain, products)
+    return sink
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from product_rows import RAW_JSON_MODES
+
+    parser = argparse.ArgumentParser(description="Parquet datasets of the crawled catalogue")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export_parser = sub.add_parser("export", help="convert NDJSON crawl shards into Parquet datasets")
+    export_parser.add_argument("input", help="sink directory or shard written by fetch_products_json.py")
+    export_parser.add_argument("output", help="Parquet dataset directory")
+    export_parser.add_argument("--buckets", type=int, default=DEFAULT_BUCKETS,
+                               help=f"domain hash partitions (default: {DEFAULT_BUCKETS})")
+    export_parser.add_argument("--raw-json", choices=RAW_JSON_MODES, default="full",
+                               help="raw products.json kept per row, as in the crawler (default: full)")
+    stats_parser = sub.add_parser("stats", help="per-domain statistics from a Parquet dataset")
+    stats_parser.add_argument("path", help="Parquet dataset directory")
+    stats_parser.add_argument("--limit", type=int, default=20, help="domains to print (default: 20)")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        sink = export(args.input, args.output, buckets=args.buckets, raw_json=args.raw_json)
+        written = ", ".join(f"{rows} {table}" for table, rows in sink.rows_written.items())
+        print(f"Wrote {written} rows in {len(sink.shard_paths)} files to {args.output}")
+        return 0
+
+    statistics = domain_statistics(args.path)
+    print(f"{len(statistics)} domains")
+    for stats in sorted(statistics, key=lambda s: s['product_count'], reverse=True)[:args.limit]:
+        print(f"{stats['domain']}: {stats['product_count']} products, {stats['vendor_count']} vendors, "
+              f"prices {stats['price_range_min']}-{stats['price_range_max']}")
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
@@ -0,0 +1,170 @@
+"""
+Direct Postgres bulk loader for crawled products.
+
+Instead of sending batches of 50 rows through PostgREST behind a global lock, each
+batch is streamed with COPY into a session-local staging table and merged into the
+target table with one set-based `INSERT ... ON CONFLICT DO UPDATE`. Every thread
+checks out its own pooled connection, so concurrent writers load in parallel and
+the database, not a Python lock, becomes the limit.
+
+Works against Supabase (via DATABASE_URL) or any local Postgres with the same
+`products`, `images` and `domains` tables.
+"""
+
+import io
+import re
+from datetime import datetime, UTC
+from typing import Any, Dict, List, Optional, Tuple
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.pool import ThreadedConnectionPool
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+
+import product_codec
+from db import require_database_url, with_sslmode
+from product_rows import IMAGE_COLUMNS, OPTION_COLUMNS, PRODUCT_COLUMNS, VARIANT_COLUMNS, RowBatch, build_rows
+
+# NUL escapes are valid JSON but jsonb rejects them; drop them (keeping escaped backslashes)
+_JSON_NUL = re.compile(rb"(?<!\\)((?:\\\\)*)\\u0000")
+
+
+def _copy_line(row: Dict[str, Any]) -> bytes:
+    """Encode one row as a single-column COPY text-format line holding its JSON."""
+    doc = product_codec.dumps(row)
+    doc = _JSON_NUL.sub(rb"\1", doc)
+    # JSON already escapes newlines and tabs; only backslashes need COPY escaping
+    return doc.replace(b"\\", b"\\\\") + b"\n"
+
+
+class PostgresBulkWriter:
+    """Thread-safe COPY + merge writer with the same interface as SupabaseWriter."""
+
+    def __init__(self, database_url: Optional[str] = None, pool_size: int = 8, schema: str = "public",
+                 raw_json: str = "full") -> None:
+        self.database_url = with_sslmode(database_url) if database_url else require_database_url()
+        self.schema = schema
+        self.raw_json = raw_json
+        self.pool = ThreadedConnectionPool(1, pool_size, self.database_url)
+
+    def is_enabled(self) -> bool:
+        return self.pool is not None and not self.pool.closed
+
+    def _merge_sql(self, table: str, columns: List[str], key: List[str]) -> sql.Composed:
+        target = sql.Identifier(self.schema, table)
+        cols = sql.SQL(", ").join(map(sql.Identifier, columns))
+        updates = sql.SQL(", ").join(
+            sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(c)) for c in columns if c not in key)
+        # Keep the last staged copy of each key: ON CONFLICT cannot touch a row twice
+        return sql.SQL("""
+            INSERT INTO {target} ({cols})
+            SELECT DISTINCT ON ({key}) {r_cols}
+            FROM {stage} AS s, jsonb_populate_record(NULL::{target}, s.doc) AS r
+            ORDER BY {key}, s.seq DESC
+            ON CONFLICT ({key}) DO UPDATE SET {updates}
+        """).format(
+            target=target,
+            cols=cols,
+            r_cols=sql.SQL(", ").join(sql.Identifier("r", c) for c in columns),
+            stage=sql.Identifier(f"_stage_{table}"),
+            key=sql.SQL(", ").join(map(sql.Identifier, key)),
+            updates=updates,
+        )
+
+    def _load(self, cur, table: str, rows: List[Dict[str, Any]], columns: List[str], key: List[str]) -> None:
+        if not rows:
+            return
+        # Temp tables are per session, so pooled connections never see each other's rows
+        cur.execute(sql.SQL(
+            "CREATE TEMP TABLE IF NOT EXISTS {} (seq bigserial, doc jsonb) ON COMMIT DELETE ROWS"
+        ).format(sql.Identifier(f"_stage_{table}")))
+        buffer = io.BytesIO(b"".join(_copy_line(row) for row in rows))
+        cur.copy_expert(
+            sql.SQL("COPY {} (doc) FROM STDIN").format(sql.Identifier(f"_stage_{table}")), buffer)
+        cur.execute(self._merge_sql(table, columns, key))
+
+    def _delete(self, cur, table: str, key: str, keys: List[Tuple[str, Any]]) -> None:
+        if not keys:
+            return
+        domains, ids = zip(*keys)
+        cur.execute(sql.SQL("""
+            DELETE FROM {target} AS t
+            USING unnest(%s::text[], %s::bigint[]) AS gone(domain, id)
+            WHERE t.domain = gone.domain AND t.{key} = gone.id
+        """).format(target=sql.Identifier(self.schema, table), key=sql.Identifier(key)),
+            (list(domains), list(ids)))
+
+    @retry(
+        retry=retry_if_exception_type(psycopg2.OperationalError),
+        stop=stop_after_attempt(5),
+        wait=wait_exponential(multiplier=1, min=1, max=10),
+    )
+    def write_batch(self, batch: RowBatch) -> None:
+        """Load a batch of product and image rows, and apply its deletes, in one transaction."""
+        if not batch:
+            return
+        conn = self.pool.getconn()
+        broken = False
+        try:
+            with conn, conn.cursor() as cur:
+                self._load(cur, "products", batch.product_rows, PRODUCT_COLUMNS, ["domain", "product_id"])
+                self._load(cur, "images", batch.image_rows, IMAGE_COLUMNS, ["domain", "image_id"])
+                # A written product's variants and options replace the stored ones
+                replaced = [(row["domain"], row["product_id"]) for row in batch.product_rows]
+                replaced += batch.product_deletes
+                self._delete(cur, "product_variants", "product_id", replaced)
+                self._delete(cur, "product_options", "product_id", replaced)
+                self._load(cur, "product_variants", batch.variant_rows, VARIANT_COLUMNS, ["domain", "variant_id"])
+                self._load(cur, "product_options", batch.option_rows, OPTION_COLUMNS,
+                           ["domain", "product_id", "position"])
+                self._delete(cur, "images", "image_id", batch.image_deletes)
+                self._delete(cur, "products", "product_id", batch.product_deletes)
+        except psycopg2.OperationalError:
+            broken = True
+            raise
+        finally:
+            self.pool.putconn(conn, close=broken or bool(conn.closed))
+
+    def upsert_products(self, products: List[Dict[str, Any]], domain: str) -> None:
+        if not self.is_enabled() or not products:
+            return
+        self.write_batch(build_rows(products, domain, raw_json=self.raw_json))
+
+    def upsert_domain(self, domain: str, products: List[Dict[str, Any]], error: Optional[str] = None) -> None:
+        """Record the outcome of a fetch attempt on the domain's row."""
+        if not self.is_enabled():
+            return
+
+        now = datetime.now(UTC).isoformat()
+        row: Dict[str, Any] = {
+            "domain": domain,
+            "scraping_status": "failed" if error else "active",
+            "last_scrape_error": error,
+            "last_fetched_at": now,
+            "updated_at": now,
+        }
+        if products:
+            row["product_count"] = len(products)
+
+        columns = list(row)
+        statement = sql.SQL(
+            "INSERT INTO {} ({}) VALUES ({}) ON CONFLICT (domain) DO UPDATE SET {}"
+        ).format(
+            sql.Identifier(self.schema, "domains"),
+            sql.SQL(", ").join(map(sql.Identifier, columns)),
+            sql.SQL(", ").join(sql.Placeholder() * len(columns)),
+            sql.SQL(", ").join(
+                sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(c)) for c in columns if c != "domain"),
+        )
+        conn = self.pool.getconn()
+        try:
+            with conn, conn.cursor() as cur:
+                cur.execute(statement, [row[c] for c in columns])
+        except Exception as e:
+            print(f"Warning: Failed to update domain record for {domain}: {e}")
+        finally:
+            self.pool.putconn(conn, close=bool(conn.closed))
+
+    def close(self) -> None:
+        if not self.pool.closed:
+            self.pool.closeall()
@@ -4,17 +4,22 @@ Populate domains table from existing products data.
 
 This script backfills the domains table by:
 1. Reading domains from domains.txt up to and including 'thesoapopera.com'
-2. Calculating statistics for each domain (product count, vendors, price ranges)
-3. Upserting domain records with the calculated data
+2. Calculating statistics for all domains in bulk (product count, vendors, price ranges)
+   with the domain_statistics SQL function, 1000 domains per call
+3. Upserting domain records with the calculated data in large batches
 4. Optionally triggering metadata scraping for each domain
 
+With `--parquet DIR` the statistics are computed locally from the crawler's Parquet
+datasets (see parquet_export.py), reading only the columns they need.
+
 Note: Only processes domains up to 'thesoapopera.com' as that's where product scraping stopped.
 """
 
 import os
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from datetime import datetime, UTC
 from dotenv import load_dotenv
+from tenacity import retry, stop_after_attempt, wait_exponential
 
 try:
     from supabase import create_client, Client
@@ -24,6 +29,10 @@ except ImportError:
 
 load_dotenv()
 
+# Domains per domain_statistics RPC call and domain rows per upsert request
+STATS_CHUNK_SIZE = 1000
+UPSERT_BATCH_SIZE = 500
+
 with open('domains.txt', 'r') as f:
     domains = [line.strip() for line in f if line.strip()]
 
@@ -31,7 +40,8 @@ with open('domains.txt', 'r') as f:
 class DomainPopulator:
     """Populates domains table from existing products data."""
     
-    def __init__(self):
+    def __init__(self, parquet: Optional[str] = None):
+        self.parquet = parquet
         self.supabase_client = None
         supabase_url = os.getenv("SUPABASE_URL")
         supabase_key = os.getenv("SUPABASE_API_KEY")
@@ -58,109 +68,72 @@ class DomainPopulator:
             print(f"Error processing domains from domains.txt: {e}")
             return []
     
-    def calculate_domain_statistics(self, domain: str) -> Dict[str, Any]:
-        """Calculate statistics for a specific domain."""
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10), reraise=True)
+    def _chunk_statistics(self, chunk: List[str]) -> List[Dict[str, Any]]:
+        result = self.supabase_client.rpc('domain_statistics', {'domain_list': chunk}).execute()
+        return result.data or []
+    
+    def calculate_statistics(self, domains: List[str]) -> List[Dict[str, Any]]:
+        """Calculate statistics for many domains with the domain_statistics SQL aggregate.
+        
+        The database aggregates products and product_variants per domain, so only one
+        small row per domain crosses the wire instead of every product's raw_json.
+        With a Parquet dataset the same rows are aggregated locally instead.
+        
+        A chunk whose call still fails after retries is left out rather than reported
+        as empty, so its domains keep the statistics they already have.
+        """
+        if self.parquet:
+            from parquet_export import domain_statistics
+            return domain_statistics(self.parquet, domains)
         if not self.is_enabled():
-            return {}
+            return []
         
-        try:
-            # Get all products for this domain
-            result = self.supabase_client.table('products').select('*').eq('domain', domain).execute()
-            products = result.data
-            
-            if not products:
-                # Domain exists in domains.txt but no products scraped yet
-                return {
-                    'domain': domain,
-                    'product_count': 0,
-                    'vendor_count': 0,
-                    'product_types': None,
-                    'price_range_min': None,
-                    'price_range_max': None,
-                }
-            
-            # Calculate statistics
-            vendors = set()
-            product_types = set()
-            prices = []
-            
-            for product in products:
-                # Collect vendors
-                vendor = product.get('vendor')
-                if vendor:
-                    vendors.add(vendor)
-                
-                # Collect product types
-                product_type = product.get('product_type')
-                if product_type:
-                    product_types.add(product_type)
-                
-                # Get prices from raw_json variants
-                raw_json = product.get('raw_json', {})
-                variants = raw_json.get('variants', [])
-                
-                for variant in variants:
-                    price_str = variant.get('price')
-                    if price_str:
-                        try:
-                            price = float(price_str)
-                            prices.append(price)
-                        except (ValueError, TypeError):
-                            pass
-            
-            # Calculate price range
-            price_range_min = min(prices) if prices else None
-            price_range_max = max(prices) if prices else None
-            
-            return {
-                'domain': domain,
-                'product_count': len(products),
-                'vendor_count': len(vendors),
-                'product_types': list(product_types) if product_types else None,
-                'price_range_min': price_range_min,
-                'price_range_max': price_range_max,
-            }
-            
-        except Exception as e:
-            print(f"Error calculating statistics for {domain}: {e}")
-            return {
-                'domain': domain,
-                'product_count': 0,
-                'vendor_count': 0,
-                'product_types': None,
-                'price_range_min': None,
-                'price_range_max': None,
-            }
+        statistics: List[Dict[str, Any]] = []
+        for i in range(0, len(domains), STATS_CHUNK_SIZE):
+            chunk = domains[i:i + STATS_CHUNK_SIZE]
+            try:
+                statistics.extend(self._chunk_statistics(chunk))
+            except Exception as e:
+                print(f"Error calculating statistics for {len(chunk)} domains, skipping them: {e}")
+        return statistics
     
-    def upsert_domain_record(self, domain_stats: Dict[str, Any]) -> bool:
-        """Upsert domain record to database."""
+    def calculate_domain_statistics(self, domain: str) -> Dict[str, Any]:
+        """Calculate statistics for a specific domain."""
+        statistics = self.calculate_statistics([domain])
+        return statistics[0] if statistics else {}
+    
+    def upsert_domain_records(self, domain_stats: List[Dict[str, Any]]) -> int:
+        """Upsert domain records in large batches; returns the number written."""
         if not self.is_enabled():
-            return False
+            return 0
         
-        try:
-            # Prepare data for database
-            domain_data = {
-                **domain_stats,
-                'created_at': datetime.now(UTC).isoformat(),
-                'updated_at': datetime.now(UTC).isoformat(),
+        now = datetime.now(UTC).isoformat()
+        rows = [
+            {
+                **stats,
+                'created_at': now,
+                'updated_at': now,
                 'scraping_status': 'pending',
                 'fetch_attempt_count': 0,
-                'successful_fetch_count': 1 if domain_stats['product_count'] > 0 else 0,
+                'successful_fetch_count': 1 if stats['product_count'] > 0 else 0,
             }
-            
-            # Upsert to database
-            result = self.supabase_client.table('domains').upsert(
-                domain_data, 
-                on_conflict='domain'
-            ).execute()
-            
-            status = "with products" if domain_stats['product_count'] > 0 else "pending scraping"
-            print(f"Upserted domain record for {domain_stats['domain']}: {domain_stats['product_count']} products ({status})")
-            return True
-            
-        except Exception as e:
-            print(f"Error upserting domain record for {domain_stats['domain']}: {e}")
-            return False
+            for stats in domain_stats
+        ]
+        
+        written = 0
+        for i in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[i:i + UPSERT_BATCH_SIZE]
+            try:
+                self.supabase_client.table('domains').upsert(batch, on_conflict='domain').execute()
+                written += len(batch)
+            except Exception as e:
+                print(f"Error upserting {len(batch)} domain records: {e}")
+        return written
+    
+    def upsert_domain_record(self, domain_stats: Dict[str, Any]) -> bool:
+        """Upsert domain record to database."""
+        return self.upsert_domain_records([domain_stats]) == 1
     
     def populate_domains(self, scrape_metadata: bool = False) -> None:
         """Main method to populate domains table with domains up to thesoapopera.com."""
@@ -176,32 +149,18 @@ class DomainPopulator:
             print("No domains found to populate")
             return
         
-        successful = 0
-        failed = 0
+        print(f"Calculating statistics for {len(domains)} domains...")
+        domain_stats = self.calculate_statistics(domains)
+        with_products = sum(1 for stats in domain_stats if stats['product_count'] > 0)
+        print(f"  {with_products} domains with products, {len(domain_stats) - with_products} pending scraping")
         
-        for domain in domains:
-            try:
-                print(f"Processing domain: {domain}")
-                
-                # Calculate statistics
-                domain_stats = self.calculate_domain_statistics(domain)
-                
-                # Upsert domain record
-                if self.upsert_domain_record(domain_stats):
-                    successful += 1
-                    
-                    # Optionally trigger metadata scraping
-                    if scrape_metadata:
-                        print(f"Triggering metadata scraping for {domain}...")
-                        # Note: This would require importing and calling the metadata scraper
-                        # For now, we'll just log that it should be done
-                        print(f"TODO: Run metadata scraper for {domain}")
-                else:
-                    failed += 1
-                    
-            except Exception as e:
-                print(f"Error processing domain {domain}: {e}")
-                failed += 1
+        successful = self.upsert_domain_records(domain_stats)
+        failed = len(domains) - successful
+        
+        if scrape_metadata:
+            # Note: This would require importing and calling the metadata scraper
+            # For now, we'll just log that it should be done
+            print("TODO: Run metadata scraper for the populated domains")
         
         print("\nDomain population complete:")
         print(f"  Successful: {successful}")
@@ -215,8 +174,9 @@ def main():
     
     # Parse command line arguments
     scrape_metadata = '--scrape-metadata' in sys.argv
+    parquet = sys.argv[sys.argv.index('--parquet') + 1] if '--parquet' in sys.argv else None
     
-    populator = DomainPopulator()
+    populator = DomainPopulator(parquet=parquet)
     populator.populate_domains(scrape_metadata=scrape_metadata)
 
 
@@ -0,0 +1,203 @@
+"""
+Fast JSON for the crawler's hot path.
+
+Every products.json page is decoded once, and its products are encoded again
+several times: into the NDJSON shards (product_sink.py), into the COPY documents
+of the bulk loader (pg_bulk_writer.py) and into content hashes
+(content_hashes.py). With the stdlib `json` module that round trip costs more CPU
+than the rest of the pipeline put together. When orjson or msgspec is installed
+(`uv sync --extra fast-json`), it takes over:
+
+- decoding: orjson, or msgspec against a typed page envelope that skips every
+  top-level key except `products`
+- encoding: compact UTF-8 with `str()` as the fallback for Decimal values. The
+  output matches `json.dumps(..., ensure_ascii=False, separators=(",", ":"))`
+  byte for byte, so content hashes stay stable whichever backend wrote them. The
+  one exception is the exponent form of very large or small floats (`1e+16`
+  vs `1e16`), which products.json does not use: prices are strings and weights
+  are integer grams.
+
+Input the fast decoders reject (NaN, Infinity) and values they cannot encode
+(integers beyond 64 bits) fall back to the stdlib, so behaviour never depends on
+the backend.
+
+    uv run python scripts/product_codec.py bench crawl_output
+"""
+
+import argparse
+import json
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover
+    msgspec = None
+
+BACKENDS = ("orjson", "msgspec", "json")
+
+# Raised by a fast encoder for a value the stdlib may still handle
+_ENCODE_ERRORS: tuple = (TypeError, ValueError, OverflowError)
+if msgspec is not None:
+    _ENCODE_ERRORS += (msgspec.EncodeError,)
+
+
+def available_backends() -> List[str]:
+    installed = {"orjson": orjson is not None, "msgspec": msgspec is not None, "json": True}
+    return [name for name in BACKENDS if installed[name]]
+
+
+def _json_dumps(obj: Any, sort_keys: bool = False) -> bytes:
+    return json.dumps(obj, sort_keys=sort_keys, ensure_ascii=False, separators=(",", ":"),
+                      default=str).encode("utf-8")
+
+
+if msgspec is not None:
+    class Page(msgspec.Struct):
+        """products.json envelope; products stay plain dicts for the rest of the pipeline."""
+
+        products: List[Dict[str, Any]] = []
+
+
+class Codec:
+    """JSON encoder/decoder pair backed by one of BACKENDS."""
+
+    def __init__(self, backend: Optional[str] = None) -> None:
+        backend = backend or available_backends()[0]
+        if backend not in available_backends():
+            raise RuntimeError(f"JSON backend {backend!r} requested but it is not installed")
+        self.backend = backend
+        self._loads: Callable[[Any], Any] = json.loads
+        self._dumps: Callable[[Any, bool], bytes] = _json_dumps
+        self._decode_page: Optional[Callable[[Any], Any]] = None
+
+        if backend == "orjson":
+            self._loads = orjson.loads
+            self._dumps = lambda obj, sort_keys=False: orjson.dumps(
+                obj, default=str,
+                option=orjson.OPT_PASSTHROUGH_DATETIME | (orjson.OPT_SORT_KEYS if sort_keys else 0))
+        elif backend == "msgspec":
+            self._loads = msgspec.json.decode
+            self._decode_page = msgspec.json.Decoder(Page).decode
+            encoder = msgspec.json.Encoder(enc_hook=str, decimal_format="string")
+            sorted_encoder = msgspec.json.Encoder(enc_hook=str, decimal_format="string", order="sorted")
+            self._dumps = lambda obj, sort_keys=False: (sorted_encoder if sort_keys else encoder).encode(obj)
+
+    def loads(self, data: Any) -> Any:
+        try:
+            return self._loads(data)
+        except ValueError:
+            # orjson and msgspec are stricter than json (NaN, Infinity); json also raises the usual error
+            return json.loads(data)
+
+    def dumps(self, obj: Any, sort_keys: bool = False) -> bytes:
+        """Compact UTF-8 JSON, as json.dumps(ensure_ascii=False, separators=(",", ":"), default=str)."""
+        try:
+            return self._dumps(obj, sort_keys)
+        except _ENCODE_ERRORS:
+            return _json_dumps(obj, sort_keys)
+
+    def decode_products(self, body: bytes) -> List[Dict[str, Any]]:
+        """The `products` array of a products.json page."""
+        if self._decode_page is not None:
+            try:
+                return self._decode_page(body).products
+            except ValueError:
+                pass
+        data = self.loads(body)
+        return data.get("products", []) if isinstance(data, dict) else []
+
+
+# Fastest installed backend, shared by the crawler, the sink and the writers
+CODEC = Codec()
+
+loads = CODEC.loads
+dumps = CODEC.dumps
+decode_products = CODEC.decode_products
+
+
+def bench(pages: List[bytes], repeat: int = 3) -> None:
+    """Per-page CPU cost of decoding and of each re-encoding, per backend."""
+    from product_rows import build_rows
+
+    reference: Optional[List[bytes]] = None
+    print(f"{len(pages)} pages, {sum(len(p) for p in pages) / 1024 ** 2:.1f} MB")
+    # The stdlib runs first and is the reference the others must reproduce
+    for backend in reversed(available_backends()):
+        codec = Codec(backend)
+        timings: Dict[str, float] = {}
+
+        def timed(name: str, func: Callable[[], Any]) -> Any:
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                result = func()
+                best = min(best, time.perf_counter() - start)
+            timings[name] = best * 1000 / len(pages)
+            return result
+
+        decoded = timed("decode", lambda: [codec.decode_products(page) for page in pages])
+        lines = timed("ndjson", lambda: [codec.dumps(p) for products in decoded for p in products])
+        rows = [row for products in decoded for row in build_rows(products, "bench.example").product_rows]
+        timed("copy", lambda: [codec.dumps(row) for row in rows])
+        timed("hash", lambda: [codec.dumps(row, sort_keys=True) for row in rows])
+
+        # Same bytes as the stdlib, or the content hashes would churn on a backend switch
+        hashes = [codec.dumps({k: v for k, v in row.items() if k != "fetched_at"}, sort_keys=True)
+                  for row in rows]
+        identical = "reference"
+        if reference is None:
+            reference = hashes + lines
+        else:
+            identical = "identical" if reference == hashes + lines else "DIFFERENT"
+        total = sum(timings.values())
+        print(f"{backend:>8}: " + ", ".join(f"{name} {ms:.2f}" for name, ms in timings.items())
+              + f" -> {total:.2f} ms/page ({identical})")
+
+
+def load_pages(path: str, per_page: int = 250, limit: int = 200) -> List[bytes]:
+    """products.json pages rebuilt from a sink directory or shard (see product_sink.py)."""
+    from product_sink import iter_products
+
+    pages: List[bytes] = []
+    batch: List[Dict[str, Any]] = []
+    for product in iter_products(path):
+        product.pop("domain", None)
+        batch.append(product)
+        if len(batch) == per_page:
+            pages.append(_json_dumps({"products": batch}))
+            batch = []
+            if len(pages) >= limit:
+                break
+    if batch and len(pages) < limit:
+        pages.append(_json_dumps({"products": batch}))
+    return pages
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="JSON backends for the crawler hot path")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench_parser = sub.add_parser("bench", help="compare the installed backends on crawled products")
+    bench_parser.add_argument("path", nargs="?", default="crawl_output",
+                              help="sink directory or shard to rebuild pages from (default: crawl_output)")
+    bench_parser.add_argument("--pages", type=int, default=200, help="pages to benchmark (default: 200)")
+    bench_parser.add_argument("--repeat", type=int, default=3, help="runs per measurement, best kept (default: 3)")
+    args = parser.parse_args(argv)
+
+    pages = load_pages(args.path, limit=args.pages)
+    if not pages:
+        print(f"No products found in {args.path}")
+        return 1
+    print(f"Backends installed: {', '.join(available_backends())}")
+    bench(pages, repeat=args.repeat)
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
@@ -0,0 +1,232 @@
+"""
+Row shapes for persisting crawled Shopify products.
+
+Both persistence paths (PostgREST via supabase-py and the direct Postgres bulk
+loader) write the same `products`, `images`, `product_variants` and
+`product_options` rows, so they are built here once. Variant prices are parsed into
+numeric columns at ingest, so analytics never has to dig through `raw_json`.
+
+Each product row also carries a search projection (`search_projection`): primary
+image URL, min/max variant price, currency, availability and a short display title,
+so search and listing pages can read narrow columns instead of `raw_json`.
+
+`raw_json` is configurable:
+
+- `full` keeps the whole products.json entry (the frontend reads variants, images
+  and body_html from it)
+- `compact` drops everything already stored in columns or in the images table
+- `none` stores no raw JSON at all
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime, UTC
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, List, Optional, Tuple
+
+PRODUCT_COLUMNS: List[str] = [
+    "domain", "product_id", "handle", "title", "vendor", "product_type", "tags",
+    "created_at", "updated_at", "published_at", "admin_graphql_api_id",
+    "template_suffix", "published_scope", "fetched_at", "raw_json",
+    "image_src", "price_min", "price_max", "currency", "available", "title_short",
+]
+
+IMAGE_COLUMNS: List[str] = [
+    "domain", "image_id", "product_id", "position", "src", "width", "height", "alt",
+    "created_at", "updated_at", "fetched_at", "raw_json",
+]
+
+VARIANT_COLUMNS: List[str] = [
+    "domain", "variant_id", "product_id", "title", "sku", "position",
+    "option1", "option2", "option3", "price", "compare_at_price", "available",
+    "requires_shipping", "taxable", "grams", "created_at", "updated_at", "fetched_at",
+]
+
+OPTION_COLUMNS: List[str] = ["domain", "product_id", "position", "name", "values"]
+
+RAW_JSON_MODES = ("full", "compact", "none")
+
+TITLE_SHORT_CHARS = 80
+
+# products.json keys that `compact` drops because a column or the images table holds them
+_COLUMN_KEYS = frozenset({
+    "id", "domain", "handle", "title", "vendor", "product_type", "tags", "created_at",
+    "updated_at", "published_at", "admin_graphql_api_id", "template_suffix",
+    "published_scope", "images", "image",
+})
+
+
+@dataclass
+class RowBatch:
+    product_rows: List[Dict[str, Any]] = field(default_factory=list)
+    image_rows: List[Dict[str, Any]] = field(default_factory=list)
+    variant_rows: List[Dict[str, Any]] = field(default_factory=list)
+    option_rows: List[Dict[str, Any]] = field(default_factory=list)
+    # (domain, product_id) / (domain, image_id) keys that disappeared from the store
+    product_deletes: List[Tuple[str, Any]] = field(default_factory=list)
+    image_deletes: List[Tuple[str, Any]] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return (len(self.product_rows) + len(self.image_rows)
+                + len(self.variant_rows) + len(self.option_rows)
+                + len(self.product_deletes) + len(self.image_deletes))
+
+    def extend(self, other: "RowBatch") -> None:
+        self.product_rows.extend(other.product_rows)
+        self.image_rows.extend(other.image_rows)
+        self.variant_rows.extend(other.variant_rows)
+        self.option_rows.extend(other.option_rows)
+        self.product_deletes.extend(other.product_deletes)
+        self.image_deletes.extend(other.image_deletes)
+
+
+def parse_price(value: Any) -> Optional[str]:
+    """Normalize a storefront price ("19.90", 19.9) to a numeric string, or None."""
+    if value is None or value == "":
+        return None
+    try:
+        price = Decimal(str(value))
+    except InvalidOperation:
+        return None
+    return str(price) if price.is_finite() else None
+
+
+def _currency(variant: Dict[str, Any]) -> Optional[str]:
+    # products.json only states a currency on some storefronts
+    if variant.get("price_currency"):
+        return variant["price_currency"]
+    for presentment in variant.get("presentment_prices") or []:
+        code = ((presentment or {}).get("price") or {}).get("currency_code")
+        if code:
+            return code
+    return None
+
+
+def search_projection(p: Dict[str, Any]) -> Dict[str, Any]:
+    """Flattened fields a search result or listing card needs for one product."""
+    images = p.get("images") or []
+    image = images[0] if images else p.get("image") or {}
+    variants = p.get("variants") or []
+
+    prices = [Decimal(price) for price in (parse_price(v.get("price")) for v in variants) if price is not None]
+    availability = [v["available"] for v in variants if v.get("available") is not None]
+
+    title = " ".join((p.get("title") or "").split()) or None
+    if title and len(title) > TITLE_SHORT_CHARS:
+        title = title[:TITLE_SHORT_CHARS - 1] + "…"
+
+    return {
+        "image_src": image.get("src"),
+        "price_min": str(min(prices)) if prices else None,
+        "price_max": str(max(prices)) if prices else None,
+        "currency": _currency(variants[0]) if variants else None,
+        "available": any(availability) if availability else None,
+        "title_short": title,
+    }
+
+
+def _raw_json(p: Dict[str, Any], mode: str) -> Optional[Dict[str, Any]]:
+    if mode == "full":
+        return p
+    if mode == "compact":
+        return {k: v for k, v in p.items() if k not in _COLUMN_KEYS}
+    return None
+
+
+def build_rows(products: List[Dict[str, Any]], domain: str, fetched_at: Optional[str] = None,
+               raw_json: str = "full") -> RowBatch:
+    """Turn one domain's products.json payload into product, image, variant and option rows."""
+    fetched_at = fetched_at or datetime.now(UTC).isoformat()
+
+    product_rows: List[Dict[str, Any]] = []
+    image_rows_dict: Dict[str, Dict[str, Any]] = {}
+    variant_rows_dict: Dict[Any, Dict[str, Any]] = {}
+    option_rows: List[Dict[str, Any]] = []
+
+    for p in products:
+        product_id = p.get("id")
+        if product_id is None:
+            continue
+
+        # Core product row with raw_json
+        product_rows.append({
+            "domain": domain,
+            "product_id": product_id,
+            "handle": p.get("handle"),
+            "title": p.get("title"),
+            "vendor": p.get("vendor"),
+            "product_type": p.get("product_type"),
+            "tags": p.get("tags"),
+            "created_at": p.get("created_at"),
+            "updated_at": p.get("updated_at"),
+            "published_at": p.get("published_at"),
+            "admin_graphql_api_id": p.get("admin_graphql_api_id"),
+            "template_suffix": p.get("template_suffix"),
+            "published_scope": p.get("published_scope"),
+            "fetched_at": fetched_at,
+            "raw_json": _raw_json(p, raw_json),
+            **search_projection(p),
+        })
+
+        for variant in p.get("variants", []) or []:
+            variant_id = variant.get("id")
+            if variant_id is None:
+                continue
+            variant_rows_dict[variant_id] = {
+                "domain": domain,
+                "variant_id": variant_id,
+                "product_id": product_id,
+                "title": variant.get("title"),
+                "sku": variant.get("sku"),
+                "position": variant.get("position"),
+                "option1": variant.get("option1"),
+                "option2": variant.get("option2"),
+                "option3": variant.get("option3"),
+                "price": parse_price(variant.get("price")),
+                "compare_at_price": parse_price(variant.get("compare_at_price")),
+                "available": variant.get("available"),
+                "requires_shipping": variant.get("requires_shipping"),
+                "taxable": variant.get("taxable"),
+                "grams": variant.get("grams"),
+                "created_at": variant.get("created_at"),
+                "updated_at": variant.get("updated_at"),
+                "fetched_at": fetched_at,
+            }
+
+        for position, option in enumerate(p.get("options", []) or [], start=1):
+            option_rows.append({
+                "domain": domain,
+                "product_id": product_id,
+                "position": option.get("position") or position,
+                "name": option.get("name"),
+                "values": option.get("values"),
+            })
+
+        # Images - deduplicate by domain and image_id
+        for img in p.get("images", []) or []:
+            image_id = img.get("id")
+            if image_id is None:
+                continue
+
+            # Use dictionary to deduplicate by domain+image_id
+            image_key = f"{domain}:{image_id}"
+            image_rows_dict[image_key] = {
+                "domain": domain,
+                "image_id": image_id,
+                "product_id": product_id,
+                "position": img.get("position"),
+                "src": img.get("src"),
+                "width": img.get("width"),
+                "height": img.get("height"),
+                "alt": img.get("alt"),
+                "created_at": img.get("created_at"),
+                "updated_at": img.get("updated_at"),
+                "fetched_at": fetched_at,
+                "raw_json": img if raw_json == "full" else None,
+            }
+
+    return RowBatch(
+        product_rows,
+        list(image_rows_dict.values()),
+        list(variant_rows_dict.values()),
+        option_rows,
+    )
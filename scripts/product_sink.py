@@ -0,0 +1,171 @@
+"""
+Streaming product sink for the products.json crawler.
+
+Products are appended to newline-delimited JSON shards as soon as a domain finishes,
+so memory stays flat regardless of crawl size and a crash only loses the domains that
+were still in flight. Each shard holds the products of up to `domains_per_shard`
+domains. With compression enabled every domain is written as an independent zstd
+frame, which keeps a partially written shard readable.
+"""
+
+import glob
+import io
+import os
+from datetime import datetime, UTC
+from threading import Lock
+from typing import Any, Dict, Iterator, List, Optional, IO
+
+import product_codec
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+
+class ProductSink:
+    """Thread-safe NDJSON writer that shards output by domain count."""
+
+    def __init__(
+        self,
+        output_dir: str = "crawl_output",
+        domains_per_shard: int = 1000,
+        compress: bool = False,
+        compression_level: int = 3,
+        run_tag: Optional[str] = None,
+    ) -> None:
+        if compress and zstandard is None:
+            raise RuntimeError("zstd compression requested but the zstandard package is not installed")
+
+        self.output_dir = output_dir
+        self.domains_per_shard = domains_per_shard
+        self.compress = compress
+        self.compression_level = compression_level
+        # Shards of different runs never collide, so a restarted crawl only appends;
+        # `run_tag` (the crawl shard, see sharding.py) keeps concurrent runs apart too
+        self.run_id = datetime.now(UTC).strftime("%Y%m%dT%H%M%S")
+        if run_tag:
+            self.run_id += f"-{run_tag}"
+        self.lock: Lock = Lock()
+
+        self._file: Optional[IO[bytes]] = None
+        self._shard_index: int = 0
+        self._domains_in_shard: int = 0
+        self.shard_paths: List[str] = []
+
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def _shard_path(self, index: int) -> str:
+        suffix = ".ndjson.zst" if self.compress else ".ndjson"
+        return os.path.join(self.output_dir, f"products-{self.run_id}-{index:05d}{suffix}")
+
+    def _encode(self, products: List[Dict[str, Any]]) -> bytes:
+        data = b"".join(product_codec.dumps(product) + b"\n" for product in products)
+        if self.compress:
+            # A fresh compressor per domain yields one self-contained frame
+            data = zstandard.ZstdCompressor(level=self.compression_level).compress(data)
+        return data
+
+    def _rotate_if_needed(self) -> None:
+        if self._file is not None and self._domains_in_shard < self.domains_per_shard:
+            return
+        if self._file is not None:
+            self._file.close()
+            self._shard_index += 1
+        path = self._shard_path(self._shard_index)
+        self._file = open(path, "ab")
+        self._domains_in_shard = 0
+        self.shard_paths.append(path)
+
+    def write_domain(self, domain: str, products: List[Dict[str, Any]]) -> None:
+        """Append one domain's products to the current shard."""
+        if not products:
+            return
+        # Serialize and compress outside the lock; only the append is serialized
+        data = self._encode(products)
+        with self.lock:
+            self._rotate_if_needed()
+            assert self._file is not None
+            self._file.write(data)
+            self._file.flush()
+            self._domains_in_shard += 1
+
+    def close(self) -> None:
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self) -> "ProductSink":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class TeeSink:
+    """Hands every domain to several sinks, e.g. the NDJSON shards and a Parquet dataset."""
+
+    def __init__(self, *sinks: Any) -> None:
+        self.sinks = sinks
+
+    def write_domain(self, domain: str, products: List[Dict[str, Any]]) -> None:
+        for sink in self.sinks:
+            sink.write_domain(domain, products)
+
+    def close(self) -> None:
+        for sink in self.sinks:
+            sink.close()
+
+    def __enter__(self) -> "TeeSink":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def shard_paths(path: str) -> List[str]:
+    """Return the shard files for a sink directory, or `path` itself if it is a file."""
+    if os.path.isdir(path):
+        return sorted(
+            glob.glob(os.path.join(path, "products-*.ndjson"))
+            + glob.glob(os.path.join(path, "products-*.ndjson.zst"))
+        )
+    return [path]
+
+
+def _iter_shard(shard: str) -> Iterator[Dict[str, Any]]:
+    with open(shard, "rb") as raw:
+        if shard.endswith(".zst"):
+            if zstandard is None:
+                raise RuntimeError(f"{shard} is zstd-compressed but the zstandard package is not installed")
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+        else:
+            stream = raw
+        for line in io.TextIOWrapper(stream, encoding="utf-8"):
+            line = line.strip()
+            if line:
+                yield product_codec.loads(line)
+
+
+def iter_products(path: str) -> Iterator[Dict[str, Any]]:
+    """Stream products back out of a sink directory or a single shard."""
+    for shard in shard_paths(path):
+        yield from _iter_shard(shard)
+
+
+def iter_latest_products(path: str) -> Iterator[Dict[str, Any]]:
+    """Products of each domain's most recent crawl in a sink directory.
+
+    A run writes all of a domain's products to one shard and shard names sort by run,
+    so the last shard holding a domain has its current catalogue: products the store
+    removed since an earlier crawl are left out. Holds the catalogue in memory.
+    """
+    latest: Dict[str, List[Dict[str, Any]]] = {}
+    for shard in shard_paths(path):
+        crawled: Dict[str, List[Dict[str, Any]]] = {}
+        for product in _iter_shard(shard):
+            crawled.setdefault(product.get("domain"), []).append(product)
+        latest.update(crawled)
+    for products in latest.values():
+        yield from products
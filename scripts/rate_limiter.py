@@ -0,0 +1,214 @@
+"""
+Adaptive, 429-aware rate limiting for storefront crawls.
+
+Every domain gets its own token bucket, and so does every IP address the domains
+resolve to, because most Shopify storefronts sit behind a handful of shared CDN
+addresses. Rates adapt AIMD-style: each successful request nudges a domain's rate
+up, and each 429 halves it and blocks the domain for the store's `Retry-After`
+(or an exponential backoff when the header is missing).
+
+Callers never sleep through a long 429 block. `wait`/`acquire` sleep through
+pacing delays (however slow the domain's adapted rate) and raise Throttled only
+while the domain is blocked after a 429, so the scheduler can re-queue the domain
+and hand the worker to another store. Only a Throttled raised for an actual 429
+(`rate_limited`) counts towards a caller's give-up limit.
+"""
+
+import asyncio
+import random
+import socket
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, UTC
+from email.utils import parsedate_to_datetime
+from threading import Lock
+from typing import Dict, Optional
+
+
+class Throttled(Exception):
+    """The domain may not be requested for another `delay` seconds.
+
+    `rate_limited` is True when the store just answered 429, and False when the
+    limiter is only holding the domain back for an earlier one.
+    """
+
+    def __init__(self, domain: str, delay: float, rate_limited: bool = True) -> None:
+        super().__init__(f"{domain} throttled for {delay:.1f}s")
+        self.domain = domain
+        self.delay = delay
+        self.rate_limited = rate_limited
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given either as seconds or as an HTTP date."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=UTC)
+    return max(0.0, (retry_at - datetime.now(UTC)).total_seconds())
+
+
+@dataclass
+class TokenBucket:
+    rate: float
+    capacity: float
+    tokens: float = field(default=-1.0)
+    updated: float = field(default_factory=time.monotonic)
+
+    def __post_init__(self) -> None:
+        if self.tokens < 0:
+            self.tokens = self.capacity
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+@dataclass
+class _DomainLimit:
+    bucket: TokenBucket
+    blocked_until: float = 0.0
+    consecutive_throttles: int = 0
+
+
+class AdaptiveRateLimiter:
+    """Thread-safe per-domain and per-IP token buckets with AIMD rate adaptation."""
+
+    def __init__(
+        self,
+        domain_rate: float = 1.0,
+        domain_burst: float = 2.0,
+        ip_rate: float = 100.0,
+        ip_burst: float = 200.0,
+        min_domain_rate: float = 0.05,
+        max_domain_rate: float = 4.0,
+        max_wait: float = 2.0,
+    ) -> None:
+        self.domain_rate = domain_rate
+        self.domain_burst = domain_burst
+        self.ip_rate = ip_rate
+        self.ip_burst = ip_burst
+        self.min_domain_rate = min_domain_rate
+        self.max_domain_rate = max_domain_rate
+        self.max_wait = max_wait
+        self.lock: Lock = Lock()
+        self._domains: Dict[str, _DomainLimit] = {}
+        self._ips: Dict[str, TokenBucket] = {}
+        self._resolved: Dict[str, Optional[str]] = {}
+        self.throttle_count: int = 0
+
+    def _domain(self, domain: str) -> _DomainLimit:
+        limit = self._domains.get(domain)
+        if limit is None:
+            limit = _DomainLimit(TokenBucket(self.domain_rate, self.domain_burst))
+            self._domains[domain] = limit
+        return limit
+
+    def _ip(self, domain: str) -> Optional[TokenBucket]:
+        ip = self._resolved.get(domain)
+        if ip is None:
+            return None
+        bucket = self._ips.get(ip)
+        if bucket is None:
+            bucket = TokenBucket(self.ip_rate, self.ip_burst)
+            self._ips[ip] = bucket
+        return bucket
+
+    def resolve(self, domain: str) -> None:
+        """Learn the IP a domain is served from (blocking, cached)."""
+        if domain in self._resolved:
+            return
+        try:
+            infos = socket.getaddrinfo(domain, 443, type=socket.SOCK_STREAM)
+            self._resolved[domain] = infos[0][4][0] if infos else None
+        except OSError:
+            self._resolved[domain] = None
+
+    async def resolve_async(self, domain: str) -> None:
+        """Event-loop friendly variant of `resolve`."""
+        if domain in self._resolved:
+            return
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(domain, 443, type=socket.SOCK_STREAM)
+            self._resolved[domain] = infos[0][4][0] if infos else None
+        except OSError:
+            self._resolved[domain] = None
+
+    def reserve(self, domain: str) -> float:
+        """Take a token for `domain` and return 0, or return the seconds to wait."""
+        now = time.monotonic()
+        with self.lock:
+            limit = self._domain(domain)
+            ip_bucket = self._ip(domain)
+            delay = max(
+                limit.blocked_until - now,
+                limit.bucket.delay(now),
+                ip_bucket.delay(now) if ip_bucket is not None else 0.0,
+            )
+            if delay > 0:
+                return delay
+            limit.bucket.take()
+            if ip_bucket is not None:
+                ip_bucket.take()
+            return 0.0
+
+    def blocked_for(self, domain: str) -> float:
+        """Seconds left of the block imposed on `domain` by its last 429."""
+        with self.lock:
+            return max(0.0, self._domain(domain).blocked_until - time.monotonic())
+
+    def wait(self, domain: str) -> None:
+        """Block until `domain` may be requested; raise Throttled while a 429 block lasts."""
+        self.resolve(domain)
+        while (delay := self.reserve(domain)) > 0:
+            if delay > self.max_wait and self.blocked_for(domain) > self.max_wait:
+                raise Throttled(domain, delay, rate_limited=False)
+            time.sleep(min(delay, self.max_wait))
+
+    async def acquire(self, domain: str) -> None:
+        """Async variant of `wait`."""
+        await self.resolve_async(domain)
+        while (delay := self.reserve(domain)) > 0:
+            if delay > self.max_wait and self.blocked_for(domain) > self.max_wait:
+                raise Throttled(domain, delay, rate_limited=False)
+            await asyncio.sleep(min(delay, self.max_wait))
+
+    def record_success(self, domain: str) -> None:
+        with self.lock:
+            limit = self._domain(domain)
+            limit.consecutive_throttles = 0
+            limit.bucket.rate = min(self.max_domain_rate, limit.bucket.rate + 0.05)
+            ip_bucket = self._ip(domain)
+            if ip_bucket is not None:
+                ip_bucket.rate = min(self.ip_rate, ip_bucket.rate + 0.5)
+
+    def record_throttle(self, domain: str, retry_after: Optional[str] = None) -> float:
+        """Back off after a 429 and return the seconds before `domain` may be retried."""
+        with self.lock:
+            self.throttle_count += 1
+            limit = self._domain(domain)
+            limit.consecutive_throttles += 1
+            limit.bucket.rate = max(self.min_domain_rate, limit.bucket.rate / 2)
+            # The CDN address is shared by many stores: slow it down more gently
+            ip_bucket = self._ip(domain)
+            if ip_bucket is not None:
+                ip_bucket.rate = max(1.0, ip_bucket.rate * 0.8)
+
+            delay = parse_retry_after(retry_after)
+            if delay is None:
+                delay = min(300.0, 5.0 * 2 ** (limit.consecutive_throttles - 1))
+                delay *= 0.5 + random.random()
+            limit.blocked_until = time.monotonic() + delay
+            return delay
@@ -8,20 +8,32 @@ This script scrapes metadata from Shopify storefronts including:
 - Social media links
 - Currency and theme information
 - Meta tags and SEO data
+
+By default domains are scraped one at a time. `--async` runs the same extraction
+through async_metadata.py: many domains concurrently over pooled connections, with
+per-host politeness from rate_limiter.py instead of a fixed sleep before every
+request. Both modes upsert `domains` rows in batches.
+
+With `--source lightweight` (the default) a store is described from /meta.json, the
+homepage `<head>` and /cart.js (see storefront_metadata.py), and the full homepage
+is only downloaded when those do not identify the shop. `--source html` always
+parses the whole homepage.
 """
 
+import argparse
 import os
-import re
 import time
 import random
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime, UTC
 
 import requests
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 from tenacity import retry, stop_after_attempt, wait_exponential
 
+import html_metadata
+import storefront_metadata
+
 try:
     from supabase import create_client, Client
 except ImportError:
@@ -30,11 +42,15 @@ except ImportError:
 
 load_dotenv()
 
+# Domain rows per upsert request
+UPSERT_BATCH_SIZE = 500
+
 
 class DomainMetadataScraper:
     """Scrapes metadata from Shopify storefronts."""
     
-    def __init__(self):
+    def __init__(self, source: str = 'html'):
+        self.source = source
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
@@ -57,8 +73,8 @@ class DomainMetadataScraper:
                 print(f"Warning: Failed to initialize Supabase client: {e}")
     
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
-    def fetch_page(self, url: str) -> Optional[BeautifulSoup]:
-        """Fetch and parse a webpage."""
+    def fetch_page(self, url: str) -> Optional[str]:
+        """Fetch a webpage's HTML."""
         try:
             # Add random delay to avoid rate limiting
             time.sleep(random.uniform(0.5, 2.0))
@@ -66,165 +82,63 @@ class DomainMetadataScraper:
             response = self.session.get(url, timeout=15)
             response.raise_for_status()
             
-            soup = BeautifulSoup(response.text, 'html.parser')
-            return soup
+            return response.text
             
         except requests.RequestException as e:
             print(f"Error fetching {url}: {e}")
             return None
     
-    def extract_shop_name(self, soup: BeautifulSoup, domain: str) -> Optional[str]:
-        """Extract shop name from various sources."""
-        # Try og:title first
-        og_title = soup.find('meta', property='og:title')
-        if og_title and og_title.get('content'):
-            return og_title['content'].strip()
-        
-        # Try page title
-        title_tag = soup.find('title')
-        if title_tag and title_tag.text:
-            title = title_tag.text.strip()
-            # Remove common suffixes
-            for suffix in [' - Shopify', ' | Shopify', ' - Powered by Shopify']:
-                title = title.replace(suffix, '')
-            if title and title != domain:
-                return title
-        
-        # Try h1 tags
-        h1_tags = soup.find_all('h1')
-        for h1 in h1_tags:
-            text = h1.text.strip()
-            if text and len(text) < 100:  # Reasonable shop name length
-                return text
-        
-        return None
-    
-    def extract_description(self, soup: BeautifulSoup) -> Optional[str]:
-        """Extract shop description from meta tags."""
-        # Try meta description
-        meta_desc = soup.find('meta', attrs={'name': 'description'})
-        if meta_desc and meta_desc.get('content'):
-            return meta_desc['content'].strip()
-        
-        # Try og:description
-        og_desc = soup.find('meta', property='og:description')
-        if og_desc and og_desc.get('content'):
-            return og_desc['content'].strip()
-        
-        return None
-    
-    def extract_contact_email(self, soup: BeautifulSoup) -> Optional[str]:
-        """Extract contact email from the page."""
-        # Look for mailto links
-        mailto_links = soup.find_all('a', href=re.compile(r'^mailto:'))
-        for link in mailto_links:
-            email = link['href'].replace('mailto:', '').strip()
-            if self.is_valid_email(email):
-                return email
-        
-        # Look for email patterns in text
-        text_content = soup.get_text()
-        email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-        emails = re.findall(email_pattern, text_content)
-        
-        for email in emails:
-            if self.is_valid_email(email):
-                return email
-        
-        return None
-    
-    def is_valid_email(self, email: str) -> bool:
-        """Validate email format."""
-        pattern = r'^[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}$'
-        return bool(re.match(pattern, email))
+    def fetch_json(self, url: str) -> Tuple[Optional[Any], int]:
+        """Fetch a JSON endpoint; returns (data or None, bytes read)."""
+        try:
+            time.sleep(random.uniform(0.5, 2.0))
+            response = self.session.get(url, timeout=15, headers={'Accept': 'application/json'})
+            response.raise_for_status()
+            return response.json(), len(response.content)
+        except (requests.RequestException, ValueError):
+            return None, 0
     
-    def extract_social_links(self, soup: BeautifulSoup) -> Dict[str, str]:
-        """Extract social media links from the page."""
-        social_links = {}
-        
-        # Common social media patterns
-        social_patterns = {
-            'twitter': [r'twitter\.com', r'x\.com'],
-            'facebook': [r'facebook\.com', r'fb\.com'],
-            'instagram': [r'instagram\.com'],
-            'linkedin': [r'linkedin\.com'],
-            'youtube': [r'youtube\.com', r'youtu\.be'],
-            'tiktok': [r'tiktok\.com'],
-            'pinterest': [r'pinterest\.com'],
-        }
-        
-        # Find all links
-        links = soup.find_all('a', href=True)
-        
-        for link in links:
-            href = link['href']
-            if not href:
-                continue
-            
-            # Convert relative URLs to absolute
-            if href.startswith('/'):
-                href = f"https://{self.domain}{href}"
-            
-            # Check against social patterns
-            for platform, patterns in social_patterns.items():
-                if platform not in social_links:  # Only take first match
-                    for pattern in patterns:
-                        if re.search(pattern, href, re.IGNORECASE):
-                            social_links[platform] = href
-                            break
-        
-        return social_links
+    def fetch_head(self, url: str) -> Tuple[Optional[str], int]:
+        """Fetch a page only up to its </head>; returns (head HTML or None, bytes read)."""
+        try:
+            time.sleep(random.uniform(0.5, 2.0))
+            with self.session.get(url, timeout=15, stream=True) as response:
+                response.raise_for_status()
+                head = storefront_metadata.read_head(response.iter_content(16384))
+                return head.decode(response.encoding or 'utf-8', errors='replace'), len(head)
+        except requests.RequestException as e:
+            print(f"Error fetching {url}: {e}")
+            return None, 0
     
-    def extract_currency(self, soup: BeautifulSoup) -> Optional[str]:
-        """Extract currency information from the page."""
-        # Look for currency symbols or codes in text
-        text_content = soup.get_text()
-        
-        # Common currency patterns
-        currency_patterns = [
-            r'\$(\d+)',  # USD
-            r'€(\d+)',   # EUR
-            r'£(\d+)',  # GBP
-            r'¥(\d+)',  # JPY
-            r'CAD',      # Canadian Dollar
-            r'AUD',      # Australian Dollar
-        ]
+    def scrape_lightweight(self, domain: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        """Fill `metadata` from /meta.json, the homepage head and (if needed) /cart.js."""
+        sources: List[str] = []
+        fetched = 0
         
-        for pattern in currency_patterns:
-            if re.search(pattern, text_content):
-                if '$' in pattern:
-                    return 'USD'
-                elif '€' in pattern:
-                    return 'EUR'
-                elif '£' in pattern:
-                    return 'GBP'
-                elif '¥' in pattern:
-                    return 'JPY'
-                elif 'CAD' in pattern:
-                    return 'CAD'
-                elif 'AUD' in pattern:
-                    return 'AUD'
+        data, size = self.fetch_json(f"https://{domain}/meta.json")
+        meta_json = storefront_metadata.parse_meta_json(data)
+        fetched += size
+        if meta_json:
+            sources.append('meta.json')
         
-        return None
-    
-    def detect_shopify_theme(self, soup: BeautifulSoup) -> Optional[str]:
-        """Detect Shopify theme information."""
-        # Look for theme-related meta tags
-        theme_meta = soup.find('meta', attrs={'name': 'generator'})
-        if theme_meta and 'shopify' in theme_meta.get('content', '').lower():
-            return 'Shopify'
+        head_html, size = self.fetch_head(f"https://{domain}/")
+        head = storefront_metadata.parse_head(head_html, domain) if head_html else {}
+        fetched += size
+        if head_html:
+            sources.append('head')
         
-        # Look for Shopify-specific classes or IDs
-        shopify_elements = soup.find_all(attrs={'class': re.compile(r'shopify|theme')})
-        if shopify_elements:
-            return 'Shopify'
+        cart_currency = None
+        if storefront_metadata.needs_currency(meta_json):
+            data, size = self.fetch_json(f"https://{domain}/cart.js")
+            cart_currency = storefront_metadata.parse_cart_js(data)
+            fetched += size
+            if cart_currency:
+                sources.append('cart.js')
         
-        return None
-    
-    def check_powered_by_badge(self, soup: BeautifulSoup) -> bool:
-        """Check if the store shows 'Powered by Shopify' badge."""
-        text_content = soup.get_text().lower()
-        return 'powered by shopify' in text_content or 'shopify' in text_content
+        metadata.update(storefront_metadata.combine(domain, meta_json, head, cart_currency))
+        metadata['metadata_sources'] = sources
+        metadata['fetched_bytes'] = fetched
+        return metadata
     
     def scrape_domain_metadata(self, domain: str) -> Dict[str, Any]:
         """Scrape comprehensive metadata for a domain."""
@@ -235,71 +149,120 @@ class DomainMetadataScraper:
             'scraped_at': datetime.now(UTC).isoformat(),
         }
         
+        if self.source == 'lightweight':
+            self.scrape_lightweight(domain, metadata)
+            if not storefront_metadata.needs_html(metadata):
+                return metadata
+        
         # Fetch homepage
         homepage_url = f"https://{domain}/"
-        soup = self.fetch_page(homepage_url)
+        html = self.fetch_page(homepage_url)
         
-        if not soup:
+        if not html:
             metadata['error'] = 'Failed to fetch homepage'
             return metadata
         
-        # Extract various metadata
-        metadata['display_name'] = self.extract_shop_name(soup, domain)
-        metadata['description'] = self.extract_description(soup)
-        metadata['shop_email'] = self.extract_contact_email(soup)
-        metadata['social_links'] = self.extract_social_links(soup)
-        metadata['shop_currency'] = self.extract_currency(soup)
-        metadata['powered_by_badge'] = self.check_powered_by_badge(soup)
-        metadata['meta_description'] = self.extract_description(soup)
+        metadata['metadata_sources'] = metadata.get('metadata_sources', []) + ['html']
+        metadata['fetched_bytes'] = metadata.get('fetched_bytes', 0) + len(html.encode('utf-8'))
+        return self.extract_metadata(domain, html, metadata)
+    
+    def extract_metadata(self, domain: str, html: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        """Fill `metadata` with every field extracted from the homepage, in one parse (html_metadata.py)."""
+        # A currency from meta.json or cart.js beats the guess from page text
+        currency = metadata.get('shop_currency')
+        metadata.update(html_metadata.extract(html, domain))
+        if currency:
+            metadata['shop_currency'] = currency
         
         # Store raw HTML for future analysis
-        metadata['raw_html'] = str(soup)[:10000]  # Limit size
+        metadata['raw_html'] = html[:10000]  # Limit size
         
         return metadata
     
-    def upsert_domain_metadata(self, domain: str, metadata: Dict[str, Any]) -> bool:
-        """Upsert domain metadata to Supabase."""
+    @staticmethod
+    def domain_record(domain: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        """Shape scraped metadata as a `domains` row.
+
+        Without the full homepage, empty HTML_ONLY_FIELDS are left out so the upsert
+        keeps the values of an earlier full-page scrape.
+        """
+        record = {
+            'domain': domain,
+            'display_name': metadata.get('display_name'),
+            'description': metadata.get('description'),
+            'shop_email': metadata.get('shop_email'),
+            'shop_currency': metadata.get('shop_currency'),
+            'powered_by_badge': metadata.get('powered_by_badge'),
+            'meta_description': metadata.get('meta_description'),
+            'social_links': metadata.get('social_links'),
+            'raw_metadata': metadata,
+            'updated_at': datetime.now(UTC).isoformat(),
+        }
+        if not storefront_metadata.from_html(metadata):
+            for key in storefront_metadata.HTML_ONLY_FIELDS:
+                if not record[key]:
+                    del record[key]
+        return record
+    
+    def upsert_domain_records(self, records: List[Dict[str, Any]]) -> int:
+        """Upsert `domains` rows in batches; returns the number written."""
         if not self.supabase_client:
             print("Supabase client not available, skipping database update")
-            return False
+            return 0
         
-        try:
-            # Prepare data for database
-            db_data = {
-                'domain': domain,
-                'display_name': metadata.get('display_name'),
-                'description': metadata.get('description'),
-                'shop_email': metadata.get('shop_email'),
-                'shop_currency': metadata.get('shop_currency'),
-                'powered_by_badge': metadata.get('powered_by_badge'),
-                'meta_description': metadata.get('meta_description'),
-                'social_links': metadata.get('social_links'),
-                'raw_metadata': metadata,
-                'updated_at': datetime.now(UTC).isoformat(),
-            }
-            
-            # Upsert to database
-            result = self.supabase_client.table('domains').upsert(
-                db_data, 
-                on_conflict='domain'
-            ).execute()
-            
-            print(f"Successfully updated metadata for {domain}")
-            return True
-            
-        except Exception as e:
-            print(f"Error updating metadata for {domain}: {e}")
+        # A bulk upsert needs the same columns in every row, and only the columns it
+        # sends are updated, so rows that leave some out are upserted separately
+        by_columns: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+        for record in records:
+            by_columns.setdefault(tuple(sorted(record)), []).append(record)
+
+        written = 0
+        for group in by_columns.values():
+            for i in range(0, len(group), UPSERT_BATCH_SIZE):
+                batch = group[i:i + UPSERT_BATCH_SIZE]
+                try:
+                    self.supabase_client.table('domains').upsert(batch, on_conflict='domain').execute()
+                    written += len(batch)
+                except Exception as e:
+                    print(f"Error upserting metadata for {len(batch)} domains: {e}")
+        return written
+    
+    def upsert_domain_metadata(self, domain: str, metadata: Dict[str, Any]) -> bool:
+        """Upsert domain metadata to Supabase."""
+        if self.upsert_domain_records([self.domain_record(domain, metadata)]) != 1:
             return False
+        print(f"Successfully updated metadata for {domain}")
+        return True
 
 
-def main():
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Scrape Shopify storefront metadata into the domains table.")
+    parser.add_argument("domains", nargs="*", help="domains to scrape (default: every domain in domains.txt)")
+    parser.add_argument("--source", choices=storefront_metadata.SOURCES, default="lightweight",
+                        help="lightweight: meta.json, page head and cart.js, falling back to the full "
+                             "homepage only when needed; html: always parse the full homepage "
+                             "(default: lightweight)")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="scrape many domains concurrently instead of one at a time")
+    parser.add_argument("--concurrency", type=int, default=200,
+                        help="domains kept in flight in async mode (default: 200)")
+    parser.add_argument("--per-host", type=int, default=1,
+                        help="concurrent requests allowed per host in async mode (default: 1)")
+    parser.add_argument("--ip-rate", type=float, default=50.0,
+                        help="requests per second per storefront IP in async mode (default: 50)")
+    parser.add_argument("--batch-size", type=int, default=UPSERT_BATCH_SIZE,
+                        help=f"domain rows per upsert (default: {UPSERT_BATCH_SIZE})")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
     """Main function to scrape metadata for domains."""
-    scraper = DomainMetadataScraper()
+    args = parse_args(argv)
+    scraper = DomainMetadataScraper(source=args.source)
     
     # Read domains from file or command line
-    import sys
-    if len(sys.argv) > 1:
-        domains = sys.argv[1:]
+    if args.domains:
+        domains = args.domains
     else:
         # Read from domains.txt
         try:
@@ -311,24 +274,47 @@ def main():
     
     print(f"Scraping metadata for {len(domains)} domains...")
     
-    successful = 0
-    failed = 0
-    
-    for domain in domains:
-        try:
-            metadata = scraper.scrape_domain_metadata(domain)
-            success = scraper.upsert_domain_metadata(domain, metadata)
-            
-            if success:
-                successful += 1
-            else:
+    if args.use_async:
+        from async_metadata import AsyncMetadataScraper
+        from rate_limiter import AdaptiveRateLimiter
+        
+        engine = AsyncMetadataScraper(
+            scraper,
+            concurrency=args.concurrency,
+            per_host=args.per_host,
+            batch_size=args.batch_size,
+            limiter=AdaptiveRateLimiter(ip_rate=args.ip_rate, ip_burst=args.ip_rate * 2),
+        )
+        engine.run(domains)
+        successful, failed = engine.written, len(domains) - engine.written
+        fetched_bytes = engine.fetched_bytes
+    else:
+        successful = 0
+        failed = 0
+        fetched_bytes = 0
+        pending: List[Dict[str, Any]] = []
+        
+        def flush() -> None:
+            nonlocal successful, failed
+            written = scraper.upsert_domain_records(pending)
+            successful += written
+            failed += len(pending) - written
+            pending.clear()
+        
+        for domain in domains:
+            try:
+                metadata = scraper.scrape_domain_metadata(domain)
+                fetched_bytes += metadata.get('fetched_bytes', 0)
+                pending.append(scraper.domain_record(domain, metadata))
+                if len(pending) >= args.batch_size:
+                    flush()
+            except Exception as e:
+                print(f"Error processing {domain}: {e}")
                 failed += 1
-                
-        except Exception as e:
-            print(f"Error processing {domain}: {e}")
-            failed += 1
+        flush()
     
-    print(f"\nScraping complete: {successful} successful, {failed} failed")
+    print(f"\nScraping complete: {successful} successful, {failed} failed "
+          f"({fetched_bytes / 1e6:.1f} MB fetched)")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,334 @@
+"""
+Self-hosted product search over the crawler's output.
+
+Serves the same contract as the `products-search` edge function the frontend calls
+(`frontend/lib/productSearch.ts`):
+
+    GET /products-search?q=soap&domain=example.com&sort=rank|recent&limit=24&cursor=...
+    -> {"items": [{"domain", "product_id", "title", "src", "price"}], "total",
+        "hasMore", "nextCursor", "sort"}
+
+The index is built in memory from each domain's most recent crawl in the ProductSink
+shards (`crawl_output/`), so products a store removed drop out of search: a BM25
+inverted index over title, vendor and tags (title terms count double). With
+`--vector-index` (see vector_index.py) the query is also embedded locally and the
+BM25 and vector rankings are merged with reciprocal rank fusion, so products that
+match semantically but share no words with the query still surface.
+
+    uv run python scripts/search_service.py --input crawl_output --port 8787
+    NEXT_PUBLIC_PRODUCTS_SEARCH_URL=http://localhost:8787/products-search npm run dev
+
+`--bench queries.txt` runs one query per line against the index and prints latency
+percentiles instead of serving.
+"""
+
+import argparse
+import base64
+import json
+import math
+import re
+import time
+from collections import defaultdict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from product_rows import search_projection
+from product_sink import iter_latest_products
+
+SORTS = ("rank", "recent")
+DEFAULT_LIMIT = 24
+MAX_LIMIT = 100
+
+# Per-field term weights for BM25
+FIELD_WEIGHTS: Dict[str, float] = {"title": 2.0, "vendor": 1.0, "tags": 1.0}
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Reciprocal rank fusion constant; 60 is the usual choice
+RRF_K = 60
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.casefold())
+
+
+def _timestamp(value: Any) -> float:
+    if not value:
+        return 0.0
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _field_text(product: Dict[str, Any], field: str) -> str:
+    value = product.get(field)
+    if isinstance(value, list):
+        return " ".join(str(v) for v in value)
+    return value or ""
+
+
+def encode_cursor(offset: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"offset": offset}).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        offset = int(json.loads(base64.urlsafe_b64decode(padded))["offset"])
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("invalid cursor")
+    if offset < 0:
+        raise ValueError("invalid cursor")
+    return offset
+
+
+class SearchIndex:
+    """BM25 inverted index (plus optional vector index) over the crawled catalogue."""
+
+    def __init__(self, products: Any, vector_index: Any = None, encoder: Any = None) -> None:
+        self.vector_index = vector_index
+        self.encoder = encoder
+
+        # One document per product, even if a crawl listed it twice
+        by_key: Dict[Tuple[str, int], Dict[str, Any]] = {}
+        for product in products:
+            if product.get("domain") and product.get("id") is not None:
+                by_key[(product["domain"], int(product["id"]))] = product
+
+        self.items: List[Dict[str, Any]] = []
+        self.doc_ids: Dict[Tuple[str, int], int] = {}
+        domain_names: List[str] = []
+        domain_lookup: Dict[str, int] = {}
+        domain_idx: List[int] = []
+        recency: List[float] = []
+        lengths: List[float] = []
+        postings: Dict[str, Dict[int, float]] = defaultdict(dict)
+
+        for doc, ((domain, product_id), product) in enumerate(by_key.items()):
+            projection = search_projection(product)
+            variants = product.get("variants") or []
+            self.items.append({
+                "domain": domain,
+                "product_id": product_id,
+                "title": product.get("title") or "",
+                "src": projection["image_src"],
+                # The contract's price is raw_json.variants[0].price, not the lowest one
+                "price": variants[0].get("price") if variants else None,
+            })
+            self.doc_ids[(domain, product_id)] = doc
+            if domain not in domain_lookup:
+                domain_lookup[domain] = len(domain_names)
+                domain_names.append(domain)
+            domain_idx.append(domain_lookup[domain])
+            recency.append(_timestamp(product.get("published_at") or product.get("created_at")))
+
+            length = 0.0
+            for field, weight in FIELD_WEIGHTS.items():
+                for token in tokenize(_field_text(product, field)):
+                    postings[token][doc] = postings[token].get(doc, 0.0) + weight
+                    length += weight
+            lengths.append(length)
+
+        self.domain_lookup = domain_lookup
+        self.domain_idx = np.array(domain_idx, dtype=np.int32)
+        self.recency = np.array(recency, dtype=np.float64)
+        self.lengths = np.array(lengths, dtype=np.float32)
+        self.avg_length = float(self.lengths.mean()) if len(self.lengths) else 0.0
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {
+            term: (np.fromiter(docs.keys(), dtype=np.int32, count=len(docs)),
+                   np.fromiter(docs.values(), dtype=np.float32, count=len(docs)))
+            for term, docs in postings.items()
+        }
+        # Newest first; ties broken by product id for a stable order
+        self.recent_order = np.lexsort((-np.array([i["product_id"] for i in self.items], dtype=np.float64),
+                                       -self.recency)) if self.items else np.zeros(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def bm25(self, query: str) -> np.ndarray:
+        """BM25 score of every document; 0 for documents matching no query term."""
+        scores = np.zeros(len(self.items), dtype=np.float32)
+        n = len(self.items)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            docs, tf = posting
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[docs] / self.avg_length)
+            scores[docs] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores
+
+    def _vector_ranks(self, query: str, domain: Optional[str], candidates: int) -> Dict[int, int]:
+        vector = self.encoder.encode([query])[0]
+        hits = self.vector_index.search(
+            vector, k=candidates, nprobe=16, rerank=candidates, domains=[domain] if domain else None)
+        ranks: Dict[int, int] = {}
+        for domain_name, product_id, _ in hits:
+            doc = self.doc_ids.get((domain_name, product_id))
+            if doc is not None and doc not in ranks:
+                ranks[doc] = len(ranks)
+        return ranks
+
+    def search(
+        self,
+        query: str = "",
+        domain: Optional[str] = None,
+        sort: str = "rank",
+        limit: int = DEFAULT_LIMIT,
+        offset: int = 0,
+        vector_candidates: int = 200,
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """Return one page of items and the total number of matches."""
+        if domain is not None and domain not in self.domain_lookup:
+            return [], 0
+        domain_mask = self.domain_idx == self.domain_lookup[domain] if domain is not None else None
+
+        if not query.strip():
+            order = self.recent_order
+            if domain_mask is not None:
+                order = order[domain_mask[order]]
+            return [self.items[i] for i in order[offset:offset + limit]], len(order)
+
+        scores = self.bm25(query)
+        if domain_mask is not None:
+            scores[~domain_mask] = 0
+        matches = np.flatnonzero(scores > 0)
+        lexical = matches[np.lexsort((matches, -scores[matches]))]
+
+        fused = np.zeros(len(self.items), dtype=np.float64)
+        fused[lexical] = 1.0 / (RRF_K + np.arange(len(lexical)))
+        if self.vector_index is not None and self.encoder is not None:
+            for doc, rank in self._vector_ranks(query, domain, vector_candidates).items():
+                fused[doc] += 1.0 / (RRF_K + rank)
+
+        docs = np.flatnonzero(fused)
+        if sort == "recent":
+            ranked = docs[np.lexsort((docs, -self.recency[docs]))]
+        else:
+            ranked = docs[np.lexsort((docs, -fused[docs]))]
+        return [self.items[i] for i in ranked[offset:offset + limit]], len(ranked)
+
+    def respond(self, params: Dict[str, str]) -> Dict[str, Any]:
+        """Build a search response for decoded query-string parameters."""
+        sort = params.get("sort") or "rank"
+        if sort not in SORTS:
+            raise ValueError(f"sort must be one of {', '.join(SORTS)}")
+        try:
+            limit = int(params.get("limit") or DEFAULT_LIMIT)
+        except ValueError:
+            raise ValueError("limit must be an integer")
+        limit = max(1, min(limit, MAX_LIMIT))
+        offset = decode_cursor(params["cursor"]) if params.get("cursor") else 0
+
+        items, total = self.search(params.get("q", ""), params.get("domain") or None, sort, limit, offset)
+        has_more = offset + len(items) < total
+        return {
+            "items": items,
+            "total": total,
+            "hasMore": has_more,
+            "nextCursor": encode_cursor(offset + len(items)) if has_more else None,
+            "sort": sort,
+        }
+
+
+def make_handler(index: SearchIndex) -> type:
+    class SearchHandler(BaseHTTPRequestHandler):
+        def _send(self, status: int, payload: Any) -> None:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_OPTIONS(self) -> None:
+            self.send_response(204)
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.send_header("Access-Control-Allow-Methods", "GET, OPTIONS")
+            self.send_header("Access-Control-Allow-Headers", "authorization, apikey, accept, content-type")
+            self.end_headers()
+
+        def do_GET(self) -> None:
+            url = urlparse(self.path)
+            if url.path.rstrip("/") not in ("", "/products-search"):
+                self._send(404, {"message": "not found"})
+                return
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            try:
+                self._send(200, index.respond(params))
+            except ValueError as e:
+                self._send(400, {"message": str(e)})
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    return SearchHandler
+
+
+def run_bench(index: SearchIndex, queries: Sequence[str], sort: str) -> None:
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        index.respond({"q": query, "sort": sort})
+        latencies.append((time.perf_counter() - start) * 1000)
+    print(f"{len(latencies)} queries over {len(index)} products ({sort}): "
+          f"p50 {np.percentile(latencies, 50):.2f} ms, p95 {np.percentile(latencies, 95):.2f} ms, "
+          f"max {max(latencies):.2f} ms")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Serve hybrid BM25 + vector product search from crawl output.")
+    parser.add_argument("--input", default="crawl_output", help="ProductSink directory or shard (default: crawl_output)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--vector-index", help="vector_index.py directory; enables hybrid ranking")
+    parser.add_argument("--bench", help="file with one query per line; print latencies instead of serving")
+    parser.add_argument("--sort", choices=SORTS, default="rank", help="sort used by --bench (default: rank)")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+
+    vector_index = encoder = None
+    if args.vector_index:
+        from embedding_backends import LocalBackend
+        from vector_index import VectorIndex
+
+        vector_index = VectorIndex(args.vector_index)
+        encoder = LocalBackend(model_id=vector_index.meta["model"])
+
+    start = time.time()
+    index = SearchIndex(iter_latest_products(args.input), vector_index, encoder)
+    print(f"Indexed {len(index)} products ({len(index.postings)} terms) in {time.time() - start:.1f}s")
+
+    if args.bench:
+        with open(args.bench) as f:
+            queries = [line.strip() for line in f if line.strip()]
+        run_bench(index, queries, args.sort)
+        return 0
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(index))
+    print(f"Serving on http://{args.host}:{args.port}/products-search")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
@@ -0,0 +1,223 @@
+"""
+Sharded crawls of domains.txt.
+
+One crawl process tops out on one core: parsing, row building and the shared
+stats all run under the GIL. `fetch_products_json.py --shard i/N` crawls only the
+domains that hash to shard i of N (0 <= i < N), so N processes split the list
+without talking to each other, whether they run on one machine (`--shards N`
+starts them as a process pool) or one per host.
+
+Domains are assigned with jump consistent hashing (Lamping & Veach) over a
+blake2b digest of the domain. The assignment does not depend on the order of
+domains.txt. When N grows to N+1, the only domains that change shard are the
+~1/(N+1) that move to the new shard N. Shrinking N moves only the domains of the
+removed shard.
+
+Each shard keeps its own persistent state. The crawl journal, the content hash
+index and the HTTP cache are named by the shard index alone
+(`crawl_state.shard-02.sqlite`), not by N. After a resize, shard i therefore reopens
+the state it had before and stays warm for every domain it keeps. A shard drops
+the journal and hash entries of domains that have moved to another shard, so a
+domain that moves back later starts clean instead of from stale hashes. Only the
+moved domains are crawled cold.
+
+Run outputs are named with the full `i/N`. The NDJSON and Parquet files look like
+`products-<run>-shard-02-of-08-00000.ndjson`, so shards can share an output
+directory, or hosts can copy theirs into one, and the readers pick up every shard's
+files. When a shard finishes it writes its summary
+(`crawl-summary-shard-02-of-08.json`) to the output directory, and `merge` combines
+these summaries into one report.
+
+    uv run python scripts/fetch_products_json.py --shards 8
+    uv run python scripts/fetch_products_json.py --shard 2/8    # one of 8 hosts
+    uv run python scripts/sharding.py merge crawl_output --failed failed_domains.txt
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+Shard = Tuple[int, int]
+
+SUMMARY_PREFIX = "crawl-summary"
+
+
+def parse_shard(value: str) -> Shard:
+    """argparse type for `i/N`."""
+    try:
+        index, shards = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, e.g. 0/4, got {value!r}")
+    if shards < 1 or not 0 <= index < shards:
+        raise argparse.ArgumentTypeError(f"shard index must satisfy 0 <= i < N, got {value!r}")
+    return index, shards
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Jump consistent hash of a 64-bit key into `buckets` buckets."""
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return bucket
+
+
+def shard_of(domain: str, shards: int) -> int:
+    """Stable shard of a domain (Python's hash() is salted per process)."""
+    digest = hashlib.blake2b(domain.strip().lower().encode("utf-8"), digest_size=8).digest()
+    return jump_hash(int.from_bytes(digest, "big"), shards)
+
+
+def select_shard(domains: Sequence[str], shard: Shard) -> List[str]:
+    index, shards = shard
+    return [domain for domain in domains if shard_of(domain, shards) == index]
+
+
+def moved_away(domains: Iterable[str], shard: Shard) -> List[str]:
+    """Those of `domains` that no longer belong to `shard`, e.g. after N changed."""
+    index, shards = shard
+    return [domain for domain in domains if shard_of(domain, shards) != index]
+
+
+def shard_tag(shard: Shard) -> str:
+    """Names one run's outputs: `shard-02-of-08`."""
+    index, shards = shard
+    return f"shard-{index:02d}-of-{shards:02d}"
+
+
+def shard_path(path: str, shard: Optional[Shard]) -> str:
+    """Persistent state of a shard: `path` with the shard index (not N) inserted before its extension.
+
+    Unchanged outside a sharded run.
+    """
+    if not path or shard is None:
+        return path
+    root, ext = os.path.splitext(path.rstrip("/"))
+    return f"{root}.shard-{shard[0]:02d}{ext}"
+
+
+def summary_path(output_dir: str, shard: Shard) -> str:
+    return os.path.join(output_dir, f"{SUMMARY_PREFIX}-{shard_tag(shard)}.json")
+
+
+def write_summary(output_dir: str, summary: Dict[str, Any]) -> str:
+    path = summary_path(output_dir, (summary["shard"], summary["shards"]))
+    os.makedirs(output_dir, exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(summary, f, indent=2)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def load_summaries(directories: Iterable[str]) -> List[Dict[str, Any]]:
+    summaries: List[Dict[str, Any]] = []
+    for directory in directories:
+        for path in sorted(glob.glob(os.path.join(directory, f"{SUMMARY_PREFIX}-shard-*.json"))):
+            with open(path) as f:
+                summaries.append(json.load(f))
+    return summaries
+
+
+def merge(summaries: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """Combine shard summaries into one crawl report.
+
+    Only summaries with the shard count of the most recent one are used, so files
+    left behind by an earlier run with a different N are ignored; a shard reported
+    twice (e.g. re-run after a failure) counts once, with its latest summary.
+    """
+    if not summaries:
+        raise ValueError("no shard summaries to merge")
+    shards = max(summaries, key=lambda s: s["finished_at"])["shards"]
+    latest: Dict[int, Dict[str, Any]] = {}
+    for summary in summaries:
+        if summary["shards"] != shards:
+            continue
+        current = latest.get(summary["shard"])
+        if current is None or summary["finished_at"] > current["finished_at"]:
+            latest[summary["shard"]] = summary
+
+    parts = [latest[index] for index in sorted(latest)]
+    failed: Dict[str, str] = {}
+    for part in parts:
+        failed.update(part["failed"])
+    started_at = min(part["started_at"] for part in parts)
+    finished_at = max(part["finished_at"] for part in parts)
+    seconds = (datetime.fromisoformat(finished_at) - datetime.fromisoformat(started_at)).total_seconds()
+    products = sum(part["products"] for part in parts)
+    return {
+        "shards": shards,
+        "merged": sorted(latest),
+        "missing": sorted(set(range(shards)) - set(latest)),
+        "domains": sum(part["domains"] for part in parts),
+        "skipped": sum(part["skipped"] for part in parts),
+        "successful": sum(part["successful"] for part in parts),
+        "unchanged": sum(part["unchanged"] for part in parts),
+        "failed": dict(sorted(failed.items())),
+        "products": products,
+        "throttles": sum(part["throttles"] for part in parts),
+        "output_files": sum(part["output_files"] for part in parts),
+        "started_at": started_at,
+        "finished_at": finished_at,
+        "seconds": seconds,
+        "products_per_second": products / seconds if seconds > 0 else 0.0,
+        "shard_seconds": {part["shard"]: part["seconds"] for part in parts},
+    }
+
+
+def print_summary(merged: Dict[str, Any]) -> None:
+    shards = merged["shards"]
+    print(f"\nSharded Crawl Summary ({len(merged['merged'])} of {shards} shards):")
+    if merged["missing"]:
+        print(f"Missing shards: {', '.join(f'{i}/{shards}' for i in merged['missing'])}")
+    print(f"Wall-clock duration: {merged['seconds']:.2f} seconds")
+    slowest = max(merged["shard_seconds"].items(), key=lambda item: item[1])
+    print(f"Slowest shard: {slowest[0]}/{shards} ({slowest[1]:.2f} seconds)")
+    print(f"Total domains processed: {merged['domains']} ({merged['skipped']} already completed)")
+    print(f"Successful domains: {merged['successful']}")
+    print(f"Unchanged domains: {merged['unchanged']}")
+    print(f"Rate limit responses: {merged['throttles']}")
+    print(f"Failed domains: {len(merged['failed'])}")
+    print(f"Total products collected: {merged['products']} ({merged['products_per_second']:.1f}/s)")
+    print(f"Output files: {merged['output_files']}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Merge the summaries of a sharded crawl")
+    sub = parser.add_subparsers(dest="command", required=True)
+    merge_parser = sub.add_parser("merge", help="combine shard stats and failure lists")
+    merge_parser.add_argument("directories", nargs="*", default=["crawl_output"],
+                              help="output directories holding shard summaries (default: crawl_output)")
+    merge_parser.add_argument("--output", metavar="FILE",
+                              help="also write the merged summary as JSON to FILE")
+    merge_parser.add_argument("--failed", metavar="FILE",
+                              help="write the failed domains to FILE, one per line (a domains.txt for a retry)")
+    args = parser.parse_args(argv)
+
+    summaries = load_summaries(args.directories)
+    if not summaries:
+        print(f"No shard summaries found in {', '.join(args.directories)}")
+        return 1
+    merged = merge(summaries)
+    print_summary(merged)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(merged, f, indent=2)
+    if args.failed:
+        with open(args.failed, "w") as f:
+            f.writelines(f"{domain}\n" for domain in merged["failed"])
+        print(f"Failed domains written to {args.failed}")
+    elif merged["failed"]:
+        print("\nFailed domains:")
+        for domain, error in merged["failed"].items():
+            print(f"- {domain}: {error}")
+    return 0 if not merged["missing"] else 2
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
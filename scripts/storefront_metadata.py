@@ -0,0 +1,172 @@
+"""
+Domain metadata from Shopify's compact machine-readable endpoints.
+
+Downloading and parsing a whole homepage just to find a shop's name, description
+and currency costs hundreds of kilobytes per store, and the currency is only a
+guess from `$`/`€` signs in the page text. Every Shopify storefront exposes better
+sources:
+
+- `/meta.json`: name, description, currency, country and product counts (~1 KB)
+- the `<head>` of the homepage, read only up to `</head>`: meta tags and the
+  JSON-LD Organization block (name, email, sameAs social profiles)
+- `/cart.js`: the cart currency, asked only when meta.json did not give one
+
+The full homepage is fetched only when these sources do not even yield a shop
+name (password pages, non-Shopify hosts). The badge, and an email or social links
+that appear only in the page body, are invisible to them, so a lightweight scrape
+leaves those columns as an earlier full-page scrape filled them (HTML_ONLY_FIELDS).
+This module only interprets responses; the serial scraper and the async engine do
+the fetching.
+"""
+
+import json
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+import html_metadata
+
+SOURCES = ("lightweight", "html")
+
+# Stop reading the homepage at </head>, or after this many bytes without one
+MAX_HEAD_BYTES = 256 * 1024
+
+_HEAD_END = re.compile(rb'</head\s*>', re.IGNORECASE)
+
+# Columns the lightweight sources cannot rule out: an empty value only means the head
+# did not mention them, so it must not overwrite what a full-page scrape found
+HTML_ONLY_FIELDS = ('shop_email', 'social_links', 'powered_by_badge')
+
+# JSON-LD types describing the shop itself (rather than a product)
+_SHOP_TYPES = frozenset({'Organization', 'OnlineStore', 'Store', 'WebSite', 'LocalBusiness'})
+
+# meta.json fields kept in raw_metadata alongside the columns
+_META_JSON_EXTRAS = (
+    'country', 'province', 'city', 'myshopify_domain', 'money_format',
+    'published_products_count', 'published_collections_count', 'ships_to_countries',
+)
+
+
+class HeadReader:
+    """Accumulates homepage bytes until `</head>` has been seen."""
+
+    def __init__(self, max_bytes: int = MAX_HEAD_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.buffer = bytearray()
+
+    def feed(self, chunk: bytes) -> bool:
+        """Add a chunk; returns True once enough of the document has been read."""
+        # Only rescan the tail that could contain a tag split across chunks
+        start = max(0, len(self.buffer) - 16)
+        self.buffer.extend(chunk)
+        match = _HEAD_END.search(self.buffer, start)
+        if match:
+            del self.buffer[match.end():]
+            return True
+        return len(self.buffer) >= self.max_bytes
+
+    def text(self, encoding: Optional[str] = None) -> str:
+        return bytes(self.buffer).decode(encoding or 'utf-8', errors='replace')
+
+
+def read_head(chunks: Iterable[bytes], max_bytes: int = MAX_HEAD_BYTES) -> bytes:
+    reader = HeadReader(max_bytes)
+    for chunk in chunks:
+        if reader.feed(chunk):
+            break
+    return bytes(reader.buffer)
+
+
+def parse_meta_json(data: Any) -> Dict[str, Any]:
+    if not isinstance(data, dict):
+        return {}
+    metadata: Dict[str, Any] = {
+        'display_name': (data.get('name') or '').strip() or None,
+        'description': (data.get('description') or '').strip() or None,
+        'shop_currency': data.get('currency') or None,
+    }
+    metadata.update({key: data[key] for key in _META_JSON_EXTRAS if data.get(key) is not None})
+    return metadata
+
+
+def parse_cart_js(data: Any) -> Optional[str]:
+    if isinstance(data, dict):
+        return data.get('currency') or None
+    return None
+
+
+def _json_ld_nodes(blocks: List[str]) -> Iterable[Dict[str, Any]]:
+    for block in blocks:
+        try:
+            data = json.loads(block)
+        except ValueError:
+            continue
+        stack = data if isinstance(data, list) else [data]
+        while stack:
+            node = stack.pop(0)
+            if not isinstance(node, dict):
+                continue
+            yield node
+            graph = node.get('@graph')
+            if isinstance(graph, list):
+                stack.extend(graph)
+
+
+def parse_head(head: str, domain: str) -> Dict[str, Any]:
+    """Metadata from the document head: meta tags plus the shop's JSON-LD block."""
+    fields = html_metadata.parse_fields(head)
+    metadata: Dict[str, Any] = {}
+
+    for node in _json_ld_nodes(fields.json_ld):
+        types = node.get('@type')
+        types = set(types) if isinstance(types, list) else {types}
+        if not types & _SHOP_TYPES:
+            continue
+        if isinstance(node.get('name'), str) and 'json_ld_name' not in metadata:
+            metadata['json_ld_name'] = node['name'].strip() or None
+        if isinstance(node.get('email'), str) and 'shop_email' not in metadata:
+            metadata['shop_email'] = node['email'].replace('mailto:', '').strip() or None
+        same_as = node.get('sameAs')
+        if isinstance(same_as, str):
+            same_as = [same_as]
+        if isinstance(same_as, list):
+            fields.hrefs.extend(href for href in same_as if isinstance(href, str))
+
+    # Head text is only the <title>, so currency/badge guesses from page text do not apply
+    interpreted = html_metadata.interpret(fields, domain)
+    metadata['head_name'] = interpreted['display_name']
+    metadata['description'] = interpreted['description']
+    metadata['social_links'] = interpreted['social_links']
+    metadata['theme'] = interpreted['theme']
+    return metadata
+
+
+def combine(domain: str, meta_json: Dict[str, Any], head: Dict[str, Any],
+            cart_currency: Optional[str] = None) -> Dict[str, Any]:
+    """Merge the lightweight sources, most authoritative first."""
+    metadata: Dict[str, Any] = {
+        'display_name': meta_json.get('display_name') or head.get('json_ld_name') or head.get('head_name'),
+        'description': meta_json.get('description') or head.get('description'),
+        'shop_email': head.get('shop_email'),
+        'social_links': head.get('social_links') or {},
+        'shop_currency': meta_json.get('shop_currency') or cart_currency,
+        # Only the full page shows whether the badge is rendered
+        'powered_by_badge': None,
+        'meta_description': head.get('description'),
+        'theme': head.get('theme'),
+    }
+    metadata.update({key: meta_json[key] for key in _META_JSON_EXTRAS if key in meta_json})
+    return metadata
+
+
+def needs_currency(meta_json: Dict[str, Any]) -> bool:
+    return not meta_json.get('shop_currency')
+
+
+def from_html(metadata: Dict[str, Any]) -> bool:
+    """The metadata was extracted from the full homepage (always true with `--source html`)."""
+    return 'html' in metadata.get('metadata_sources', ['html'])
+
+
+def needs_html(metadata: Dict[str, Any]) -> bool:
+    """The lightweight sources failed to identify the shop at all."""
+    return not metadata.get('display_name')
@@ -0,0 +1,385 @@
+"""
+Offline IVF-PQ index over product embeddings, queried with plain NumPy.
+
+Build:
+    uv run python scripts/vector_index.py build --output vector_index
+Query:
+    uv run python scripts/vector_index.py query --index vector_index --text "lavender soap"
+Recall/latency sweep:
+    uv run python scripts/vector_index.py bench --index vector_index
+
+Layout: the embeddings are partitioned by a k-means coarse quantizer into `nlist`
+inverted lists, and each vector's residual to its list centroid is product-quantized
+into `m` one-byte codes. A query scores only the `nprobe` closest lists. Because the
+embeddings are normalized and compared by inner product, one lookup table per query
+serves every list:
+
+    score(x) ~= q . centroid[list(x)] + sum_j LUT[j, code_j(x)],  LUT[j, k] = q_j . codebook[j, k]
+
+Optionally the top `rerank` candidates are rescored exactly against float16 copies of
+the vectors. Every array is saved as .npy and opened with mmap_mode="r", so a
+multi-million product index loads instantly and only the probed lists are paged in.
+`nprobe` and `rerank` trade recall for latency at query time.
+"""
+
+import argparse
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from embedding_backends import MODEL_ID
+
+INDEX_VERSION = 1
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    return x / np.maximum(np.linalg.norm(x, axis=-1, keepdims=True), 1e-12)
+
+
+def _chunks(n: int, size: int) -> Iterator[Tuple[int, int]]:
+    for start in range(0, n, size):
+        yield start, min(n, start + size)
+
+
+def _nearest(x: np.ndarray, centroids: np.ndarray, centroid_sq: np.ndarray) -> np.ndarray:
+    # argmin ||x - c||^2 == argmax (x.c - ||c||^2 / 2)
+    return np.argmax(x @ centroids.T - 0.5 * centroid_sq, axis=1)
+
+
+def kmeans(x: np.ndarray, k: int, iterations: int = 20, seed: int = 0) -> np.ndarray:
+    """Lloyd's k-means with k-means++-style sampled initialization."""
+    rng = np.random.default_rng(seed)
+    x = np.asarray(x, dtype=np.float32)
+    if len(x) <= k:
+        # Fewer points than clusters: every point is a centroid, pad with jittered copies
+        extra = x[rng.integers(0, len(x), k - len(x))] + rng.normal(0, 1e-3, (k - len(x), x.shape[1]))
+        return np.concatenate([x, extra.astype(np.float32)])
+
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.concatenate([
+            _nearest(x[a:b], centroids, (centroids ** 2).sum(1)) for a, b in _chunks(len(x), 65536)])
+        counts = np.bincount(assign, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Re-seed empty clusters on random points so no list is wasted
+        if empty.any():
+            centroids[empty] = x[rng.choice(len(x), int(empty.sum()), replace=False)]
+    return centroids
+
+
+@dataclass
+class IndexParams:
+    nlist: int = 1024
+    m: int = 48
+    train_size: int = 100_000
+    iterations: int = 20
+    keep_vectors: bool = True
+    seed: int = 0
+
+
+def build_index(
+    vectors: np.ndarray,
+    product_ids: np.ndarray,
+    domains: Sequence[str],
+    output_dir: str,
+    params: IndexParams = IndexParams(),
+    model_id: str = MODEL_ID,
+) -> None:
+    """Train and write an IVF-PQ index for `vectors` (n, dim), normalized on the fly."""
+    n, dim = vectors.shape
+    if dim % params.m:
+        raise ValueError(f"dimension {dim} is not divisible into m={params.m} subspaces")
+    nlist = max(1, min(params.nlist, n))
+    dsub = dim // params.m
+    rng = np.random.default_rng(params.seed)
+    os.makedirs(output_dir, exist_ok=True)
+
+    sample = _normalize(vectors[np.sort(rng.choice(n, min(n, params.train_size), replace=False))])
+    print(f"Training coarse quantizer: {nlist} lists on {len(sample)} vectors...")
+    centroids = kmeans(sample, nlist, params.iterations, params.seed)
+    centroid_sq = (centroids ** 2).sum(1)
+
+    residuals = sample - centroids[_nearest(sample, centroids, centroid_sq)]
+    print(f"Training product quantizer: {params.m} x 256 codes of {dsub} dims...")
+    codebooks = np.stack([
+        kmeans(residuals[:, j * dsub:(j + 1) * dsub], 256, params.iterations, params.seed + j)
+        for j in range(params.m)
+    ])
+    codebook_sq = (codebooks ** 2).sum(2)
+
+    print(f"Encoding {n} vectors...")
+    assign = np.empty(n, dtype=np.int32)
+    codes = np.empty((n, params.m), dtype=np.uint8)
+    for a, b in _chunks(n, 65536):
+        x = _normalize(vectors[a:b])
+        assign[a:b] = _nearest(x, centroids, centroid_sq)
+        r = x - centroids[assign[a:b]]
+        for j in range(params.m):
+            codes[a:b, j] = _nearest(r[:, j * dsub:(j + 1) * dsub], codebooks[j], codebook_sq[j])
+
+    # Store everything in inverted-list order so each list is one contiguous slice
+    order = np.argsort(assign, kind="stable")
+    offsets = np.zeros(nlist + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assign, minlength=nlist), out=offsets[1:])
+
+    domain_names = sorted(set(domains))
+    domain_lookup = {name: i for i, name in enumerate(domain_names)}
+    domain_idx = np.fromiter((domain_lookup[d] for d in domains), dtype=np.int32, count=n)
+
+    np.save(os.path.join(output_dir, "centroids.npy"), centroids.astype(np.float32))
+    np.save(os.path.join(output_dir, "codebooks.npy"), codebooks.astype(np.float32))
+    np.save(os.path.join(output_dir, "list_offsets.npy"), offsets)
+    np.save(os.path.join(output_dir, "codes.npy"), codes[order])
+    np.save(os.path.join(output_dir, "product_ids.npy"), np.asarray(product_ids, dtype=np.int64)[order])
+    np.save(os.path.join(output_dir, "domain_idx.npy"), domain_idx[order])
+    if params.keep_vectors:
+        out = np.lib.format.open_memmap(
+            os.path.join(output_dir, "vectors.npy"), mode="w+", dtype=np.float16, shape=(n, dim))
+        for a, b in _chunks(n, 65536):
+            out[a:b] = _normalize(vectors[order[a:b]]).astype(np.float16)
+        out.flush()
+        del out
+    with open(os.path.join(output_dir, "domains.json"), "w") as f:
+        json.dump(domain_names, f)
+    with open(os.path.join(output_dir, "meta.json"), "w") as f:
+        json.dump({
+            "version": INDEX_VERSION,
+            "model": model_id,
+            "count": int(n),
+            "dim": int(dim),
+            "nlist": int(nlist),
+            "m": params.m,
+            "metric": "inner_product",
+        }, f, indent=2)
+    print(f"Index written to {output_dir}")
+
+
+class VectorIndex:
+    """Memory-mapped IVF-PQ index; `search` is thread-safe (read-only arrays)."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta: Dict[str, Any] = json.load(f)
+        with open(os.path.join(path, "domains.json")) as f:
+            self.domains: List[str] = json.load(f)
+        self.domain_lookup = {name: i for i, name in enumerate(self.domains)}
+
+        def load(name: str) -> np.ndarray:
+            return np.load(os.path.join(path, name), mmap_mode="r")
+
+        # Small arrays are read into memory; the per-product arrays stay mapped
+        self.centroids = np.array(load("centroids.npy"))
+        self.codebooks = np.array(load("codebooks.npy"))
+        self.offsets = np.array(load("list_offsets.npy"))
+        self.codes = load("codes.npy")
+        self.product_ids = load("product_ids.npy")
+        self.domain_idx = load("domain_idx.npy")
+        vectors_path = os.path.join(path, "vectors.npy")
+        self.vectors: Optional[np.ndarray] = load("vectors.npy") if os.path.exists(vectors_path) else None
+        self.m = self.meta["m"]
+        self.dsub = self.meta["dim"] // self.m
+
+    def __len__(self) -> int:
+        return self.meta["count"]
+
+    def _candidates(self, lists: np.ndarray) -> np.ndarray:
+        ranges = [np.arange(self.offsets[i], self.offsets[i + 1]) for i in lists]
+        return np.concatenate(ranges) if ranges else np.zeros(0, dtype=np.int64)
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: int = 10,
+        nprobe: int = 16,
+        rerank: int = 0,
+        domains: Optional[Sequence[str]] = None,
+    ) -> List[Tuple[str, int, float]]:
+        """Top-k (domain, product_id, score) for one query vector."""
+        q = _normalize(query)
+        coarse = self.centroids @ q
+        nprobe = min(nprobe, len(coarse))
+        lists = np.argpartition(-coarse, nprobe - 1)[:nprobe]
+
+        positions = self._candidates(lists)
+        if domains is not None:
+            wanted = np.array([self.domain_lookup[d] for d in domains if d in self.domain_lookup], dtype=np.int32)
+            positions = positions[np.isin(self.domain_idx[positions], wanted)]
+        if not len(positions):
+            return []
+
+        # One lookup table per query serves every probed list (inner product on residuals)
+        lut = np.einsum("jkd,jd->jk", self.codebooks, q.reshape(self.m, self.dsub))
+        list_of = np.repeat(lists, self.offsets[lists + 1] - self.offsets[lists])
+        if domains is not None:
+            list_of = np.searchsorted(self.offsets, positions, side="right") - 1
+        codes = np.asarray(self.codes[positions])
+        scores = coarse[list_of] + lut[np.arange(self.m), codes].sum(axis=1)
+
+        keep = min(len(scores), max(k, rerank))
+        top = np.argpartition(-scores, keep - 1)[:keep]
+        if rerank and self.vectors is not None:
+            exact = np.asarray(self.vectors[positions[top]], dtype=np.float32) @ q
+            scores[top] = exact
+        top = top[np.argsort(-scores[top])][:k]
+        return [
+            (self.domains[self.domain_idx[p]], int(self.product_ids[p]), float(s))
+            for p, s in zip(positions[top], scores[top])
+        ]
+
+    def exact_search(self, query: np.ndarray, k: int = 10) -> List[Tuple[str, int, float]]:
+        """Brute force over the stored float16 vectors; the ground truth for recall."""
+        if self.vectors is None:
+            raise RuntimeError("index was built without vectors; exact search is unavailable")
+        q = _normalize(query)
+        scores = np.concatenate([np.asarray(self.vectors[a:b], dtype=np.float32) @ q
+                                 for a, b in _chunks(len(self), 262144)])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.domains[self.domain_idx[p]], int(self.product_ids[p]), float(scores[p])) for p in top]
+
+
+def load_embeddings(database_url: str, spool_path: str, batch_size: int = 10_000) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """Stream embeddings out of public.products into a float16 memmap at `spool_path`."""
+    import psycopg2
+
+    conn = psycopg2.connect(database_url)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM public.products WHERE embedding IS NOT NULL")
+            total = cur.fetchone()[0]
+            cur.execute("SELECT embedding::text FROM public.products WHERE embedding IS NOT NULL LIMIT 1")
+            first = cur.fetchone()
+        if not total or first is None:
+            raise SystemExit("No embeddings found; run embeddings_create.py first")
+        dim = len(first[0].strip("[]{}").split(","))
+
+        vectors = np.lib.format.open_memmap(spool_path, mode="w+", dtype=np.float16, shape=(total, dim))
+        product_ids = np.empty(total, dtype=np.int64)
+        domains: List[str] = []
+        last_key: Tuple[str, int] = ("", -1)
+        n = 0
+        while n < total:
+            with conn.cursor() as cur:
+                cur.execute("""
+                  SELECT domain, product_id, embedding::text
+                  FROM public.products
+                  WHERE embedding IS NOT NULL AND (domain, product_id) > (%s, %s)
+                  ORDER BY domain, product_id
+                  LIMIT %s
+                """, (*last_key, batch_size))
+                rows = cur.fetchall()
+            if not rows:
+                break
+            rows = rows[:total - n]
+            for domain, product_id, text in rows:
+                vectors[n] = np.array(text.strip("[]{}").split(","), dtype=np.float32)
+                product_ids[n] = product_id
+                domains.append(domain)
+                n += 1
+            last_key = (rows[-1][0], rows[-1][1])
+            print(f"  loaded {n}/{total} embeddings", end="\r")
+        print()
+        return vectors[:n], product_ids[:n], domains
+    finally:
+        conn.close()
+
+
+def _sample_queries(index: VectorIndex, count: int, seed: int = 1) -> np.ndarray:
+    """Perturbed stored vectors: realistic queries whose true neighbours are known to exist."""
+    if index.vectors is None:
+        raise RuntimeError("bench needs an index built with vectors")
+    rng = np.random.default_rng(seed)
+    picks = np.sort(rng.choice(len(index), min(count, len(index)), replace=False))
+    base = np.asarray(index.vectors[picks], dtype=np.float32)
+    return _normalize(base + rng.normal(0, 0.05, base.shape).astype(np.float32))
+
+
+def bench(index: VectorIndex, queries: np.ndarray, k: int, nprobes: Sequence[int], rerank: int) -> None:
+    truth = [{(d, p) for d, p, _ in index.exact_search(q, k)} for q in queries]
+    print(f"{'nprobe':>7} {'recall@' + str(k):>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for nprobe in nprobes:
+        latencies = []
+        hits = 0
+        for q, expected in zip(queries, truth):
+            start = time.perf_counter()
+            found = index.search(q, k=k, nprobe=nprobe, rerank=rerank)
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits += len(expected & {(d, p) for d, p, _ in found})
+        print(f"{nprobe:>7} {hits / (k * len(queries)):>10.3f} "
+              f"{np.percentile(latencies, 50):>8.2f} {np.percentile(latencies, 95):>8.2f}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Build and query an IVF-PQ index of product embeddings.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="build an index from public.products embeddings")
+    build.add_argument("--output", default="vector_index", help="index directory (default: vector_index)")
+    build.add_argument("--nlist", type=int, default=1024, help="inverted lists (default: 1024, ~sqrt(n) is typical)")
+    build.add_argument("--m", type=int, default=48, help="PQ subspaces, must divide the dimension (default: 48)")
+    build.add_argument("--train-size", type=int, default=100_000, help="vectors sampled for training (default: 100000)")
+    build.add_argument("--no-vectors", action="store_true", help="skip the float16 vectors used for reranking")
+
+    query = sub.add_parser("query", help="embed a text locally and print its nearest products")
+    query.add_argument("--index", default="vector_index")
+    query.add_argument("--text", required=True)
+    query.add_argument("--k", type=int, default=10)
+    query.add_argument("--nprobe", type=int, default=16)
+    query.add_argument("--rerank", type=int, default=100)
+    query.add_argument("--domain", action="append", help="restrict to this domain (repeatable)")
+
+    bench_parser = sub.add_parser("bench", help="recall and latency against exact search")
+    bench_parser.add_argument("--index", default="vector_index")
+    bench_parser.add_argument("--queries", type=int, default=200)
+    bench_parser.add_argument("--k", type=int, default=10)
+    bench_parser.add_argument("--nprobe", type=lambda v: [int(x) for x in v.split(",")], default=[1, 4, 16, 64],
+                              help="comma-separated nprobe values to sweep (default: 1,4,16,64)")
+    bench_parser.add_argument("--rerank", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+
+    if args.command == "build":
+        from dotenv import load_dotenv
+
+        from db import require_database_url
+
+        load_dotenv()
+        os.makedirs(args.output, exist_ok=True)
+        spool = os.path.join(args.output, "spool.npy")
+        vectors, product_ids, domains = load_embeddings(require_database_url(), spool)
+        build_index(vectors, product_ids, domains, args.output, IndexParams(
+            nlist=args.nlist, m=args.m, train_size=args.train_size, keep_vectors=not args.no_vectors))
+        del vectors
+        os.remove(spool)
+    elif args.command == "query":
+        from embedding_backends import LocalBackend
+
+        index = VectorIndex(args.index)
+        backend = LocalBackend(model_id=index.meta["model"])
+        query_vector = backend.encode([args.text])[0]
+        start = time.perf_counter()
+        results = index.search(query_vector, k=args.k, nprobe=args.nprobe, rerank=args.rerank, domains=args.domain)
+        print(f"{len(results)} results in {(time.perf_counter() - start) * 1000:.1f} ms")
+        for domain, product_id, score in results:
+            print(f"{score:.4f}  {domain}  {product_id}")
+    else:
+        index = VectorIndex(args.index)
+        bench(index, _sample_queries(index, args.queries), args.k, args.nprobe, args.rerank)
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
@@ -0,0 +1,236 @@
+"""
+Write-behind persistence stage for the products.json crawler.
+
+Crawl workers hand each finished domain to `WriteBehindQueue.submit` and move on to
+the next store straight away. A few writer threads drain the queue, coalescing the
+rows of many small domains into large batches so each database round-trip carries
+thousands of rows instead of a single store's handful. Pending rows are bounded:
+when the writers fall behind, `submit` blocks and the crawl slows to the speed the
+database can absorb.
+
+With a ContentHashIndex attached, each domain is first diffed against the hashes
+of its last successful write, so only inserted and changed rows (and deletes for
+products that disappeared) reach the database.
+
+A domain only counts as persisted once its batch committed; the `on_done` callback
+passed to `submit` is where the crawl journal is updated.
+"""
+
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from content_hashes import ContentHashIndex, HashDiff
+from crawl_state import max_updated_at
+from product_rows import RowBatch, build_rows
+
+PersistCallback = Callable[[Optional[Exception]], None]
+
+
+@dataclass
+class _Pending:
+    domain: str
+    batch: RowBatch
+    on_done: Optional[PersistCallback]
+    diff: Optional[HashDiff] = None
+
+
+def persist_callback(domain: str, products: List[Dict[str, Any]], state: Optional[Any], writer: Any) -> PersistCallback:
+    """Journal the outcome of persisting `domain` once its batch has been written."""
+    product_count = len(products)
+    updated_at_high_water = max_updated_at(products)
+
+    def on_done(error: Optional[Exception]) -> None:
+        if error is None:
+            if state is not None:
+                state.mark_done(domain, product_count, updated_at_high_water)
+            return
+        print(f"Warning: Failed to persist data for {domain}: {type(error).__name__}: {error}")
+        # Leave the domain retryable on the next run
+        if state is not None:
+            state.mark_failed(domain, f"Persist failed: {error}")
+        writer.upsert_domain(domain, [], str(error))
+
+    return on_done
+
+
+class WriteBehindQueue:
+    """Bounded queue feeding writer threads that batch rows across domains.
+
+    `writer` is anything with `write_batch(RowBatch)` and `upsert_domain`, i.e. the
+    SupabaseWriter or the PostgresBulkWriter.
+    """
+
+    def __init__(
+        self,
+        writer: Any,
+        workers: int = 4,
+        batch_rows: int = 5000,
+        max_delay: float = 1.0,
+        max_pending_rows: int = 100_000,
+        max_attempts: int = 3,
+        hashes: Optional[ContentHashIndex] = None,
+        write_all: bool = False,
+        raw_json: str = "full",
+    ) -> None:
+        self.writer = writer
+        self.hashes = hashes
+        self.write_all = write_all
+        self.raw_json = raw_json
+        self.batch_rows = batch_rows
+        self.max_delay = max_delay
+        self.max_pending_rows = max_pending_rows
+        self.max_attempts = max_attempts
+
+        self._queue: "queue.Queue[Optional[_Pending]]" = queue.Queue()
+        self._pending_rows: int = 0
+        self._space = threading.Condition()
+
+        self.lock = threading.Lock()
+        self.batches_written: int = 0
+        self.rows_written: int = 0
+        self.domains_written: int = 0
+        self.domains_failed: int = 0
+        self.blocked_seconds: float = 0.0
+        self.products_inserted: int = 0
+        self.products_changed: int = 0
+        self.products_unchanged: int = 0
+        self.products_deleted: int = 0
+
+        self._threads = [
+            threading.Thread(target=self._run, name=f"write-behind-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def is_enabled(self) -> bool:
+        return self.writer.is_enabled()
+
+    def upsert_domain(self, domain: str, products: List[Dict[str, Any]], error: Optional[str] = None) -> None:
+        self.writer.upsert_domain(domain, products, error)
+
+    def submit(self, domain: str, products: List[Dict[str, Any]], on_done: Optional[PersistCallback] = None) -> None:
+        """Queue one domain's complete catalogue, blocking while too many rows are pending."""
+        batch = build_rows(products, domain, raw_json=self.raw_json)
+        diff: Optional[HashDiff] = None
+        # An empty result is more likely a failed crawl than an emptied store: never diff it
+        if self.hashes is not None and products:
+            diff = self.hashes.diff(domain, batch, self.write_all)
+            batch = diff.batch
+        size = len(batch)
+        started = time.monotonic()
+        with self._space:
+            # A domain larger than the whole budget is still admitted once the queue is empty
+            while self._pending_rows and self._pending_rows + size > self.max_pending_rows:
+                self._space.wait()
+            self._pending_rows += size
+        waited = time.monotonic() - started
+        if waited > 0.01:
+            with self.lock:
+                self.blocked_seconds += waited
+        self._queue.put(_Pending(domain, batch, on_done, diff))
+
+    def _release(self, items: List[_Pending]) -> None:
+        with self._space:
+            self._pending_rows -= sum(len(item.batch) for item in items)
+            self._space.notify_all()
+
+    def _collect(self, first: _Pending) -> List[_Pending]:
+        """Gather queued domains after `first` until the batch is full or `max_delay` passed."""
+        items = [first]
+        rows = len(first.batch)
+        deadline = time.monotonic() + self.max_delay
+        while rows < self.batch_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Put the shutdown marker back for this worker's next loop
+                self._queue.put(None)
+                break
+            items.append(item)
+            rows += len(item.batch)
+        return items
+
+    def _write(self, items: List[_Pending], attempts: int) -> Optional[Exception]:
+        merged = RowBatch()
+        for item in items:
+            merged.extend(item.batch)
+
+        error: Optional[Exception] = None
+        for attempt in range(1, attempts + 1):
+            try:
+                self.writer.write_batch(merged)
+            except Exception as e:
+                error = e
+                print(f"Error writing batch of {len(items)} domains (attempt {attempt}/{attempts}): {e}")
+                if attempt < attempts:
+                    time.sleep(min(10.0, 2 ** attempt))
+                continue
+            with self.lock:
+                self.batches_written += 1
+                self.rows_written += len(merged)
+            return None
+        return error
+
+    def _flush(self, items: List[_Pending]) -> None:
+        error = self._write(items, self.max_attempts)
+        if error is not None and len(items) > 1:
+            # Isolate the domain that poisons the batch instead of failing all of them
+            for item in items:
+                self._finish(item, self._write([item], 1))
+        else:
+            for item in items:
+                self._finish(item, error)
+        self._release(items)
+
+    def _finish(self, item: _Pending, error: Optional[Exception]) -> None:
+        diff = item.diff
+        if error is None and diff is not None:
+            # Only a committed write may become the baseline of the next diff
+            try:
+                self.hashes.commit(item.domain, diff.hashes)
+            except Exception as e:
+                print(f"Warning: failed to record content hashes for {item.domain}: {e}")
+        with self.lock:
+            if error is not None:
+                self.domains_failed += 1
+            else:
+                self.domains_written += 1
+                if diff is not None:
+                    self.products_inserted += diff.inserted
+                    self.products_changed += diff.changed
+                    self.products_unchanged += diff.unchanged
+                    self.products_deleted += diff.deleted
+        if item.on_done is not None:
+            try:
+                item.on_done(error)
+            except Exception as e:
+                print(f"Warning: persist callback for {item.domain} failed: {e}")
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            self._flush(self._collect(first))
+
+    def close(self) -> None:
+        """Write everything still queued and stop the writer threads."""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self) -> "WriteBehindQueue":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,86 @@
+-- Normalized variants and options written by scripts/fetch_products_json.py.
+-- Prices are numeric so analytics can aggregate them without parsing products.raw_json.
+
+create table if not exists public.product_variants (
+    domain text not null,
+    variant_id bigint not null,
+    product_id bigint not null,
+    title text,
+    sku text,
+    position integer,
+    option1 text,
+    option2 text,
+    option3 text,
+    price numeric(12, 2),
+    compare_at_price numeric(12, 2),
+    available boolean,
+    requires_shipping boolean,
+    taxable boolean,
+    grams integer,
+    created_at timestamptz,
+    updated_at timestamptz,
+    fetched_at timestamptz,
+    primary key (domain, variant_id)
+);
+
+create index if not exists product_variants_product_idx
+    on public.product_variants (domain, product_id);
+create index if not exists product_variants_price_idx
+    on public.product_variants (domain, price);
+
+create table if not exists public.product_options (
+    domain text not null,
+    product_id bigint not null,
+    position integer not null,
+    name text,
+    "values" text[],
+    primary key (domain, product_id, position)
+);
+
+alter table public.product_variants enable row level security;
+alter table public.product_options enable row level security;
+
+create policy "Public read access" on public.product_variants for select using (true);
+create policy "Public read access" on public.product_options for select using (true);
+
+-- Backfill from the raw JSON already stored on products
+insert into public.product_variants (
+    domain, variant_id, product_id, title, sku, position, option1, option2, option3,
+    price, compare_at_price, available, requires_shipping, taxable, grams,
+    created_at, updated_at, fetched_at
+)
+select
+    p.domain,
+    (v ->> 'id')::bigint,
+    p.product_id,
+    v ->> 'title',
+    v ->> 'sku',
+    (v ->> 'position')::integer,
+    v ->> 'option1',
+    v ->> 'option2',
+    v ->> 'option3',
+    nullif(v ->> 'price', '')::numeric,
+    nullif(v ->> 'compare_at_price', '')::numeric,
+    (v ->> 'available')::boolean,
+    (v ->> 'requires_shipping')::boolean,
+    (v ->> 'taxable')::boolean,
+    (v ->> 'grams')::integer,
+    (v ->> 'created_at')::timestamptz,
+    (v ->> 'updated_at')::timestamptz,
+    p.fetched_at
+from public.products p
+cross join lateral jsonb_array_elements(coalesce(p.raw_json -> 'variants', '[]'::jsonb)) as v
+where v ? 'id'
+on conflict (domain, variant_id) do nothing;
+
+insert into public.product_options (domain, product_id, position, name, "values")
+select
+    p.domain,
+    p.product_id,
+    coalesce((opt.value ->> 'position')::integer, opt.ordinality::integer),
+    opt.value ->> 'name',
+    array(select jsonb_array_elements_text(coalesce(opt.value -> 'values', '[]'::jsonb)))
+from public.products p
+cross join lateral jsonb_array_elements(coalesce(p.raw_json -> 'options', '[]'::jsonb))
+    with ordinality as opt(value, ordinality)
+on conflict (domain, product_id, position) do nothing;
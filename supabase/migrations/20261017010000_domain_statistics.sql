@@ -0,0 +1,45 @@
+-- Per-domain catalogue statistics in one set-based pass, used by scripts/populate_domains.py.
+-- Every requested domain gets a row; domains without products report zero counts.
+
+create or replace function public.domain_statistics(domain_list text[])
+returns table (
+    domain text,
+    product_count bigint,
+    vendor_count bigint,
+    product_types text[],
+    price_range_min numeric,
+    price_range_max numeric
+)
+language sql
+stable
+as $$
+    with requested as (
+        select distinct unnest(domain_list) as domain
+    ),
+    product_stats as (
+        select
+            p.domain,
+            count(*) as product_count,
+            count(distinct nullif(p.vendor, '')) as vendor_count,
+            array_agg(distinct p.product_type) filter (where p.product_type <> '') as product_types
+        from public.products p
+        where p.domain = any (domain_list)
+        group by p.domain
+    ),
+    price_stats as (
+        select v.domain, min(v.price) as price_range_min, max(v.price) as price_range_max
+        from public.product_variants v
+        where v.domain = any (domain_list)
+        group by v.domain
+    )
+    select
+        r.domain,
+        coalesce(ps.product_count, 0),
+        coalesce(ps.vendor_count, 0),
+        ps.product_types,
+        pr.price_range_min,
+        pr.price_range_max
+    from requested r
+    left join product_stats ps on ps.domain = r.domain
+    left join price_stats pr on pr.domain = r.domain;
+$$;
@@ -0,0 +1,6 @@
+-- Keyset pagination over products still missing an embedding (scripts/embeddings_create.py).
+-- The partial index only holds the backlog, so it shrinks as rows get embedded.
+
+create index if not exists products_embedding_missing_idx
+    on public.products (domain, product_id)
+    where embedding is null;
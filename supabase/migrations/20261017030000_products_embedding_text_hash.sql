@@ -0,0 +1,5 @@
+-- Hash of the fields an embedding was computed from (scripts/embedding_text.py).
+-- Products whose hash no longer matches their current fields get re-embedded.
+
+alter table public.products
+    add column if not exists embedding_text_hash text;
@@ -0,0 +1,40 @@
+-- Denormalized search projection written at ingest by scripts/product_rows.py (search_projection).
+-- Search, listing and collection pages can select these narrow columns instead of digging
+-- images[0].src and variant prices out of products.raw_json.
+
+alter table public.products
+    add column if not exists image_src text,
+    add column if not exists price_min numeric(12, 2),
+    add column if not exists price_max numeric(12, 2),
+    add column if not exists currency text,
+    add column if not exists available boolean,
+    add column if not exists title_short text;
+
+-- Backfill from the stored variants and raw JSON; re-crawled products are rewritten by the crawler
+update public.products p
+set
+    image_src = coalesce(p.raw_json -> 'images' -> 0 ->> 'src', p.raw_json -> 'image' ->> 'src'),
+    price_min = v.price_min,
+    price_max = v.price_max,
+    currency = coalesce(
+        p.raw_json -> 'variants' -> 0 ->> 'price_currency',
+        p.raw_json -> 'variants' -> 0 -> 'presentment_prices' -> 0 -> 'price' ->> 'currency_code'
+    ),
+    available = v.available,
+    title_short = case
+        when length(t.title) > 80 then left(t.title, 79) || '…'
+        else t.title
+    end
+from public.products p2
+cross join lateral (
+    select nullif(btrim(regexp_replace(p2.title, '\s+', ' ', 'g')), '') as title
+) t
+left join lateral (
+    select min(pv.price) as price_min, max(pv.price) as price_max, bool_or(pv.available) as available
+    from public.product_variants pv
+    where pv.domain = p2.domain and pv.product_id = p2.product_id
+) v on true
+where p.domain = p2.domain and p.product_id = p2.product_id;
+
+create index if not exists products_domain_price_min_idx
+    on public.products (domain, price_min);
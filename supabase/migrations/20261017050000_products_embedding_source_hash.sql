@@ -0,0 +1,68 @@
+-- Fingerprint of every field an embedding can be composed from (scripts/embedding_text.py,
+-- SOURCE_FIELDS), maintained by a trigger whenever products are written. The embedding backfill
+-- compares it with embedding_text_hash through a partial index instead of hashing every
+-- product's raw_json on each run. The model and field list an embedding was made with are
+-- recorded separately in embedding_config.
+
+alter table public.products
+    add column if not exists embedding_source_hash text,
+    add column if not exists embedding_config text;
+
+create or replace function public.products_embedding_source_hash()
+returns trigger
+language plpgsql
+as $$
+begin
+    new.embedding_source_hash := md5(concat_ws(E'\x1f',
+        coalesce(new.title, ''),
+        coalesce(new.vendor, ''),
+        coalesce(new.product_type, ''),
+        coalesce(array_to_string(new.tags, ', '), ''),
+        coalesce(new.raw_json ->> 'body_html', '')
+    ));
+    return new;
+end;
+$$;
+
+drop trigger if exists products_embedding_source_hash on public.products;
+create trigger products_embedding_source_hash
+    before insert or update of title, vendor, product_type, tags, raw_json on public.products
+    for each row execute function public.products_embedding_source_hash();
+
+-- Backfill the fingerprint of existing products
+update public.products
+set embedding_source_hash = md5(concat_ws(E'\x1f',
+    coalesce(title, ''),
+    coalesce(vendor, ''),
+    coalesce(product_type, ''),
+    coalesce(array_to_string(tags, ', '), ''),
+    coalesce(raw_json ->> 'body_html', '')
+));
+
+-- embedding_text_hash used to be md5(config || fields). Embeddings made with the default model
+-- and fields move to the new columns; any others fall into the backlog and are re-embedded once.
+update public.products
+set
+    embedding_config = 'sentence-transformers/all-MiniLM-L6-v2|title,vendor,product_type,tags,body_html|v1|',
+    embedding_text_hash = embedding_source_hash
+where embedding is not null
+  and embedding_text_hash = md5(
+      'sentence-transformers/all-MiniLM-L6-v2|title,vendor,product_type,tags,body_html|v1|'
+      || concat_ws(E'\x1f',
+          coalesce(title, ''),
+          coalesce(vendor, ''),
+          coalesce(product_type, ''),
+          coalesce(array_to_string(tags, ', '), ''),
+          coalesce(raw_json ->> 'body_html', '')
+      )
+  );
+
+-- The backlog is now missing or stale embeddings, not only missing ones
+drop index if exists public.products_embedding_missing_idx;
+create index if not exists products_embedding_backlog_idx
+    on public.products (domain, product_id)
+    where embedding is null or embedding_text_hash is distinct from embedding_source_hash;
+
+-- Finds embeddings made with another model or field list without a table scan
+create index if not exists products_embedding_config_idx
+    on public.products (embedding_config);
@@ -0,0 +1,118 @@
+"""ContentHashIndex.diff: only inserted and changed rows are written, vanished keys are deleted."""
+
+import copy
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+from content_hashes import IMAGE, PRODUCT, ContentHashIndex, content_hash  # noqa: E402
+from product_rows import build_rows  # noqa: E402
+
+DOMAIN = "example.com"
+
+
+def product(product_id: int, price: str = "10.00", title: str = "Soap") -> dict:
+    return {
+        "id": product_id,
+        "title": title,
+        "tags": ["a"],
+        "variants": [{"id": product_id * 10, "price": price, "available": True}],
+        "options": [{"name": "Size", "position": 1, "values": ["One"]}],
+        "images": [{"id": product_id * 100, "src": f"https://cdn.example/{product_id}.jpg"}],
+    }
+
+
+class ContentHashTest(unittest.TestCase):
+    def test_hash_is_pinned(self) -> None:
+        # Changing the encoding or the digest would make every stored hash look changed
+        row = {"domain": "a.com", "product_id": 1, "title": "Soap", "price": "1.50", "tags": ["x", "y"]}
+        self.assertEqual(content_hash(row), "55d3a670e16c089bd1f1ca7c800396da")
+
+    def test_fetched_at_and_key_order_are_ignored(self) -> None:
+        row = {"domain": "a.com", "product_id": 1, "fetched_at": "2024-01-01"}
+        reordered = {"fetched_at": "2025-06-30", "product_id": 1, "domain": "a.com"}
+        self.assertEqual(content_hash(row), content_hash(reordered))
+
+
+class DiffTest(unittest.TestCase):
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.index = ContentHashIndex(os.path.join(directory.name, "hashes.sqlite"))
+        self.addCleanup(self.index.close)
+
+    def crawl(self, products: list, fetched_at: str = "2024-01-01T00:00:00+00:00", write_all: bool = False):
+        diff = self.index.diff(DOMAIN, build_rows(products, DOMAIN, fetched_at=fetched_at), write_all=write_all)
+        self.index.commit(DOMAIN, diff.hashes)
+        return diff
+
+    def test_first_crawl_inserts_everything(self) -> None:
+        diff = self.crawl([product(1), product(2)])
+        self.assertEqual((diff.inserted, diff.changed, diff.unchanged, diff.deleted), (2, 0, 0, 0))
+        self.assertEqual(len(diff.batch.product_rows), 2)
+        self.assertEqual(len(diff.batch.variant_rows), 2)
+        self.assertEqual(len(diff.batch.option_rows), 2)
+        self.assertEqual(len(diff.batch.image_rows), 2)
+        self.assertEqual(set(diff.hashes), {(PRODUCT, 1), (PRODUCT, 2), (IMAGE, 100), (IMAGE, 200)})
+
+    def test_unchanged_recrawl_writes_nothing(self) -> None:
+        self.crawl([product(1), product(2)])
+        diff = self.crawl([product(1), product(2)], fetched_at="2024-02-01T00:00:00+00:00")
+        self.assertEqual((diff.inserted, diff.changed, diff.unchanged, diff.deleted), (0, 0, 2, 0))
+        self.assertEqual(len(diff.batch), 0)
+
+    def test_changed_variant_rewrites_its_product_with_all_children(self) -> None:
+        self.crawl([product(1), product(2)])
+        diff = self.crawl([product(1, price="12.00"), product(2)])
+        self.assertEqual((diff.inserted, diff.changed, diff.unchanged), (0, 1, 1))
+        self.assertEqual([row["product_id"] for row in diff.batch.product_rows], [1])
+        self.assertEqual([row["variant_id"] for row in diff.batch.variant_rows], [10])
+        self.assertEqual([row["product_id"] for row in diff.batch.option_rows], [1])
+        self.assertEqual(diff.batch.image_rows, [])
+
+    def test_changed_image_is_written(self) -> None:
+        self.crawl([product(1), product(2)])
+        edited = product(1)
+        edited["images"][0]["src"] = "https://cdn.example/new.jpg"
+        diff = self.crawl([edited, product(2)])
+        self.assertEqual([row["image_id"] for row in diff.batch.image_rows], [100])
+        # The product's raw_json and image_src carry the image too
+        self.assertEqual([row["product_id"] for row in diff.batch.product_rows], [1])
+
+    def test_vanished_rows_are_deleted(self) -> None:
+        self.crawl([product(1), product(2)])
+        diff = self.crawl([product(1)])
+        self.assertEqual(diff.deleted, 1)
+        self.assertEqual(diff.batch.product_deletes, [(DOMAIN, 2)])
+        self.assertEqual(diff.batch.image_deletes, [(DOMAIN, 200)])
+
+    def test_write_all_keeps_every_row(self) -> None:
+        self.crawl([product(1), product(2)])
+        diff = self.crawl([product(1), product(2)], write_all=True)
+        self.assertEqual(diff.unchanged, 2)
+        self.assertEqual(len(diff.batch.product_rows), 2)
+        self.assertEqual(len(diff.batch.image_rows), 2)
+
+    def test_domains_are_independent(self) -> None:
+        self.crawl([product(1)])
+        other = self.index.diff("other.com", build_rows([product(1)], "other.com"))
+        self.assertEqual((other.inserted, other.deleted), (1, 0))
+
+    def test_diff_does_not_touch_the_batch_rows(self) -> None:
+        batch = build_rows([product(1)], DOMAIN)
+        before = copy.deepcopy(batch)
+        self.index.diff(DOMAIN, batch)
+        self.assertEqual(batch, before)
+
+    def test_forget_drops_a_domains_hashes(self) -> None:
+        self.crawl([product(1)])
+        self.index.forget([DOMAIN])
+        self.assertEqual(self.index.domains(), [])
+        self.assertEqual(self.crawl([product(1)]).inserted, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+"""with_sslmode: SSL is required for remote servers only, decided on the exact host."""
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+from db import with_sslmode  # noqa: E402
+
+
+class WithSslmodeTest(unittest.TestCase):
+    def setUp(self) -> None:
+        patcher = mock.patch.dict(os.environ)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        os.environ.pop("PGHOST", None)
+
+    def test_local_servers_are_left_alone(self) -> None:
+        for url in (
+            "postgresql://localhost/db",
+            "postgresql:///db",
+            "postgresql://u:p@localhost:5432/db",
+            "postgresql://u:p@127.0.0.1/db",
+            "postgresql://u:p@[::1]/db",
+            "postgresql:///db?host=/var/run/postgresql",
+            "host=localhost dbname=db",
+            "dbname=db",
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(with_sslmode(url), url)
+
+    def test_remote_servers_require_ssl(self) -> None:
+        self.assertEqual(with_sslmode("postgresql://u:p@db.example.com/db"),
+                         "postgresql://u:p@db.example.com/db?sslmode=require")
+        self.assertEqual(with_sslmode("postgresql://u@db.example.com/db?connect_timeout=5"),
+                         "postgresql://u@db.example.com/db?connect_timeout=5&sslmode=require")
+        self.assertEqual(with_sslmode("host=db.example.com dbname=db"),
+                         "host=db.example.com dbname=db sslmode=require")
+
+    def test_host_is_matched_exactly(self) -> None:
+        self.assertEqual(with_sslmode("postgresql://u:p@localhost.evil.com/x"),
+                         "postgresql://u:p@localhost.evil.com/x?sslmode=require")
+        # One remote host in a multi-host URL is enough
+        self.assertEqual(with_sslmode("postgresql://localhost,db.example.com/x"),
+                         "postgresql://localhost,db.example.com/x?sslmode=require")
+
+    def test_explicit_sslmode_is_kept(self) -> None:
+        url = "postgresql://u@db.example.com/db?sslmode=disable"
+        self.assertEqual(with_sslmode(url), url)
+
+    def test_pghost_stands_in_for_a_missing_host(self) -> None:
+        os.environ["PGHOST"] = "db.example.com"
+        self.assertEqual(with_sslmode("postgresql:///db"), "postgresql:///db?sslmode=require")
+
+
+if __name__ == "__main__":
+    unittest.main()
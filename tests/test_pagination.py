@@ -0,0 +1,91 @@
+"""Paginator against simulated stores that honour since_id and page to varying degrees."""
+
+import os
+import random
+import sys
+import unittest
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+from pagination import PAGE, SINCE_ID, Paginator  # noqa: E402
+
+
+class FakeStore:
+    """products.json of one store.
+
+    `since_id_requests` is how many requests honour since_id before the store starts
+    ignoring it (None: always honoured); `honours_page=False` serves page 1 forever.
+    """
+
+    def __init__(self, count: int, since_id_requests: Optional[int] = None, honours_page: bool = True,
+                 shuffled: bool = False) -> None:
+        self.order = list(range(1, count + 1))
+        if shuffled:
+            random.Random(count).shuffle(self.order)
+        self.since_id_requests = since_id_requests
+        self.honours_page = honours_page
+        self.requests = 0
+
+    def get(self, query: str) -> List[Dict[str, Any]]:
+        self.requests += 1
+        params = {key: int(values[0]) for key, values in parse_qs(query).items()}
+        limit = params["limit"]
+        honoured = self.since_id_requests is None or self.requests <= self.since_id_requests
+        if "since_id" in params and honoured:
+            ids = sorted(i for i in self.order if i > params["since_id"])[:limit]
+        else:
+            page = params.get("page", 1) if self.honours_page else 1
+            ids = self.order[(page - 1) * limit:page * limit]
+        return [{"id": i} for i in ids]
+
+
+def crawl(store: FakeStore, per_page: int = 250, strategy: Optional[str] = None) -> Paginator:
+    pager = Paginator(strategy, per_page=per_page)
+    while pager.advance(store.get(pager.query())):
+        if pager.requests > 100:
+            raise AssertionError("pagination did not terminate")
+    return pager
+
+
+class PaginatorTest(unittest.TestCase):
+    def assert_complete(self, pager: Paginator, count: int) -> None:
+        ids = [product["id"] for product in pager.products]
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(sorted(ids), list(range(1, count + 1)))
+
+    def test_since_id(self) -> None:
+        pager = crawl(FakeStore(1000))
+        self.assert_complete(pager, 1000)
+        self.assertEqual(pager.detected, SINCE_ID)
+
+    def test_since_id_ignored_from_the_start(self) -> None:
+        pager = crawl(FakeStore(1000, since_id_requests=1))
+        self.assert_complete(pager, 1000)
+        self.assertEqual(pager.detected, PAGE)
+
+    def test_since_id_ignored_after_two_pages(self) -> None:
+        # The restart at page 1 replays pages that add nothing new; they must not end the walk
+        for shuffled in (False, True):
+            with self.subTest(shuffled=shuffled):
+                pager = crawl(FakeStore(1000, since_id_requests=2, shuffled=shuffled))
+                self.assert_complete(pager, 1000)
+                self.assertEqual(pager.detected, PAGE)
+
+    def test_page_strategy(self) -> None:
+        self.assert_complete(crawl(FakeStore(1000), strategy=PAGE), 1000)
+
+    def test_page_ignored_stops(self) -> None:
+        pager = crawl(FakeStore(1000, honours_page=False), strategy=PAGE)
+        self.assertEqual(len(pager.products), 250)
+        self.assertEqual(pager.requests, 2)
+
+    def test_short_catalogue(self) -> None:
+        pager = crawl(FakeStore(7))
+        self.assert_complete(pager, 7)
+        self.assertEqual(pager.requests, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
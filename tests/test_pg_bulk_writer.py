@@ -0,0 +1,123 @@
+"""PostgresBulkWriter: COPY line encoding, and the COPY + merge against a real Postgres.
+
+The database tests run when TEST_DATABASE_URL points at a scratch Postgres (a local
+one is fine); they work in their own schema and drop it afterwards.
+"""
+
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+from pg_bulk_writer import PostgresBulkWriter, _copy_line  # noqa: E402
+
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+SCHEMA = "bulk_writer_test"
+
+AWKWARD = "tab\there, new\nline, back\\slash, \\u0000 literal, quote \" and ünïcode"
+
+
+def _unescape_copy(line: bytes) -> bytes:
+    """Undo COPY text-format escaping of a single-column line."""
+    out, i = bytearray(), 0
+    while i < len(line):
+        if line[i:i + 1] == b"\\":
+            out += {b"n": b"\n", b"t": b"\t", b"r": b"\r", b"\\": b"\\"}[line[i + 1:i + 2]]
+            i += 2
+        else:
+            out += line[i:i + 1]
+            i += 1
+    return bytes(out)
+
+
+class CopyLineTest(unittest.TestCase):
+    def test_one_line_per_row(self) -> None:
+        line = _copy_line({"title": AWKWARD})
+        self.assertTrue(line.endswith(b"\n"))
+        self.assertNotIn(b"\n", line[:-1])
+        self.assertNotIn(b"\t", line)
+        self.assertNotIn(b"\x00", line)
+
+    def test_round_trips_through_copy_escaping(self) -> None:
+        row = {"domain": "a.com", "product_id": 1, "title": AWKWARD, "tags": ["x\\y", "z\n"]}
+        self.assertEqual(json.loads(_unescape_copy(_copy_line(row)[:-1])), row)
+
+    def test_nul_characters_are_dropped(self) -> None:
+        # jsonb rejects \u0000 but an escaped backslash before a literal "u0000" is text
+        row = {"title": "a\x00b", "body": "c\\\x00d", "literal": "\\u0000"}
+        self.assertEqual(json.loads(_unescape_copy(_copy_line(row)[:-1])),
+                         {"title": "ab", "body": "c\\d", "literal": "\\u0000"})
+
+
+@unittest.skipUnless(TEST_DATABASE_URL, "TEST_DATABASE_URL is not set")
+class MergeTest(unittest.TestCase):
+    COLUMNS = ["domain", "product_id", "title", "tags"]
+    KEY = ["domain", "product_id"]
+
+    def setUp(self) -> None:
+        self.writer = PostgresBulkWriter(TEST_DATABASE_URL, pool_size=1, schema=SCHEMA)
+        self.addCleanup(self.writer.close)
+        self._execute(f"""
+            DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;
+            CREATE SCHEMA {SCHEMA};
+            CREATE TABLE {SCHEMA}.products (
+                domain text NOT NULL,
+                product_id bigint NOT NULL,
+                title text,
+                tags text[],
+                untouched text DEFAULT 'kept',
+                PRIMARY KEY (domain, product_id)
+            );
+        """)
+        self.addCleanup(self._execute, f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+
+    def _execute(self, statement: str) -> list:
+        conn = self.writer.pool.getconn()
+        try:
+            with conn, conn.cursor() as cur:
+                cur.execute(statement)
+                return cur.fetchall() if cur.description else []
+        finally:
+            self.writer.pool.putconn(conn)
+
+    def _load(self, rows: list) -> None:
+        conn = self.writer.pool.getconn()
+        try:
+            with conn, conn.cursor() as cur:
+                self.writer._load(cur, "products", rows, self.COLUMNS, self.KEY)
+        finally:
+            self.writer.pool.putconn(conn)
+
+    def _rows(self) -> list:
+        return self._execute(
+            f"SELECT domain, product_id, title, tags, untouched FROM {SCHEMA}.products ORDER BY 1, 2")
+
+    def test_inserts_and_updates_in_one_statement(self) -> None:
+        self._load([{"domain": "a.com", "product_id": 1, "title": "old", "tags": ["x"]}])
+        self._execute(f"UPDATE {SCHEMA}.products SET untouched = 'edited'")
+        self._load([
+            {"domain": "a.com", "product_id": 1, "title": "new", "tags": None},
+            {"domain": "b.com", "product_id": 1, "title": "other", "tags": []},
+        ])
+        self.assertEqual(self._rows(), [
+            ("a.com", 1, "new", None, "edited"),
+            ("b.com", 1, "other", [], "kept"),
+        ])
+
+    def test_last_staged_copy_of_a_key_wins(self) -> None:
+        self._load([
+            {"domain": "a.com", "product_id": 1, "title": "first", "tags": None},
+            {"domain": "a.com", "product_id": 1, "title": "second", "tags": None},
+        ])
+        self.assertEqual([row[2] for row in self._rows()], ["second"])
+
+    def test_awkward_text_survives_copy(self) -> None:
+        self._load([{"domain": "a.com", "product_id": 1, "title": AWKWARD + "\x00!", "tags": ["t\\1", "t\n2"]}])
+        self.assertEqual(self._rows(), [("a.com", 1, AWKWARD + "!", ["t\\1", "t\n2"], "kept")])
+
+
+if __name__ == "__main__":
+    unittest.main()
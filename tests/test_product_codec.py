@@ -0,0 +1,84 @@
+"""product_codec: every installed backend writes the stdlib's bytes, so hashes survive a backend switch."""
+
+import json
+import os
+import sys
+import unittest
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+from product_codec import Codec, available_backends  # noqa: E402
+from product_rows import build_rows  # noqa: E402
+
+PRODUCT = {
+    "id": 7654321098765,
+    "title": "Lavender Soap – «handmade» 🧼",
+    "handle": "lavender-soap",
+    "body_html": "<p>Line one\nline two\t\"quoted\" \\ back\\slash </script>   \x7f \x01</p>",
+    "vendor": "Ünïcode & Co",
+    "product_type": "",
+    "tags": ["gift", "vegan", "日本語"],
+    "published_at": "2024-01-01T00:00:00-05:00",
+    "updated_at": "2024-02-01T12:30:00+01:00",
+    "variants": [
+        {"id": 1, "price": "12.50", "compare_at_price": None, "available": True, "grams": 100,
+         "option1": "Small", "option2": None, "position": 1, "taxable": False},
+        {"id": 2, "price": "0.99", "compare_at_price": "1.00", "available": False, "grams": 0,
+         "option1": "Large", "option2": None, "position": 2, "taxable": True},
+    ],
+    "images": [{"id": 11, "src": "https://cdn.example/a.jpg?v=1&w=2", "width": 800, "height": 600,
+                "alt": None, "variant_ids": []}],
+    "options": [{"name": "Size", "position": 1, "values": ["Small", "Large"]}],
+    "nested": {"z": 1, "a": [1.5, -0.25, 3.0, 10, -7], "m": {"empty": {}, "list": []}},
+}
+
+
+def reference(obj, sort_keys: bool = False) -> bytes:
+    return json.dumps(obj, sort_keys=sort_keys, ensure_ascii=False, separators=(",", ":"),
+                      default=str).encode("utf-8")
+
+
+class CodecParityTest(unittest.TestCase):
+    def test_stdlib_is_always_available(self) -> None:
+        self.assertIn("json", available_backends())
+
+    def test_products_encode_like_the_stdlib(self) -> None:
+        for backend in available_backends():
+            codec = Codec(backend)
+            with self.subTest(backend=backend):
+                self.assertEqual(codec.dumps(PRODUCT), reference(PRODUCT))
+                self.assertEqual(codec.dumps(PRODUCT, sort_keys=True), reference(PRODUCT, sort_keys=True))
+
+    def test_database_rows_encode_like_the_stdlib(self) -> None:
+        batch = build_rows([PRODUCT], "example.com", fetched_at="2024-03-01T00:00:00+00:00")
+        rows = batch.product_rows + batch.variant_rows + batch.image_rows + batch.option_rows
+        for backend in available_backends():
+            codec = Codec(backend)
+            for row in rows:
+                with self.subTest(backend=backend, row=row.get("product_id")):
+                    self.assertEqual(codec.dumps(row, sort_keys=True), reference(row, sort_keys=True))
+
+    def test_values_a_fast_backend_cannot_encode_fall_back(self) -> None:
+        awkward = {"big": 2 ** 70, "price": Decimal("19.90"), "negative": -2 ** 65}
+        for backend in available_backends():
+            with self.subTest(backend=backend):
+                self.assertEqual(Codec(backend).dumps(awkward), reference(awkward))
+
+    def test_decoding_matches_the_stdlib(self) -> None:
+        page = reference({"products": [PRODUCT], "extra": {"ignored": True}})
+        for backend in available_backends():
+            codec = Codec(backend)
+            with self.subTest(backend=backend):
+                self.assertEqual(codec.loads(page), json.loads(page))
+                self.assertEqual(codec.decode_products(page), [PRODUCT])
+                self.assertEqual(codec.decode_products(b'{"products": [{"price": NaN}]}')[0].keys(), {"price"})
+                self.assertEqual(codec.decode_products(b"[]"), [])
+
+    def test_unknown_backend_is_rejected(self) -> None:
+        with self.assertRaises(RuntimeError):
+            Codec("simdjson")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+"""build_rows: the row shapes both persistence paths write."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+from product_rows import (  # noqa: E402
+    IMAGE_COLUMNS, OPTION_COLUMNS, PRODUCT_COLUMNS, VARIANT_COLUMNS, TITLE_SHORT_CHARS, build_rows, parse_price,
+)
+
+FETCHED_AT = "2024-03-01T00:00:00+00:00"
+
+
+def product(**overrides) -> dict:
+    base = {
+        "id": 1,
+        "title": "Soap",
+        "handle": "soap",
+        "vendor": "Acme",
+        "tags": ["a", "b"],
+        "variants": [
+            {"id": 10, "price": "12.50", "compare_at_price": None, "available": False, "position": 1,
+             "price_currency": "EUR"},
+            {"id": 11, "price": 9.9, "compare_at_price": "15", "available": True, "position": 2},
+        ],
+        "images": [{"id": 100, "src": "https://cdn.example/1.jpg", "position": 1},
+                   {"id": 101, "src": "https://cdn.example/2.jpg", "position": 2}],
+        "options": [{"name": "Size", "position": 1, "values": ["S", "L"]}, {"name": "Colour", "values": ["Red"]}],
+    }
+    base.update(overrides)
+    return base
+
+
+class ParsePriceTest(unittest.TestCase):
+    def test_numeric_strings_and_numbers(self) -> None:
+        self.assertEqual(parse_price("19.90"), "19.90")
+        self.assertEqual(parse_price(19.9), "19.9")
+        self.assertEqual(parse_price(5), "5")
+        self.assertEqual(parse_price("0"), "0")
+
+    def test_missing_or_malformed_prices_are_none(self) -> None:
+        for value in (None, "", "free", "NaN", "Infinity", "-inf"):
+            with self.subTest(value=value):
+                self.assertIsNone(parse_price(value))
+
+
+class BuildRowsTest(unittest.TestCase):
+    def test_rows_have_exactly_the_table_columns(self) -> None:
+        batch = build_rows([product()], "a.com", fetched_at=FETCHED_AT)
+        for rows, columns in ((batch.product_rows, PRODUCT_COLUMNS), (batch.image_rows, IMAGE_COLUMNS),
+                              (batch.variant_rows, VARIANT_COLUMNS), (batch.option_rows, OPTION_COLUMNS)):
+            for row in rows:
+                self.assertEqual(list(row), columns)
+
+    def test_product_row_and_search_projection(self) -> None:
+        row = build_rows([product()], "a.com", fetched_at=FETCHED_AT).product_rows[0]
+        self.assertEqual((row["domain"], row["product_id"], row["fetched_at"]), ("a.com", 1, FETCHED_AT))
+        self.assertEqual((row["price_min"], row["price_max"]), ("9.9", "12.50"))
+        self.assertEqual(row["currency"], "EUR")
+        self.assertTrue(row["available"])
+        self.assertEqual(row["image_src"], "https://cdn.example/1.jpg")
+        self.assertEqual(row["title_short"], "Soap")
+
+    def test_variant_prices_are_parsed(self) -> None:
+        variants = build_rows([product()], "a.com").variant_rows
+        self.assertEqual([(v["variant_id"], v["price"], v["compare_at_price"]) for v in variants],
+                         [(10, "12.50", None), (11, "9.9", "15")])
+
+    def test_options_default_their_position(self) -> None:
+        options = build_rows([product()], "a.com").option_rows
+        self.assertEqual([(o["position"], o["name"]) for o in options], [(1, "Size"), (2, "Colour")])
+
+    def test_rows_without_ids_are_skipped_and_duplicates_collapse(self) -> None:
+        duplicate = product(id=2, variants=[{"id": 10, "price": "1"}], images=[{"id": 100}, {"src": "no-id"}])
+        batch = build_rows([product(), {"title": "no id"}, duplicate], "a.com")
+        self.assertEqual([row["product_id"] for row in batch.product_rows], [1, 2])
+        # The last listing of a variant or image wins
+        self.assertEqual(sorted((v["variant_id"], v["product_id"]) for v in batch.variant_rows), [(10, 2), (11, 1)])
+        self.assertEqual(sorted((i["image_id"], i["product_id"]) for i in batch.image_rows), [(100, 2), (101, 1)])
+
+    def test_raw_json_modes(self) -> None:
+        full = build_rows([product()], "a.com", raw_json="full")
+        self.assertEqual(full.product_rows[0]["raw_json"], product())
+        self.assertEqual(full.image_rows[0]["raw_json"]["id"], 100)
+
+        compact = build_rows([product()], "a.com", raw_json="compact")
+        self.assertEqual(set(compact.product_rows[0]["raw_json"]), {"variants", "options"})
+        self.assertIsNone(compact.image_rows[0]["raw_json"])
+
+        none = build_rows([product()], "a.com", raw_json="none")
+        self.assertIsNone(none.product_rows[0]["raw_json"])
+
+    def test_long_titles_are_shortened(self) -> None:
+        row = build_rows([product(title="word  " * 40)], "a.com").product_rows[0]
+        self.assertEqual(len(row["title_short"]), TITLE_SHORT_CHARS)
+        self.assertTrue(row["title_short"].endswith("…"))
+        self.assertNotIn("  ", row["title_short"])
+
+    def test_product_without_variants_or_images(self) -> None:
+        row = build_rows([product(variants=[], images=[])], "a.com").product_rows[0]
+        self.assertEqual((row["price_min"], row["currency"], row["available"], row["image_src"]),
+                         (None, None, None, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
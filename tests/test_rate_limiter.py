@@ -0,0 +1,161 @@
+"""AdaptiveRateLimiter: AIMD rate adaptation, 429 blocks, and when callers sleep or get Throttled."""
+
+import asyncio
+import os
+import sys
+import time
+import unittest
+from datetime import datetime, timedelta, UTC
+from email.utils import format_datetime
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+import rate_limiter  # noqa: E402
+from rate_limiter import AdaptiveRateLimiter, Throttled, parse_retry_after  # noqa: E402
+
+
+class FakeClock:
+    """Stands in for the time module: sleeping advances monotonic time instantly."""
+
+    def __init__(self) -> None:
+        # Ahead of the real clock, which stamps new token buckets (they start full anyway)
+        self.now = time.monotonic() + 60
+        self.slept = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class LimiterTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+        patcher = mock.patch.object(rate_limiter, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def limiter(self, **kwargs) -> AdaptiveRateLimiter:
+        limiter = AdaptiveRateLimiter(**kwargs)
+        # No DNS in tests; domains without a resolved IP have no IP bucket
+        limiter.resolve = lambda domain: limiter._resolved.setdefault(domain, None)
+        return limiter
+
+
+class AimdTest(LimiterTestCase):
+    def test_success_raises_the_rate_additively_up_to_the_cap(self) -> None:
+        limiter = self.limiter(domain_rate=1.0, max_domain_rate=1.2)
+        limiter.record_success("a.com")
+        self.assertAlmostEqual(limiter._domain("a.com").bucket.rate, 1.05)
+        for _ in range(10):
+            limiter.record_success("a.com")
+        self.assertAlmostEqual(limiter._domain("a.com").bucket.rate, 1.2)
+
+    def test_throttle_halves_the_rate_down_to_the_floor(self) -> None:
+        limiter = self.limiter(domain_rate=1.0, min_domain_rate=0.2)
+        limiter.record_throttle("a.com", "1")
+        self.assertAlmostEqual(limiter._domain("a.com").bucket.rate, 0.5)
+        for _ in range(5):
+            limiter.record_throttle("a.com", "1")
+        self.assertAlmostEqual(limiter._domain("a.com").bucket.rate, 0.2)
+        self.assertEqual(limiter.throttle_count, 6)
+
+    def test_domains_adapt_independently(self) -> None:
+        limiter = self.limiter(domain_rate=1.0)
+        limiter.record_throttle("a.com", "1")
+        self.assertAlmostEqual(limiter._domain("b.com").bucket.rate, 1.0)
+
+    def test_shared_ip_slows_down_gently(self) -> None:
+        limiter = self.limiter(ip_rate=100.0)
+        limiter._resolved.update({"a.com": "23.227.38.1", "b.com": "23.227.38.1"})
+        limiter.record_throttle("a.com", "1")
+        self.assertAlmostEqual(limiter._ip("b.com").rate, 80.0)
+        limiter.record_success("b.com")
+        self.assertAlmostEqual(limiter._ip("a.com").rate, 80.5)
+
+    def test_retry_after_blocks_the_domain(self) -> None:
+        limiter = self.limiter()
+        self.assertEqual(limiter.record_throttle("a.com", "30"), 30.0)
+        self.assertAlmostEqual(limiter.blocked_for("a.com"), 30.0)
+        self.assertAlmostEqual(limiter.reserve("a.com"), 30.0)
+        self.clock.now += 30
+        self.assertEqual(limiter.blocked_for("a.com"), 0.0)
+
+    def test_backoff_without_retry_after_grows_and_resets(self) -> None:
+        limiter = self.limiter()
+        delays = [limiter.record_throttle("a.com") for _ in range(3)]
+        for attempt, delay in enumerate(delays):
+            self.assertGreaterEqual(delay, 5.0 * 2 ** attempt * 0.5)
+            self.assertLessEqual(delay, 5.0 * 2 ** attempt * 1.5)
+        for _ in range(10):
+            limiter.record_throttle("a.com")
+        self.assertLessEqual(limiter.record_throttle("a.com"), 300.0 * 1.5)
+        limiter.record_success("a.com")
+        self.assertLessEqual(limiter.record_throttle("a.com"), 5.0 * 1.5)
+
+
+class PacingTest(LimiterTestCase):
+    def test_burst_then_paced_tokens(self) -> None:
+        limiter = self.limiter(domain_rate=2.0, domain_burst=2.0)
+        self.assertEqual(limiter.reserve("a.com"), 0.0)
+        self.assertEqual(limiter.reserve("a.com"), 0.0)
+        self.assertAlmostEqual(limiter.reserve("a.com"), 0.5)
+        self.clock.now += 0.5
+        self.assertEqual(limiter.reserve("a.com"), 0.0)
+
+    def test_wait_sleeps_through_slow_pacing_in_chunks(self) -> None:
+        limiter = self.limiter(domain_rate=0.1, domain_burst=1.0, max_wait=2.0)
+        limiter.wait("a.com")
+        limiter.wait("a.com")
+        self.assertAlmostEqual(sum(self.clock.slept), 10.0)
+        self.assertLessEqual(max(self.clock.slept), 2.0)
+
+    def test_wait_raises_while_a_429_block_lasts(self) -> None:
+        limiter = self.limiter(max_wait=2.0)
+        limiter.record_throttle("a.com", "30")
+        with self.assertRaises(Throttled) as caught:
+            limiter.wait("a.com")
+        self.assertFalse(caught.exception.rate_limited)
+        self.assertAlmostEqual(caught.exception.delay, 30.0)
+
+    def test_wait_sleeps_out_a_short_block(self) -> None:
+        limiter = self.limiter(max_wait=2.0)
+        limiter.record_throttle("a.com", "1")
+        limiter.wait("a.com")
+        self.assertAlmostEqual(sum(self.clock.slept), 1.0)
+
+    def test_acquire_matches_wait(self) -> None:
+        limiter = self.limiter(max_wait=2.0)
+
+        async def resolve_async(domain: str) -> None:
+            limiter._resolved.setdefault(domain, None)
+
+        limiter.resolve_async = resolve_async
+        limiter.record_throttle("a.com", "30")
+        with mock.patch.object(asyncio, "sleep", mock.AsyncMock()):
+            with self.assertRaises(Throttled):
+                asyncio.run(limiter.acquire("a.com"))
+            asyncio.run(limiter.acquire("b.com"))
+
+
+class ParseRetryAfterTest(unittest.TestCase):
+    def test_seconds(self) -> None:
+        self.assertEqual(parse_retry_after(" 120 "), 120.0)
+
+    def test_http_date(self) -> None:
+        later = format_datetime(datetime.now(UTC) + timedelta(seconds=60), usegmt=True)
+        self.assertAlmostEqual(parse_retry_after(later), 60.0, delta=2.0)
+        earlier = format_datetime(datetime.now(UTC) - timedelta(seconds=60), usegmt=True)
+        self.assertEqual(parse_retry_after(earlier), 0.0)
+
+    def test_missing_or_malformed(self) -> None:
+        for value in (None, "", "soon", "-5"):
+            with self.subTest(value=value):
+                self.assertIsNone(parse_retry_after(value))
+
+
+if __name__ == "__main__":
+    unittest.main()
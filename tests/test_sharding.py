@@ -0,0 +1,118 @@
+"""Shard assignment must never move a domain except through a change of N, and then minimally."""
+
+import argparse
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+import sharding  # noqa: E402
+
+DOMAINS = [f"store{i}.example" for i in range(5000)]
+
+
+def summary(shard: int, shards: int, finished_at: str, products: int = 10, failed=None) -> dict:
+    return {
+        "shard": shard, "shards": shards, "domains": 5, "skipped": 1, "successful": 3, "unchanged": 1,
+        "failed": failed or {}, "products": products, "throttles": 2, "output_files": 1,
+        "started_at": "2026-01-01T00:00:00+00:00", "finished_at": finished_at, "seconds": 60.0,
+    }
+
+
+class ShardOfTest(unittest.TestCase):
+    def test_jump_hash_reference_values(self) -> None:
+        # From the reference implementations of Lamping & Veach's algorithm
+        cases = [((1, 1), 0), ((42, 57), 43), ((0xDEAD10CC, 1), 0), ((0xDEAD10CC, 666), 361), ((256, 1024), 520)]
+        for (key, buckets), expected in cases:
+            self.assertEqual(sharding.jump_hash(key, buckets), expected)
+
+    def test_assignment_is_pinned(self) -> None:
+        # A different digest or key derivation would move every domain to another shard's state
+        expected = {
+            "shop1.com": [0, 0, 0, 0, 9],
+            "allbirds.com": [0, 1, 1, 7, 7],
+            "thesoapopera.com": [0, 1, 1, 1, 8],
+            "a.myshopify.com": [0, 0, 3, 3, 3],
+        }
+        for domain, shards in expected.items():
+            self.assertEqual([sharding.shard_of(domain, n) for n in (1, 2, 4, 8, 16)], shards, domain)
+
+    def test_domain_is_normalized(self) -> None:
+        self.assertEqual(sharding.shard_of(" Example.COM\n", 16), sharding.shard_of("example.com", 16))
+
+    def test_growing_n_only_moves_domains_to_the_new_shard(self) -> None:
+        for shards in (1, 3, 8):
+            moved = [d for d in DOMAINS if sharding.shard_of(d, shards) != sharding.shard_of(d, shards + 1)]
+            self.assertTrue(all(sharding.shard_of(d, shards + 1) == shards for d in moved))
+            self.assertAlmostEqual(len(moved) / len(DOMAINS), 1 / (shards + 1), delta=0.03)
+
+    def test_shards_partition_the_list_evenly(self) -> None:
+        parts = [sharding.select_shard(DOMAINS, (index, 8)) for index in range(8)]
+        self.assertEqual(sorted(d for part in parts for d in part), sorted(DOMAINS))
+        for part in parts:
+            self.assertAlmostEqual(len(part), len(DOMAINS) / 8, delta=len(DOMAINS) / 8 * 0.15)
+
+    def test_moved_away(self) -> None:
+        kept = sharding.select_shard(DOMAINS, (2, 5))
+        self.assertEqual(sharding.moved_away(DOMAINS, (2, 5)), [d for d in DOMAINS if d not in set(kept)])
+
+
+class ShardNamesTest(unittest.TestCase):
+    def test_parse_shard(self) -> None:
+        self.assertEqual(sharding.parse_shard("2/8"), (2, 8))
+        for value in ("8/8", "-1/4", "1/0", "1", "a/b"):
+            with self.assertRaises(argparse.ArgumentTypeError, msg=value):
+                sharding.parse_shard(value)
+
+    def test_state_paths_do_not_depend_on_n(self) -> None:
+        self.assertEqual(sharding.shard_path("crawl_state.sqlite", (2, 8)), "crawl_state.shard-02.sqlite")
+        self.assertEqual(sharding.shard_path("http_cache/", (2, 9)), "http_cache.shard-02")
+        self.assertEqual(sharding.shard_path("crawl_state.sqlite", None), "crawl_state.sqlite")
+
+    def test_outputs_carry_the_full_shard(self) -> None:
+        self.assertEqual(sharding.shard_tag((2, 8)), "shard-02-of-08")
+
+
+class MergeTest(unittest.TestCase):
+    def test_sums_the_shards(self) -> None:
+        merged = sharding.merge([
+            summary(0, 2, "2026-01-01T00:01:00+00:00", products=10, failed={"b.com": "500"}),
+            summary(1, 2, "2026-01-01T00:02:00+00:00", products=30, failed={"a.com": "timeout"}),
+        ])
+        self.assertEqual(merged["merged"], [0, 1])
+        self.assertEqual(merged["missing"], [])
+        self.assertEqual(merged["products"], 40)
+        self.assertEqual(merged["domains"], 10)
+        self.assertEqual(merged["throttles"], 4)
+        self.assertEqual(list(merged["failed"]), ["a.com", "b.com"])
+        self.assertEqual(merged["seconds"], 120.0)
+        self.assertAlmostEqual(merged["products_per_second"], 40 / 120)
+
+    def test_latest_summary_of_a_shard_wins_and_other_n_is_ignored(self) -> None:
+        merged = sharding.merge([
+            summary(0, 4, "2026-01-01T00:01:00+00:00", products=999),
+            summary(0, 3, "2026-01-01T00:02:00+00:00", products=1),
+            summary(0, 3, "2026-01-01T00:03:00+00:00", products=5),
+            summary(2, 3, "2026-01-01T00:04:00+00:00", products=7),
+        ])
+        self.assertEqual(merged["shards"], 3)
+        self.assertEqual(merged["merged"], [0, 2])
+        self.assertEqual(merged["missing"], [1])
+        self.assertEqual(merged["products"], 12)
+
+    def test_nothing_to_merge(self) -> None:
+        with self.assertRaises(ValueError):
+            sharding.merge([])
+
+    def test_summaries_round_trip_through_the_output_directory(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            written = [summary(index, 2, f"2026-01-01T00:0{index + 1}:00+00:00") for index in range(2)]
+            for part in written:
+                sharding.write_summary(directory, part)
+            self.assertEqual(sharding.load_summaries([directory]), written)
+
+
+if __name__ == "__main__":
+    unittest.main()